@@ -0,0 +1,252 @@
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from metrics import span
+from product_matching import TitleMatcher, match_pairs
+from products import Opportunity, Product
+
+PLATFORM_FEES = {
+    'wallapop': {'buy': 0.05, 'sell': 0.05},
+    'ebay': {'buy': 0.0, 'sell': 0.125},
+    'vinted': {'buy': 0.0, 'sell': 0.05},
+    'catawiki': {'buy': 0.09, 'sell': 0.09}
+}
+
+SHIPPING_COSTS = {
+    'wallapop': 5.0,
+    'ebay': 7.0,
+    'vinted': 6.0,
+    'catawiki': 8.0
+}
+
+PAYMENT_FEE = 0.03
+PACKAGING = 2.0
+TAX_RATE = 0.19
+MIN_MARKUP = 1.2
+MAX_PAIR_CELLS = 1_000_000
+
+def calculate_arbitrage_opportunity(buy_product: Product, sell_product: Product) -> Opportunity:
+    buy_platform = buy_product.platform
+    sell_platform = sell_product.platform
+
+    buy_price = buy_product.price
+    buy_commission = buy_price * PLATFORM_FEES[buy_platform]['buy']
+    buy_shipping = SHIPPING_COSTS[buy_platform]
+
+    sell_price = sell_product.price
+    sell_commission = sell_price * PLATFORM_FEES[sell_platform]['sell']
+    sell_shipping = SHIPPING_COSTS[sell_platform]
+    payment_fee = sell_price * PAYMENT_FEE
+
+    packaging = PACKAGING
+    taxes = (sell_price - buy_price) * TAX_RATE if sell_price > buy_price else 0
+
+    total_investment = buy_price + buy_commission + buy_shipping + packaging
+    total_costs = total_investment + sell_commission + sell_shipping + payment_fee + taxes
+    net_profit = sell_price - total_costs
+
+    roi_percent = (net_profit / total_investment * 100) if total_investment > 0 else 0
+    score = min(100, max(0, roi_percent))
+
+    return Opportunity(
+        buy=buy_product,
+        sell=sell_product,
+        net_profit=round(net_profit, 2),
+        roi_percent=round(roi_percent, 2),
+        score=round(score, 2),
+        total_investment=round(total_investment, 2),
+        buy_commission=round(buy_commission, 2),
+        buy_shipping=round(buy_shipping, 2),
+        sell_commission=round(sell_commission, 2),
+        sell_shipping=round(sell_shipping, 2),
+        payment_fee=round(payment_fee, 2),
+        packaging=round(packaging, 2),
+        taxes=round(taxes, 2)
+    )
+
+class ArbitrageEngine:
+    def __init__(self, fees: Dict[str, dict] = PLATFORM_FEES, shipping: Dict[str, float] = SHIPPING_COSTS,
+                 max_pair_cells: int = MAX_PAIR_CELLS):
+        self.platforms = [platform for platform in fees if platform in shipping]
+        self.fee_buy = np.array([fees[p]['buy'] for p in self.platforms], dtype=np.float64)
+        self.fee_sell = np.array([fees[p]['sell'] for p in self.platforms], dtype=np.float64)
+        self.shipping = np.array([shipping[p] for p in self.platforms], dtype=np.float64)
+        self.codes = {platform: code for code, platform in enumerate(self.platforms)}
+        self.max_pair_cells = max_pair_cells
+
+    def _evaluate(self, b: np.ndarray, s: np.ndarray, invest: np.ndarray, sell_code: int):
+        # Same operation order as calculate_arbitrage_opportunity so results match bit for bit
+        total_costs = invest + s * self.fee_sell[sell_code] + self.shipping[sell_code] + s * PAYMENT_FEE \
+            + np.where(s > b, (s - b) * TAX_RATE, 0.0)
+        net_profit = s - total_costs
+        with np.errstate(divide='ignore', invalid='ignore'):
+            roi = np.where(invest > 0, net_profit / invest * 100, 0.0)
+        roi_cents = round_cents(roi)
+        return (s > b * MIN_MARKUP) & (roi_cents > 0), roi_cents, round_cents(net_profit)
+
+    def _investment(self, buy_prices: np.ndarray, buy_code: int) -> np.ndarray:
+        return buy_prices + buy_prices * self.fee_buy[buy_code] + self.shipping[buy_code] + PACKAGING
+
+    def _pair_roi(self, buy_prices: np.ndarray, sell_prices: np.ndarray, buy_code: int, sell_code: int):
+        total_investment = self._investment(buy_prices, buy_code)
+        rows = max(1, self.max_pair_cells // max(1, len(sell_prices)))
+        for start in range(0, len(buy_prices), rows):
+            mask, roi_cents, net_cents = self._evaluate(buy_prices[start:start + rows, None], sell_prices[None, :],
+                                                        total_investment[start:start + rows, None], sell_code)
+            buy_idx, sell_idx = np.nonzero(mask)
+            yield buy_idx + start, sell_idx, roi_cents[buy_idx, sell_idx], net_cents[buy_idx, sell_idx], None
+
+    def _matched_roi(self, buy_prices: np.ndarray, sell_prices: np.ndarray, buy_code: int, sell_code: int,
+                     buy_titles: List[str], matcher: TitleMatcher, min_confidence: float):
+        buy_idx, sell_idx, confidence = match_pairs(buy_titles, matcher, min_confidence)
+        buy_idx = np.asarray(buy_idx, dtype=np.int64)
+        sell_idx = np.asarray(sell_idx, dtype=np.int64)
+        b = buy_prices[buy_idx]
+        mask, roi_cents, net_cents = self._evaluate(b, sell_prices[sell_idx], self._investment(b, buy_code), sell_code)
+        yield buy_idx[mask], sell_idx[mask], roi_cents[mask], net_cents[mask], np.asarray(confidence, dtype=np.float64)[mask]
+
+    def find_opportunities(self, buy_side: Dict[str, List[Product]], sell_side: Dict[str, List[Product]],
+                           top_k: Optional[int] = None, min_confidence: Optional[float] = None, **options) -> List[Opportunity]:
+        return self.find_page(buy_side, sell_side, top_k, min_confidence, **options)[0]
+
+    def find_page(self, buy_side: Dict[str, List[Product]], sell_side: Dict[str, List[Product]],
+                  top_k: Optional[int] = None, min_confidence: Optional[float] = None,
+                  sort_by: str = 'roi_percent', min_net_profit: Optional[float] = None,
+                  min_roi: Optional[float] = None,
+                  after: Optional[Tuple[int, str, str]] = None) -> Tuple[List[Opportunity], Optional[Tuple[int, str, str]]]:
+        # Keyed by list identity: the same platform can map to different lists on each side
+        prices = {}
+        def price_array(products: List[Product]) -> np.ndarray:
+            if id(products) not in prices:
+                prices[id(products)] = np.fromiter((p.price for p in products), dtype=np.float64, count=len(products))
+            return prices[id(products)]
+
+        # Ties are broken by (buy url, sell url) through their rank among every url in the search,
+        # so a cursor stays valid when the next request scrapes the results in a different order
+        urls = sorted({p.url or '' for side in (buy_side, sell_side) for products in side.values() for p in products})
+        url_rank = {url: i for i, url in enumerate(urls)}
+        ranks = {}
+        def rank_array(products: List[Product]) -> np.ndarray:
+            if id(products) not in ranks:
+                ranks[id(products)] = np.fromiter((url_rank[p.url or ''] for p in products), dtype=np.int64, count=len(products))
+            return ranks[id(products)]
+
+        with span('pairing'):
+            matchers = {}
+            pairs = []
+            pair_parts, buy_parts, sell_parts, roi_parts, net_parts, confidence_parts = [], [], [], [], [], []
+            buy_rank_parts, sell_rank_parts = [], []
+            for buy_platform, buy_products in buy_side.items():
+                for sell_platform, sell_products in sell_side.items():
+                    if buy_platform == sell_platform or not buy_products or not sell_products:
+                        continue
+                    if buy_platform not in self.codes or sell_platform not in self.codes:
+                        continue
+                    pair_id = len(pairs)
+                    pairs.append((buy_products, sell_products))
+                    buy_ranks, sell_ranks = rank_array(buy_products), rank_array(sell_products)
+                    buy_code, sell_code = self.codes[buy_platform], self.codes[sell_platform]
+                    if min_confidence:
+                        if sell_platform not in matchers:
+                            matchers[sell_platform] = TitleMatcher([p.title for p in sell_products])
+                        chunks = self._matched_roi(price_array(buy_products), price_array(sell_products), buy_code, sell_code,
+                                                   [p.title for p in buy_products], matchers[sell_platform], min_confidence)
+                    else:
+                        chunks = self._pair_roi(price_array(buy_products), price_array(sell_products), buy_code, sell_code)
+                    for buy_idx, sell_idx, roi, net, confidence in chunks:
+                        pair_parts.append(np.full(len(roi), pair_id, dtype=np.int32))
+                        buy_parts.append(buy_idx)
+                        sell_parts.append(sell_idx)
+                        buy_rank_parts.append(buy_ranks[buy_idx])
+                        sell_rank_parts.append(sell_ranks[sell_idx])
+                        roi_parts.append(roi)
+                        net_parts.append(net)
+                        confidence_parts.append(confidence)
+
+        if not roi_parts:
+            return [], None
+        roi = np.concatenate(roi_parts)
+        net = np.concatenate(net_parts)
+        pair_ids = np.concatenate(pair_parts)
+        buy_idx = np.concatenate(buy_parts)
+        sell_idx = np.concatenate(sell_parts)
+        buy_rank = np.concatenate(buy_rank_parts)
+        sell_rank = np.concatenate(sell_rank_parts)
+        confidence = np.concatenate(confidence_parts) if min_confidence else None
+
+        with span('sorting'):
+            key = net if sort_by == 'net_profit' else roi
+            # Candidates are ranked by (key desc, buy url, sell url); a cursor resumes after the last one returned
+            keep = np.ones(len(key), dtype=bool)
+            if min_net_profit is not None:
+                keep &= net >= min_net_profit * 100
+            if min_roi is not None:
+                keep &= roi >= min_roi * 100
+            if after is not None:
+                last_key, last_buy, last_sell = after
+                keep &= (key < last_key) | ((key == last_key) & _after_urls(urls, buy_rank, sell_rank, last_buy, last_sell))
+            candidates = np.flatnonzero(keep)
+
+            selected = candidates[top_k_indices(key[candidates], top_k)]
+            if len(selected):
+                # top_k_indices ranks by key alone; the whole tied group at the cut is re-ranked by url
+                tied = candidates[key[candidates] >= key[selected[-1]]]
+                order = np.lexsort((sell_rank[tied], buy_rank[tied], -key[tied]))
+                selected = tied[order][:len(selected)]
+            opportunities = []
+            for i in selected:
+                buy_products, sell_products = pairs[pair_ids[i]]
+                opportunity = calculate_arbitrage_opportunity(buy_products[buy_idx[i]], sell_products[sell_idx[i]])
+                if confidence is not None:
+                    opportunity.match_confidence = round(float(confidence[i]), 2)
+                opportunities.append(opportunity)
+            more = top_k is not None and len(candidates) > len(selected)
+        if not more or not len(selected):
+            return opportunities, None
+        last = selected[-1]
+        return opportunities, (int(key[last]), urls[buy_rank[last]], urls[sell_rank[last]])
+
+def _after_urls(urls: List[str], buy_rank: np.ndarray, sell_rank: np.ndarray, last_buy: str, last_sell: str) -> np.ndarray:
+    # (buy url, sell url) > (last_buy, last_sell) on ranks; the cursor urls need not be in this search
+    def position(url: str) -> Tuple[int, bool]:
+        i = bisect_left(urls, url)
+        return i, i < len(urls) and urls[i] == url
+    buy_at, buy_found = position(last_buy)
+    sell_at, sell_found = position(last_sell)
+    buy_after = buy_rank > buy_at if buy_found else buy_rank >= buy_at
+    sell_after = sell_rank > sell_at if sell_found else sell_rank >= sell_at
+    return buy_after | ((buy_rank == buy_at) & buy_found & sell_after)
+
+def round_cents(values: np.ndarray) -> np.ndarray:
+    # Integer hundredths matching Python's round(x, 2); np.rint alone differs on near-half ties
+    scaled = values * 100
+    cents = np.rint(scaled)
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_half.any():
+        flat_values = values.reshape(-1)
+        flat_cents = cents.reshape(-1)
+        for i in np.flatnonzero(near_half):
+            flat_cents[i] = round(round(float(flat_values[i]), 2) * 100)
+    return cents.astype(np.int64)
+
+def top_k_indices(values: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    # Descending order, ties keep their original position (same as a stable sort)
+    n = len(values)
+    if k is None or k >= n:
+        return np.argsort(-values, kind='stable')
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    threshold = np.partition(values, n - k)[n - k]
+    candidates = np.nonzero(values >= threshold)[0]
+    return candidates[np.argsort(-values[candidates], kind='stable')][:k]
+
+engine = ArbitrageEngine()
+
+def find_opportunities(buy_side: Dict[str, List[Product]], sell_side: Dict[str, List[Product]],
+                       top_k: Optional[int] = None, min_confidence: Optional[float] = None, **options) -> List[Opportunity]:
+    return engine.find_opportunities(buy_side, sell_side, top_k, min_confidence, **options)
+
+def find_page(buy_side: Dict[str, List[Product]], sell_side: Dict[str, List[Product]],
+              top_k: Optional[int] = None, min_confidence: Optional[float] = None, **options):
+    return engine.find_page(buy_side, sell_side, top_k, min_confidence, **options)
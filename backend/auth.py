@@ -1,30 +1,159 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 import requests
-from jose import jwt
-from jose.exceptions import JWTError
+from jose import jwk, jwt
+from jose.exceptions import JWKError, JWTError
 from fastapi import Header, HTTPException
 
-_cache = {"jwks": None, "url": None}
+from logger import get_logger
+from metrics import registry, span
 
-def _jwks(url: str):
-    if _cache["jwks"] is None or _cache["url"] != url:
-        _cache["jwks"] = requests.get(url, timeout=10).json()["keys"]
-        _cache["url"] = url
-    return _cache["jwks"]
+JWKS_TTL_SECONDS = float(os.getenv("JWKS_TTL_SECONDS", "3600"))
+JWKS_MIN_REFETCH_SECONDS = float(os.getenv("JWKS_MIN_REFETCH_SECONDS", "30"))
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_MAX_SECONDS = 300
+
+logger = get_logger(__name__)
+
+TOKEN_CACHE_LOOKUPS = registry.counter("arbitraje_auth_token_cache_total", "Consultas a la caché de tokens verificados",
+                                       ("result",))
+
+class JWKSCache:
+    def __init__(self, url: str, ttl: float = JWKS_TTL_SECONDS):
+        self.url = url
+        self.ttl = ttl
+        self.jwks: Dict[str, dict] = {}
+        self.fetched_at = 0.0
+        self._parsed: Dict[Tuple[str, str], object] = {}
+        self._fetch_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def refresh(self, seen_at: Optional[float] = None):
+        # Single flight: callers that queued behind a fetch reuse its result
+        with self._fetch_lock:
+            if seen_at is not None:
+                if self.fetched_at > seen_at:
+                    return
+                logger.info("🔑 kid desconocido, recargando JWKS")
+            keys = requests.get(self.url, timeout=10).json()["keys"]
+            self.jwks = {k.get("kid"): k for k in keys}
+            self._parsed = {}
+            self.fetched_at = time.monotonic()
+
+    def key(self, kid: str, alg: str):
+        seen_at = self.fetched_at
+        data = self.jwks.get(kid)
+        if data is None and time.monotonic() - seen_at >= JWKS_MIN_REFETCH_SECONDS:
+            try:
+                self.refresh(seen_at)
+            except Exception as e:
+                logger.error(f"❌ Error refrescando JWKS: {str(e)}")
+            data = self.jwks.get(kid)
+        if data is None:
+            return None
+        alg = data.get("alg") or alg
+        parsed = self._parsed.get((kid, alg))
+        if parsed is None:
+            parsed = self._parsed[(kid, alg)] = jwk.construct(data, alg)
+        return parsed
+
+    async def start(self):
+        try:
+            await asyncio.to_thread(self.refresh)
+        except Exception as e:
+            logger.error(f"❌ Error cargando JWKS: {str(e)}")
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"❌ Error refrescando JWKS: {str(e)}")
+
+class TokenCache:
+    def __init__(self, size: int = TOKEN_CACHE_SIZE):
+        self.size = size
+        self._entries: "OrderedDict[bytes, Tuple[str, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, digest: bytes) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            sub, kid, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return sub, kid
+
+    def put(self, digest: bytes, sub: str, kid: str, expires_at: float):
+        with self._lock:
+            self._entries[digest] = (sub, kid, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+_jwks_caches: Dict[str, JWKSCache] = {}
+_jwks_lock = threading.Lock()
+token_cache = TokenCache()
+
+def jwks_cache(url: str) -> JWKSCache:
+    cache = _jwks_caches.get(url)
+    if cache is None:
+        with _jwks_lock:
+            cache = _jwks_caches.setdefault(url, JWKSCache(url))
+    return cache
 
 def get_current_user(authorization: str = Header(None), jwks_url: str = "") -> str:
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing bearer token")
     token = authorization.split(" ", 1)[1].strip()
+    keys = jwks_cache(jwks_url)
+
+    digest = TokenCache.digest(token)
+    cached = token_cache.get(digest)
+    # A verification stays valid only while its signing key is still published
+    if cached is not None and cached[1] in keys.jwks:
+        TOKEN_CACHE_LOOKUPS.inc(result='hit')
+        return cached[0]
+    TOKEN_CACHE_LOOKUPS.inc(result='miss')
+
     try:
-        header = jwt.get_unverified_header(token)
-        kid = header.get("kid")
-        key = next((k for k in _jwks(jwks_url) if k.get("kid") == kid), None)
-        if not key:
-            raise HTTPException(status_code=401, detail="Invalid token key")
-        claims = jwt.decode(token, key, options={"verify_aud": False})
+        with span('jwt_verify'):
+            header = jwt.get_unverified_header(token)
+            kid = header.get("kid")
+            key = keys.key(kid, header.get("alg"))
+            if not key:
+                raise HTTPException(status_code=401, detail="Invalid token key")
+            claims = jwt.decode(token, key, options={"verify_aud": False})
         sub = claims.get("sub")
         if not sub:
             raise HTTPException(status_code=401, detail="Invalid token subject")
+        exp = claims.get("exp")
+        token_cache.put(digest, sub, kid, float(exp) if exp is not None else time.time() + TOKEN_CACHE_MAX_SECONDS)
         return sub
-    except JWTError:
+    except (JWTError, JWKError):
         raise HTTPException(status_code=401, detail="Invalid token")
+
+def current_user(authorization: str = Header(None)) -> str:
+    return get_current_user(authorization, os.getenv("SUPABASE_JWKS_URL", ""))
@@ -0,0 +1,210 @@
+import itertools
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Tables whose upserts conflict on something other than "id" when no on_conflict is given
+PRIMARY_KEYS = {
+    'listing_product_match': ('listing_id',),
+    'price_history': ('user_id', 'product_id', 'platform', 'is_demo'),
+    'refresh_watermarks': ('user_id',),
+    'user_settings': ('user_id',),
+}
+
+def observed_sales_ranked(tables: Dict[str, List[dict]]) -> List[dict]:
+    # Same columns as the view in supabase_sql/sales_windows.sql
+    groups: Dict[tuple, List[dict]] = {}
+    for row in tables.get('observed_sales', []):
+        if row.get('product_id') is not None:
+            groups.setdefault((row['user_id'], row['product_id'], row['platform']), []).append(row)
+    ranked = []
+    for rows in groups.values():
+        rows = sorted(rows, key=lambda row: row['id'])
+        rows.sort(key=lambda row: str(row['sold_at']), reverse=True)
+        real = [row for row in rows if not row.get('is_demo')]
+        real_rank = {row['id']: i for i, row in enumerate(real, 1)}
+        for i, row in enumerate(rows, 1):
+            ranked.append({**row, 'rank_all': i, 'count_all': len(rows),
+                           'rank_real': real_rank.get(row['id']), 'count_real': len(real)})
+    return ranked
+
+def observed_sales_daily(tables: Dict[str, List[dict]]) -> List[dict]:
+    # Same columns as the view in supabase_sql/price_history.sql
+    groups: Dict[tuple, List[float]] = {}
+    for row in tables.get('observed_sales', []):
+        if row.get('product_id') is not None:
+            key = (row['user_id'], row['product_id'], row['platform'], bool(row.get('is_demo')), row['sold_at'])
+            groups.setdefault(key, []).append(float(row['sold_price']))
+    daily = []
+    for (user_id, product_id, platform, is_demo, sold_at), prices in groups.items():
+        prices.sort()
+        n = len(prices)
+        daily.append({'user_id': user_id, 'product_id': product_id, 'platform': platform, 'is_demo': is_demo,
+                      'sold_at': sold_at, 'sales': n, 'low': prices[0],
+                      'median': (prices[(n - 1) // 2] + prices[n // 2]) / 2, 'high': prices[-1]})
+    return daily
+
+# Read-only views, rebuilt from their base tables on every select
+VIEWS = {'observed_sales_ranked': observed_sales_ranked, 'observed_sales_daily': observed_sales_daily}
+
+class MemoryResponse:
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+class MemoryQuery:
+    def __init__(self, db: "MemorySupabase", table: str):
+        self.db = db
+        self.table = table
+        self.op = 'select'
+        self.columns = '*'
+        self.count_method = None
+        self.filters: List[Callable[[dict], bool]] = []
+        self.orders: List[Tuple[str, bool]] = []
+        self.offset = 0
+        self.row_limit: Optional[int] = None
+        self.single_row = False
+        self.payload: Any = None
+        self.on_conflict = ''
+        self.ignore_duplicates = False
+
+    def select(self, columns: str = '*', count=None):
+        self.columns, self.count_method = columns, count
+        return self
+
+    def _filter(self, predicate: Callable[[dict], bool]):
+        self.filters.append(predicate)
+        return self
+
+    def eq(self, column: str, value):
+        return self._filter(lambda row: row.get(column) == value)
+
+    def neq(self, column: str, value):
+        return self._filter(lambda row: row.get(column) != value)
+
+    def gt(self, column: str, value):
+        return self._filter(lambda row: row.get(column) is not None and row[column] > value)
+
+    def gte(self, column: str, value):
+        return self._filter(lambda row: row.get(column) is not None and row[column] >= value)
+
+    def lt(self, column: str, value):
+        return self._filter(lambda row: row.get(column) is not None and row[column] < value)
+
+    def lte(self, column: str, value):
+        return self._filter(lambda row: row.get(column) is not None and row[column] <= value)
+
+    def in_(self, column: str, values):
+        values = set(values)
+        return self._filter(lambda row: row.get(column) in values)
+
+    def order(self, column: str, desc: bool = False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, size: int):
+        self.row_limit = size
+        return self
+
+    def range(self, start: int, end: int):
+        self.offset, self.row_limit = start, end - start + 1
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    def insert(self, payload, **kwargs):
+        self.op, self.payload = 'insert', payload
+        return self
+
+    def upsert(self, payload, on_conflict: str = '', ignore_duplicates: bool = False, **kwargs):
+        self.op, self.payload, self.on_conflict = 'upsert', payload, on_conflict
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, payload, **kwargs):
+        self.op, self.payload = 'update', payload
+        return self
+
+    def delete(self, **kwargs):
+        self.op = 'delete'
+        return self
+
+    def _matches(self, rows: List[dict]) -> List[dict]:
+        return [row for row in rows if all(predicate(row) for predicate in self.filters)]
+
+    def _select(self, rows: List[dict]) -> MemoryResponse:
+        found = self._matches(rows)
+        for column, desc in reversed(self.orders):
+            found.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        total = len(found)
+        found = found[self.offset:] if self.row_limit is None else found[self.offset:self.offset + self.row_limit]
+        if self.columns == '*':
+            found = [dict(row) for row in found]
+        else:
+            columns = [c.strip() for c in self.columns.split(',')]
+            found = [{c: row.get(c) for c in columns} for row in found]
+        if self.single_row:
+            return MemoryResponse(found[0] if found else None)
+        return MemoryResponse(found, total if self.count_method else None)
+
+    def _write(self, rows: List[dict]) -> MemoryResponse:
+        items = self.payload if isinstance(self.payload, list) else [self.payload]
+        keys = tuple(k for k in self.on_conflict.split(',') if k) or PRIMARY_KEYS.get(self.table, ('id',))
+        index = {tuple(row.get(k) for k in keys): row for row in rows} if self.op == 'upsert' else {}
+        written = []
+        for item in items:
+            # NULLs never conflict, like in a Postgres unique index
+            key = tuple(item.get(k) for k in keys)
+            existing = index.get(key) if None not in key else None
+            if existing is not None:
+                if self.ignore_duplicates:
+                    continue
+                existing.update(item)
+                written.append(dict(existing))
+                continue
+            row = dict(item)
+            row.setdefault('id', f"{next(self.db.ids):012d}")
+            rows.append(row)
+            index[tuple(row.get(k) for k in keys)] = row
+            written.append(dict(row))
+        return MemoryResponse(written)
+
+    def execute(self) -> MemoryResponse:
+        with self.db.lock:
+            self.db.round_trips[(self.table, self.op)] += 1
+            if self.table in VIEWS:
+                return self._select(VIEWS[self.table](self.db.tables))
+            rows = self.db.tables.setdefault(self.table, [])
+            if self.op == 'select':
+                return self._select(rows)
+            if self.op == 'update':
+                found = self._matches(rows)
+                for row in found:
+                    row.update(self.payload)
+                return MemoryResponse([dict(row) for row in found])
+            if self.op == 'delete':
+                rows[:] = [row for row in rows if not all(predicate(row) for predicate in self.filters)]
+                return MemoryResponse([])
+            return self._write(rows)
+
+# In-memory stand-in for the PostgREST side of the Supabase client; every execute() is one round-trip
+class MemorySupabase:
+    def __init__(self, tables: Optional[Dict[str, List[dict]]] = None):
+        self.tables: Dict[str, List[dict]] = tables or {}
+        self.round_trips: Counter = Counter()
+        self.ids = itertools.count(1)
+        self.lock = threading.RLock()
+
+    def table(self, name: str) -> MemoryQuery:
+        return MemoryQuery(self, name)
+
+    def reset_counters(self):
+        self.round_trips.clear()
+
+    def round_trip_summary(self) -> dict:
+        return {
+            'total': sum(self.round_trips.values()),
+            'by_table': {f"{table}.{op}": n for (table, op), n in sorted(self.round_trips.items())}
+        }
@@ -0,0 +1,409 @@
+import argparse
+import asyncio
+import contextlib
+import gc
+import http.server
+import json
+import os
+import platform as platform_info
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from arbitrage_engine import calculate_arbitrage_opportunity, find_page
+from benchmarks.memory_supabase import MemorySupabase
+from extraction import build_products, extract_cards_html
+from product_matching import DEFAULT_THRESHOLD
+from products import Product
+
+PLATFORMS = ('wallapop', 'ebay', 'vinted', 'catawiki')
+STAGES = ('parse', 'scrape', 'pairing', 'refresh', 'search')
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+QUICK_SIZES = (10, 100, 1000)
+CROSS_MAX_SIZE = 1000
+FAMILY_SIZE = 4
+CASE_BUDGET_SECONDS = 30.0
+MIN_RUNS = 3
+REFRESH_SIZES = (100, 1000, 5000)
+QUICK_REFRESH_SIZES = (100, 1000)
+
+MODELS = ("iPhone 13 128GB", "iPhone 12 64GB", "Nintendo Switch OLED", "PS5 Digital Edition", "MacBook Air M1 256GB",
+          "AirPods Pro 2", "Samsung Galaxy S22 128GB", "iPad Air 5 64GB", "Apple Watch Series 8 45mm", "GoPro Hero 11",
+          "Kindle Paperwhite 11", "Xbox Series S 512GB", "Canon EOS M50", "DJI Mini 3", "Sony WH-1000XM5")
+EXTRAS = ("como nuevo", "con caja", "sin uso", "buen estado", "azul", "negro", "factura", "garantía", "")
+PRICE_BANDS = {'wallapop': (60, 700), 'vinted': (50, 650), 'ebay': (150, 950), 'catawiki': (100, 800)}
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+def scrapers() -> dict:
+    from catawiki_scraper import CatawikiScraper
+    from ebay_scraper import EbayScraper
+    from vinted_scraper import VintedScraper
+    from wallapop_scraper import WallapopScraper
+    return {
+        'wallapop': (WallapopScraper, 'iter_items', 'España', ()),
+        'ebay': (EbayScraper, 'iter_sold_items', 'España', ("Shop on eBay",)),
+        'vinted': (VintedScraper, 'iter_items', 'España', ()),
+        'catawiki': (CatawikiScraper, 'iter_closed_auctions', 'Internacional', ()),
+    }
+
+def _timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+def measure(stage: str, case: str, fn: Callable[[], object], repeat: int, items: int = 0,
+            unit: str = 'items', params: Optional[dict] = None, budget_seconds: float = CASE_BUDGET_SECONDS) -> dict:
+    # The first call warms caches; a case slower than the whole budget keeps it as its only sample
+    warmup = _timed(fn)
+    gc.collect()
+    if warmup > budget_seconds * 1000:
+        latencies = [warmup]
+    else:
+        latencies = []
+        deadline = time.perf_counter() + budget_seconds
+        while len(latencies) < repeat and (len(latencies) < MIN_RUNS or time.perf_counter() < deadline):
+            latencies.append(_timed(fn))
+
+    # Peak memory comes from one extra traced run so tracing does not skew the timings
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    values = np.asarray(latencies)
+    p50 = float(np.percentile(values, 50))
+    result = {
+        'stage': stage,
+        'case': case,
+        'params': params or {},
+        'runs': len(latencies),
+        'latency_ms': {
+            'min': round(float(values.min()), 3),
+            'p50': round(p50, 3),
+            'p95': round(float(np.percentile(values, 95)), 3),
+            'p99': round(float(np.percentile(values, 99)), 3),
+            'max': round(float(values.max()), 3),
+            'mean': round(float(values.mean()), 3),
+        },
+        'peak_memory_bytes': peak,
+    }
+    if items:
+        result['throughput'] = {'unit': f'{unit}/s', 'value': round(items / (p50 / 1000), 1) if p50 else None}
+    log(f"⏱️ {stage}/{case} {json.dumps(params or {})}: p50 {p50:.2f} ms, p95 {result['latency_ms']['p95']:.2f} ms")
+    return result
+
+def fixture(platform: str) -> str:
+    return (FIXTURES_DIR / f"{platform}.html").read_text(encoding="utf-8")
+
+def bench_parse(repeat: int) -> List[dict]:
+    results = []
+    for platform, (scraper_cls, _, location, skip) in scrapers().items():
+        scraper = scraper_cls()
+        html = fixture(platform)
+        rows = extract_cards_html(html, scraper.result_selectors, scraper.card_fields)
+
+        def run():
+            build_products(extract_cards_html(html, scraper.result_selectors, scraper.card_fields),
+                           platform, scraper.base_url, location, skip)
+
+        results.append(measure('parse', platform, run, repeat, items=len(rows), unit='cards',
+                               params={'bytes': len(html.encode())}))
+    return results
+
+class _FixtureHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        # Only the first results page exists, later pages come back empty like a short search would
+        platform = self.path.strip('/').split('/')[0]
+        paged = any(marker in self.path for marker in ('_pgn=', '&page='))
+        if platform not in PLATFORMS:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = b"<html><body></body></html>" if paged else fixture(platform).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_fixture_server() -> http.server.ThreadingHTTPServer:
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    for platform in PLATFORMS:
+        os.environ[f"SCRAPER_BASE_URL_{platform.upper()}"] = f"http://{host}:{port}/{platform}"
+        os.environ[f"SCRAPER_FETCH_{platform.upper()}"] = "http"
+        # Replays are local, so the marketplace rate limits would only measure the token bucket
+        os.environ[f"SCRAPER_RATE_{platform.upper()}"] = "1000000"
+        os.environ[f"SCRAPER_BURST_{platform.upper()}"] = "1000000"
+    return server
+
+def bench_scrape(repeat: int) -> List[dict]:
+    from http_fetch import http_fetcher
+
+    loop = asyncio.new_event_loop()
+
+    async def collect(scraper_cls, method: str) -> int:
+        found = 0
+        async for batch in getattr(scraper_cls(), method)(["iphone", "13"], 1000):
+            found += len(batch)
+        return found
+
+    results = []
+    try:
+        for platform, (scraper_cls, method, _, _) in scrapers().items():
+            found = loop.run_until_complete(collect(scraper_cls, method))
+            results.append(measure('scrape', platform, lambda: loop.run_until_complete(collect(scraper_cls, method)),
+                                   repeat, items=found, unit='products'))
+    finally:
+        loop.run_until_complete(http_fetcher.close())
+        loop.close()
+    return results
+
+def synthetic_products(platform: str, size: int, seed: int) -> List[Product]:
+    # Titles fall into size / FAMILY_SIZE reference families, so every product keeps a similar
+    # number of plausible matches per platform as the sets grow instead of matching everything
+    rng = random.Random(f"{seed}:{platform}:{size}")
+    low, high = PRICE_BANDS[platform]
+    families = max(1, size // FAMILY_SIZE)
+    products = []
+    for i in range(size):
+        family = rng.randrange(families)
+        title = f"{MODELS[family % len(MODELS)]} ref{family} {rng.choice(EXTRAS)}".strip()
+        products.append(Product(title=title, price=round(rng.uniform(low, high), 2),
+                                url=f"https://{platform}.example/item/{i}", platform=platform))
+    return products
+
+def bench_pairing(repeat: int, sizes: List[int], seed: int) -> List[dict]:
+    results = []
+    for size in sizes:
+        side = {platform: synthetic_products(platform, size, seed) for platform in PLATFORMS}
+        total = size * len(PLATFORMS)
+        matched = measure(
+            'pairing', 'matched', lambda: find_page(side, side, top_k=50, min_confidence=DEFAULT_THRESHOLD),
+            repeat, items=total, unit='products', params={'per_platform': size, 'top_k': 50})
+        results.append(matched)
+        if size <= CROSS_MAX_SIZE:
+            cross = measure(
+                'pairing', 'cross', lambda: find_page(side, side, top_k=50),
+                repeat, items=total, unit='products', params={'per_platform': size, 'top_k': 50})
+            results.append(cross)
+            # Above 1 the title index beats scoring the whole cross product
+            matched['speedup_vs_cross'] = round(cross['latency_ms']['p50'] / matched['latency_ms']['p50'], 2)
+            log(f"📊 pairing {size}: emparejado {matched['speedup_vs_cross']}x frente al producto cruzado")
+
+    buy, sell = synthetic_products('wallapop', 1000, seed), synthetic_products('ebay', 1000, seed)
+    results.append(measure(
+        'pairing', 'calculate_arbitrage_opportunity',
+        lambda: [calculate_arbitrage_opportunity(b, s) for b, s in zip(buy, sell)],
+        repeat, items=len(buy), unit='pairs'))
+    return results
+
+def seed_user(db: MemorySupabase, user_id: str, listings: int, seed: int):
+    rng = random.Random(f"{seed}:refresh:{listings}")
+    products = [{'id': f"P{i:05d}", 'user_id': user_id, 'canonical_name': name, 'aliases': [], 'liquidity_class': 'medium'}
+                for i, name in enumerate(MODELS)]
+    db.tables.update({
+        'user_settings': [{'user_id': user_id, 'packaging_cost': 2.0, 'tax_enabled': False, 'tax_rate': 0.0,
+                           'risk_buffer': 0.05, 'liquidity_days_high': 7, 'liquidity_days_medium': 14,
+                           'liquidity_days_low': 30}],
+        'platform_fees': [{'user_id': user_id, 'platform': 'ebay', 'fee_percent': 0.125, 'fee_fixed': 0.35},
+                          {'user_id': user_id, 'platform': 'wallapop', 'fee_percent': 0.05, 'fee_fixed': 0.0}],
+        'products': products,
+        'listings': [],
+        'listing_product_match': [],
+        'observed_sales': [],
+    })
+    for i in range(listings):
+        product = rng.choice(products)
+        db.tables['listings'].append({
+            'id': f"L{i:07d}", 'user_id': user_id, 'platform': rng.choice(('wallapop', 'vinted')),
+            'url': f"https://example/listing/{i}", 'title': f"{product['canonical_name']} {rng.choice(EXTRAS)}".strip(),
+            'price': round(rng.uniform(60, 700), 2), 'shipping_price': None, 'is_demo': False,
+            'imported_at': f"2024-03-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:00+00:00",
+        })
+    for i in range(listings // 2):
+        product = rng.choice(products)
+        db.tables['observed_sales'].append({
+            'id': f"S{i:07d}", 'user_id': user_id, 'platform': 'ebay', 'product_id': product['id'],
+            'sold_price': round(rng.uniform(150, 950), 2), 'sold_at': f"2024-03-{1 + i % 28:02d}", 'is_demo': False,
+        })
+
+def bench_refresh(repeat: int, sizes: List[int], seed: int) -> List[dict]:
+    from models import RefreshIn
+    from opportunities import refresh
+    from product_index import product_index_cache
+    from sales_stats import sales_stats
+
+    user_id = "bench-user"
+    results = []
+    for size in sizes:
+        db = MemorySupabase()
+        seed_user(db, user_id, size, seed)
+        # Each size starts from a new database; the product index is then kept warm like in the API
+        product_index_cache.invalidate(user_id)
+        body = RefreshIn(min_net_margin=0.0, min_roi=0.0, limit=size).model_dump()
+        full_body = {**body, 'full': True}
+
+        def full():
+            sales_stats.invalidate(user_id)
+            return refresh(db, user_id, full_body)
+
+        db.reset_counters()
+        summary = full()
+        trips = db.round_trip_summary()
+        result = measure('refresh', 'full', full, repeat, items=size, unit='listings', params={'listings': size})
+        results.append({**result, 'round_trips': trips, 'result': summary})
+
+        refresh(db, user_id, body)
+        db.reset_counters()
+        summary = refresh(db, user_id, body)
+        trips = db.round_trip_summary()
+        result = measure('refresh', 'incremental_noop', lambda: refresh(db, user_id, body), repeat,
+                         items=size, unit='listings', params={'listings': size})
+        results.append({**result, 'round_trips': trips, 'result': summary})
+    return results
+
+def bench_search(repeat: int) -> List[dict]:
+    from fastapi.testclient import TestClient
+    from main import app
+
+    client = TestClient(app)
+    counter = iter(range(10 ** 9))
+
+    def run():
+        # Fresh keywords every call so each request misses the search cache and scrapes the fixtures
+        response = client.post("/api/search-arbitrage", json={"keywords": ["iphone", f"b{next(counter)}"], "max_results": 40},
+                               headers={"Accept-Encoding": "identity"})
+        response.raise_for_status()
+        statuses = {p: r['status'] for p, r in response.json()['platforms_searched'].items()}
+        if any(status != 'ok' for status in statuses.values()):
+            raise RuntimeError(f"Búsqueda incompleta: {statuses}")
+
+    return [measure('search', 'search_arbitrage', run, repeat, params={'max_results': 40})]
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True,
+                                timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'machine': platform_info.machine(),
+        'system': platform_info.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+def result_key(result: dict) -> str:
+    return f"{result['stage']}/{result['case']}/{json.dumps(result['params'], sort_keys=True)}"
+
+def compare(current: List[dict], baseline: List[dict]) -> List[dict]:
+    previous = {result_key(r): r for r in baseline}
+    rows = []
+    for result in current:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        old, new = before['latency_ms']['p50'], result['latency_ms']['p50']
+        rows.append({
+            'key': result_key(result),
+            'p50_before_ms': old,
+            'p50_after_ms': new,
+            'p50_change': round((new - old) / old, 4) if old else None,
+            'peak_memory_change': round((result['peak_memory_bytes'] - before['peak_memory_bytes'])
+                                        / before['peak_memory_bytes'], 4) if before['peak_memory_bytes'] else None,
+        })
+    return rows
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks offline de scraping, parsing, emparejamiento y refresh")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Etapas separadas por comas")
+    parser.add_argument("--sizes", default=None, help="Productos por plataforma para el emparejamiento")
+    parser.add_argument("--refresh-sizes", default=None, help="Anuncios por usuario para el refresh")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--quick", action="store_true", help="Tamaños pequeños y menos repeticiones")
+    parser.add_argument("--out", default=None, help="Fichero JSON de salida (por defecto stdout)")
+    parser.add_argument("--compare", default=None, help="JSON de una ejecución anterior para comparar")
+    parser.add_argument("--fail-over", type=float, default=None,
+                        help="Sale con código 1 si algún p50 empeora más que esta fracción frente a --compare")
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"etapas desconocidas: {', '.join(unknown)}")
+    repeat = min(args.repeat, 5) if args.quick else args.repeat
+    sizes = [int(s) for s in args.sizes.split(",")] if args.sizes else list(QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    refresh_sizes = [int(s) for s in args.refresh_sizes.split(",")] if args.refresh_sizes \
+        else list(QUICK_REFRESH_SIZES if args.quick else REFRESH_SIZES)
+
+    server = start_fixture_server() if {'scrape', 'search'} & set(stages) else None
+    results = []
+    # Logs already go to stderr; this keeps stray prints from third-party code out of the JSON report
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            for stage in stages:
+                log(f"🏁 Etapa {stage}")
+                if stage == 'parse':
+                    results.extend(bench_parse(repeat))
+                elif stage == 'scrape':
+                    results.extend(bench_scrape(repeat))
+                elif stage == 'pairing':
+                    results.extend(bench_pairing(repeat, sizes, args.seed))
+                elif stage == 'refresh':
+                    results.extend(bench_refresh(repeat, refresh_sizes, args.seed))
+                elif stage == 'search':
+                    results.extend(bench_search(repeat))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    report = {'meta': {**metadata(), 'repeat': repeat, 'seed': args.seed}, 'results': results}
+    regressions = []
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        report['comparison'] = compare(results, baseline.get('results', []))
+        for row in report['comparison']:
+            log(f"📊 {row['key']}: {row['p50_before_ms']} → {row['p50_after_ms']} ms ({row['p50_change']:+.1%})"
+                if row['p50_change'] is not None else f"📊 {row['key']}: sin referencia")
+        if args.fail_over is not None:
+            regressions = [row for row in report['comparison']
+                           if row['p50_change'] is not None and row['p50_change'] > args.fail_over]
+
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        Path(args.out).write_text(payload + "\n", encoding="utf-8")
+        log(f"✅ Resultados guardados en {args.out}")
+    else:
+        print(payload)
+    if regressions:
+        log(f"❌ {len(regressions)} casos empeoran más de {args.fail_over:.0%}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Playwright
+
+from logger import get_logger
+from metrics import span
+from page_loader import install_resource_blocking
+
+logger = get_logger(__name__)
+
+LAUNCH_ARGS = ['--no-sandbox', '--disable-setuid-sandbox', '--disable-dev-shm-usage']
+
+PLATFORM_CONCURRENCY = {
+    'wallapop': 2,
+    'ebay': 2,
+    'vinted': 2,
+    'catawiki': 2
+}
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+class _BrowserHandle:
+    def __init__(self, browser: Browser, generation: int):
+        self.browser = browser
+        self.generation = generation
+        self.active = 0
+        self.served = 0
+        self.retired = False
+
+    @property
+    def alive(self) -> bool:
+        return self.browser.is_connected()
+
+class _Slot:
+    def __init__(self, handle: _BrowserHandle, context: BrowserContext, page: Page):
+        self.handle = handle
+        self.context = context
+        self.page = page
+        self.uses = 0
+        self.broken = False
+
+class BrowserPool:
+    def __init__(self, max_pages: Optional[int] = None, recycle_after: Optional[int] = None,
+                 context_max_uses: Optional[int] = None, platform_limits: Optional[Dict[str, int]] = None):
+        self.max_pages = max_pages or _env_int("BROWSER_POOL_MAX_PAGES", 6)
+        self.recycle_after = recycle_after or _env_int("BROWSER_POOL_RECYCLE_AFTER", 200)
+        self.context_max_uses = context_max_uses or _env_int("BROWSER_POOL_CONTEXT_MAX_USES", 25)
+        limits = dict(PLATFORM_CONCURRENCY)
+        limits.update(platform_limits or {})
+        for platform in limits:
+            limits[platform] = _env_int(f"BROWSER_POOL_LIMIT_{platform.upper()}", limits[platform])
+        self.platform_limits = limits
+
+        self._playwright: Optional[Playwright] = None
+        self._handle: Optional[_BrowserHandle] = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+        self._page_slots: Optional[asyncio.Semaphore] = None
+        self._platform_slots: Dict[str, asyncio.Semaphore] = {}
+        self._idle: Dict[str, List[_Slot]] = {}
+        self._closing = False
+
+    @property
+    def started(self) -> bool:
+        return self._playwright is not None
+
+    async def start(self):
+        async with self._lock:
+            if self._playwright is not None:
+                return
+            self._closing = False
+            self._page_slots = asyncio.Semaphore(self.max_pages)
+            self._playwright = await async_playwright().start()
+            await self._launch()
+        logger.info(f"🌐 Pool de navegadores listo (max {self.max_pages} páginas)")
+
+    async def stop(self):
+        async with self._lock:
+            self._closing = True
+            for slots in self._idle.values():
+                for slot in slots:
+                    await self._close_slot(slot)
+            self._idle = {}
+            if self._handle is not None:
+                await self._close_browser(self._handle)
+                self._handle = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    async def _launch(self) -> _BrowserHandle:
+        self._generation += 1
+        with span('browser_launch'):
+            browser = await self._playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        self._handle = _BrowserHandle(browser, self._generation)
+        return self._handle
+
+    async def _close_browser(self, handle: _BrowserHandle):
+        try:
+            await handle.browser.close()
+        except Exception:
+            pass
+
+    async def _close_slot(self, slot: _Slot):
+        try:
+            await slot.context.close()
+        except Exception:
+            pass
+
+    async def _current_browser(self) -> _BrowserHandle:
+        async with self._lock:
+            if self._closing:
+                raise RuntimeError("El pool de navegadores se está cerrando")
+            handle = self._handle
+            if handle is None or not handle.alive:
+                if handle is not None:
+                    logger.warning("♻️ Navegador caído, relanzando")
+                handle = await self._launch()
+            elif handle.served >= self.recycle_after:
+                logger.warning(f"♻️ Reciclando navegador tras {handle.served} páginas")
+                handle.retired = True
+                if handle.active == 0:
+                    await self._close_browser(handle)
+                handle = await self._launch()
+            return handle
+
+    def _platform_slot(self, platform: str) -> asyncio.Semaphore:
+        if platform not in self._platform_slots:
+            self._platform_slots[platform] = asyncio.Semaphore(self.platform_limits.get(platform, 1))
+        return self._platform_slots[platform]
+
+    async def _acquire(self, platform: str) -> _Slot:
+        idle = self._idle.setdefault(platform, [])
+        while idle:
+            slot = idle.pop()
+            if slot.handle is self._handle and slot.handle.alive and not slot.page.is_closed():
+                slot.handle.active += 1
+                return slot
+            await self._close_slot(slot)
+
+        handle = await self._current_browser()
+        context = await handle.browser.new_context(locale='es-ES')
+        await install_resource_blocking(context)
+        page = await context.new_page()
+        slot = _Slot(handle, context, page)
+        page.on("crash", lambda _: setattr(slot, 'broken', True))
+        handle.active += 1
+        return slot
+
+    async def _release(self, platform: str, slot: _Slot):
+        handle = slot.handle
+        handle.active -= 1
+        handle.served += 1
+        slot.uses += 1
+
+        reusable = (
+            not self._closing
+            and not slot.broken
+            and handle is self._handle
+            and handle.alive
+            and not slot.page.is_closed()
+            and slot.uses < self.context_max_uses
+        )
+        if reusable:
+            self._idle.setdefault(platform, []).append(slot)
+        else:
+            await self._close_slot(slot)
+
+        if handle.retired and handle.active == 0:
+            await self._close_browser(handle)
+
+    @asynccontextmanager
+    async def page(self, platform: str):
+        if not self.started:
+            await self.start()
+        async with self._platform_slot(platform), self._page_slots:
+            slot = await self._acquire(platform)
+            try:
+                yield slot.page
+            except Exception:
+                slot.broken = True
+                raise
+            finally:
+                await self._release(platform, slot)
+
+    def stats(self) -> dict:
+        handle = self._handle
+        return {
+            'started': self.started,
+            'generation': self._generation,
+            'active_pages': handle.active if handle else 0,
+            'pages_served': handle.served if handle else 0,
+            'idle_pages': {platform: len(slots) for platform, slots in self._idle.items()}
+        }
+
+browser_pool = BrowserPool()
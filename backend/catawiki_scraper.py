@@ -1,66 +1,92 @@
-﻿import asyncio
-import re
-from typing import List, Dict
-from playwright.async_api import async_playwright
+﻿from typing import AsyncIterator, List
+
+from browser_pool import browser_pool
+from page_loader import load_results, MAX_PAGES
+from extraction import extract_cards, build_products, take_new
+from http_fetch import HttpFallback, base_url, fetch_mode, http_fetcher
+from logger import get_logger
+from products import Product
+from search_cache import search_cache
+
+logger = get_logger(__name__)
 
 class CatawikiScraper:
     def __init__(self):
-        self.base_url = "https://www.catawiki.com"
+        self.base_url = base_url('catawiki', "https://www.catawiki.com")
+        self.result_selectors = ['[data-testid="search-result"]', '.c-lot-card', 'article[class*="lot"]']
+        self.card_fields = {
+            'title': ('[data-testid="lot-title"], h3, .c-lot-card__title', 'text'),
+            'price': ('[data-testid="lot-price"], span[class*="price"]', 'text'),
+            'url': ('a', 'href'),
+            'image_url': ('img', 'src|data-src'),
+            'location': None,
+            'sold_at': ('time, [data-testid="lot-close-date"]', 'datetime|text')
+        }
+        self.last_load = None
     
-    async def search_closed_auctions(self, keywords: List[str], max_results: int = 20) -> List[Dict]:
+    def search_url(self, search_query: str, page_number: int = 1) -> str:
+        url = f"{self.base_url}/es/s?q={search_query.replace(' ', '+')}&status=closed"
+        return url if page_number == 1 else f"{url}&page={page_number}"
+    
+    async def iter_closed_auctions(self, keywords: List[str], max_results: int = 20) -> AsyncIterator[List[Product]]:
         search_query = " ".join(keywords)
-        search_url = f"{self.base_url}/es/s?q={search_query.replace(' ', '+')}&status=closed"
         
-        print(f"🔍 Buscando subastas cerradas en Catawiki: {search_query}")
+        logger.info(f"🔍 Buscando subastas cerradas en Catawiki: {search_query}")
         
-        try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True, args=['--no-sandbox', '--disable-setuid-sandbox'])
-                page = await browser.new_page()
-                await page.goto(search_url, wait_until='domcontentloaded', timeout=30000)
-                await asyncio.sleep(3)
-                
-                products = []
-                selectors = ['[data-testid="search-result"]', '.c-lot-card', 'article[class*="lot"]']
-                
-                items = []
-                for selector in selectors:
-                    items = await page.query_selector_all(selector)
-                    if len(items) > 0:
+        seen = set()
+        found = 0
+        if fetch_mode('catawiki') != 'browser':
+            try:
+                pages = (self.search_url(search_query, n) for n in range(1, MAX_PAGES + 1))
+                async for rows in http_fetcher.results('catawiki', pages, self.result_selectors, self.card_fields):
+                    products = take_new(build_products(rows, 'catawiki', self.base_url, 'Internacional'), seen, max_results - found)
+                    if not products:
+                        break
+                    found += len(products)
+                    yield products
+                    if found >= max_results:
                         break
+                return
+            except HttpFallback as e:
+                logger.info(f"↩️ Catawiki sin resultados por HTTP ({str(e)}), usando navegador")
+        
+        async with browser_pool.page('catawiki') as page:
+            for page_number in range(1, MAX_PAGES + 1):
+                load = await load_results(page, self.search_url(search_query, page_number), self.result_selectors, platform='catawiki')
+                self.last_load = load
+                logger.debug(f"⏱️ Catawiki página {page_number} lista en {load.wait_ms:.0f} ms (navegación {load.navigation_ms:.0f} ms)")
+                if not load.ready:
+                    break
                 
-                for item in items[:max_results]:
-                    try:
-                        title_elem = await item.query_selector('[data-testid="lot-title"], h3, .c-lot-card__title')
-                        title = await title_elem.inner_text() if title_elem else ""
-                        
-                        price_elem = await item.query_selector('[data-testid="lot-price"], span[class*="price"]')
-                        price_text = await price_elem.inner_text() if price_elem else "0"
-                        price = float(re.sub(r'[^\d,.]', '', price_text).replace(',', '.'))
-                        
-                        link_elem = await item.query_selector('a')
-                        href = await link_elem.get_attribute('href') if link_elem else ""
-                        url = f"{self.base_url}{href}" if href and not href.startswith('http') else href
-                        
-                        if title and price > 0:
-                            products.append({
-                                'title': title.strip(),
-                                'price': price,
-                                'url': url,
-                                'platform': 'catawiki',
-                                'image_url': '',
-                                'location': 'Internacional'
-                            })
-                    except:
-                        continue
+                rows = await extract_cards(page, load.selector, self.card_fields, platform='catawiki')
+                products = take_new(build_products(rows, 'catawiki', self.base_url, 'Internacional'), seen, max_results - found)
+                if not products:
+                    break
                 
-                await browser.close()
-                print(f"✅ Encontradas {len(products)} subastas en Catawiki")
-                return products
+                found += len(products)
+                yield products
+                if found >= max_results:
+                    break
+    
+    async def search_closed_auctions(self, keywords: List[str], max_results: int = 20) -> List[Product]:
+        products = []
+        try:
+            async for batch in self.iter_closed_auctions(keywords, max_results):
+                products.extend(batch)
         except Exception as e:
-            print(f"❌ Error scraping Catawiki: {str(e)}")
-            return []
+            logger.error(f"❌ Error scraping Catawiki: {str(e)}")
+            if not products:
+                raise
+            return products
+        
+        logger.info(f"✅ Encontradas {len(products)} subastas en Catawiki")
+        return products
 
-async def search_catawiki_closed(keywords: List[str], max_results: int = 20) -> List[Dict]:
+@search_cache.cached('catawiki')
+async def search_catawiki_closed(keywords: List[str], max_results: int = 20) -> List[Product]:
     scraper = CatawikiScraper()
     return await scraper.search_closed_auctions(keywords, max_results)
+
+def stream_catawiki_closed(keywords: List[str], max_results: int = 20) -> AsyncIterator[List[Product]]:
+    scraper = CatawikiScraper()
+    return scraper.iter_closed_auctions(keywords, max_results)
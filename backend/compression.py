@@ -0,0 +1,126 @@
+import gzip
+import os
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+def _qvalues(accept_encoding: str) -> dict:
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, *params = [p.strip() for p in part.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.lower()] = q
+    return weights
+
+def choose_encoding(accept_encoding: str) -> str:
+    # Highest q wins and q=0 rules a coding out; "*" covers codings not listed, ties prefer br
+    weights = _qvalues(accept_encoding)
+    wildcard = weights.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = "", 0.0
+    for coding in candidates:
+        q = weights.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._br = None
+            self._gz = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        # Flushed per chunk so streamed NDJSON lines reach the client as soon as they are produced
+        if self._br is not None:
+            return self._br.process(data) + self._br.flush()
+        return self._gz.compress(data) + self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self._br is not None:
+            return self._br.finish()
+        return self._gz.flush(zlib.Z_FINISH)
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start: dict = {}
+        compressor = None
+
+        async def send_compressed(message: Message):
+            nonlocal compressor
+            if message["type"] == "http.response.start":
+                start.update(message)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if start:
+                headers = MutableHeaders(raw=start["headers"])
+                skip = "content-encoding" in headers or (not more_body and len(body) < self.minimum_size)
+                if skip:
+                    await send(start)
+                    start.clear()
+                    await send(message)
+                    return
+                headers["content-encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body:
+                    body = compress(body, encoding)
+                    headers["content-length"] = str(len(body))
+                    await send(start)
+                    start.clear()
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                del headers["content-length"]
+                await send(start)
+                start.clear()
+                compressor = _Compressor(encoding)
+
+            if compressor is None:
+                await send(message)
+                return
+            data = compressor.chunk(body) if body else b""
+            if not more_body:
+                data += compressor.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,60 +1,92 @@
-﻿import asyncio
-import re
-from typing import List, Dict
-from playwright.async_api import async_playwright
-import random
+﻿from typing import AsyncIterator, List
+
+from browser_pool import browser_pool
+from page_loader import load_results, MAX_PAGES
+from extraction import extract_cards, build_products, take_new
+from http_fetch import HttpFallback, base_url, fetch_mode, http_fetcher
+from logger import get_logger
+from products import Product
+from search_cache import search_cache
+
+logger = get_logger(__name__)
 
 class EbayScraper:
     def __init__(self):
-        self.base_url = "https://www.ebay.es"
+        self.base_url = base_url('ebay', "https://www.ebay.es")
+        self.result_selectors = ['.s-item']
+        self.card_fields = {
+            'title': ('.s-item__title', 'text'),
+            'price': ('.s-item__price', 'text'),
+            'url': ('.s-item__link', 'href'),
+            'image_url': ('.s-item__image img', 'src|data-src'),
+            'location': ('.s-item__location', 'text'),
+            'sold_at': ('.s-item__caption--signal, .s-item__title--tag', 'text')
+        }
+        self.last_load = None
+    
+    def search_url(self, search_query: str, page_number: int = 1) -> str:
+        url = f"{self.base_url}/sch/i.html?_from=R40&_nkw={search_query.replace(' ', '+')}&_sacat=0&LH_Sold=1&LH_Complete=1&rt=nc"
+        return url if page_number == 1 else f"{url}&_pgn={page_number}"
     
-    async def search_sold_items(self, keywords: List[str], max_results: int = 20) -> List[Dict]:
+    async def iter_sold_items(self, keywords: List[str], max_results: int = 20) -> AsyncIterator[List[Product]]:
         search_query = " ".join(keywords)
-        search_url = f"{self.base_url}/sch/i.html?_from=R40&_nkw={search_query.replace(' ', '+')}&_sacat=0&LH_Sold=1&LH_Complete=1&rt=nc"
         
-        print(f"🔍 Buscando ventas completadas en eBay: {search_query}")
+        logger.info(f"🔍 Buscando ventas completadas en eBay: {search_query}")
         
-        try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True, args=['--no-sandbox', '--disable-setuid-sandbox'])
-                page = await browser.new_page()
-                await page.goto(search_url, wait_until='domcontentloaded', timeout=30000)
-                await asyncio.sleep(3)
-                
-                products = []
-                items = await page.query_selector_all('.s-item')
+        seen = set()
+        found = 0
+        if fetch_mode('ebay') != 'browser':
+            try:
+                pages = (self.search_url(search_query, n) for n in range(1, MAX_PAGES + 1))
+                async for rows in http_fetcher.results('ebay', pages, self.result_selectors, self.card_fields):
+                    products = take_new(build_products(rows, 'ebay', self.base_url, 'España', skip_titles=("Shop on eBay",)), seen, max_results - found)
+                    if not products:
+                        break
+                    found += len(products)
+                    yield products
+                    if found >= max_results:
+                        break
+                return
+            except HttpFallback as e:
+                logger.info(f"↩️ eBay sin resultados por HTTP ({str(e)}), usando navegador")
+        
+        async with browser_pool.page('ebay') as page:
+            for page_number in range(1, MAX_PAGES + 1):
+                load = await load_results(page, self.search_url(search_query, page_number), self.result_selectors, platform='ebay')
+                self.last_load = load
+                logger.debug(f"⏱️ eBay página {page_number} lista en {load.wait_ms:.0f} ms (navegación {load.navigation_ms:.0f} ms)")
+                if not load.ready:
+                    break
                 
-                for item in items[:max_results]:
-                    try:
-                        title_elem = await item.query_selector('.s-item__title')
-                        title = await title_elem.inner_text() if title_elem else ""
-                        
-                        price_elem = await item.query_selector('.s-item__price')
-                        price_text = await price_elem.inner_text() if price_elem else "0"
-                        price = float(re.sub(r'[^\d,.]', '', price_text).replace(',', '.'))
-                        
-                        link_elem = await item.query_selector('.s-item__link')
-                        url = await link_elem.get_attribute('href') if link_elem else ""
-                        
-                        if title and price > 0 and "Shop on eBay" not in title:
-                            products.append({
-                                'title': title.strip(),
-                                'price': price,
-                                'url': url,
-                                'platform': 'ebay',
-                                'image_url': '',
-                                'location': 'España'
-                            })
-                    except:
-                        continue
+                rows = await extract_cards(page, load.selector, self.card_fields, platform='ebay')
+                products = take_new(build_products(rows, 'ebay', self.base_url, 'España', skip_titles=("Shop on eBay",)), seen, max_results - found)
+                if not products:
+                    break
                 
-                await browser.close()
-                print(f"✅ Encontrados {len(products)} productos vendidos en eBay")
-                return products
+                found += len(products)
+                yield products
+                if found >= max_results:
+                    break
+    
+    async def search_sold_items(self, keywords: List[str], max_results: int = 20) -> List[Product]:
+        products = []
+        try:
+            async for batch in self.iter_sold_items(keywords, max_results):
+                products.extend(batch)
         except Exception as e:
-            print(f"❌ Error scraping eBay: {str(e)}")
-            return []
+            logger.error(f"❌ Error scraping eBay: {str(e)}")
+            if not products:
+                raise
+            return products
+        
+        logger.info(f"✅ Encontrados {len(products)} productos vendidos en eBay")
+        return products
 
-async def search_ebay_sold(keywords: List[str], max_results: int = 20) -> List[Dict]:
+@search_cache.cached('ebay')
+async def search_ebay_sold(keywords: List[str], max_results: int = 20) -> List[Product]:
     scraper = EbayScraper()
     return await scraper.search_sold_items(keywords, max_results)
+
+def stream_ebay_sold(keywords: List[str], max_results: int = 20) -> AsyncIterator[List[Product]]:
+    scraper = EbayScraper()
+    return scraper.iter_sold_items(keywords, max_results)
@@ -0,0 +1,130 @@
+import re
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+from bs4 import BeautifulSoup
+from playwright.async_api import Page
+
+from metrics import span
+from products import Product
+
+FIELDS = ('title', 'price', 'url', 'image_url', 'location', 'sold_at')
+
+EXTRACT_CARDS_JS = """
+({cardSelector, fields, limit, offset}) => {
+    const pick = (card, spec) => {
+        if (!spec) return '';
+        const [selector, attrs] = spec;
+        const el = selector ? card.querySelector(selector) : card;
+        if (!el) return '';
+        for (const attr of attrs.split('|')) {
+            const value = attr === 'text' ? (el.innerText || el.textContent) : el.getAttribute(attr);
+            if (value) return value;
+        }
+        return '';
+    };
+    return Array.from(document.querySelectorAll(cardSelector))
+        .slice(offset, limit == null ? undefined : offset + limit)
+        .map(card => fields.map(spec => pick(card, spec)));
+}
+"""
+
+_PRICE_CHARS = re.compile(r'[^\d,.]')
+_ISO_DATE = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+_TEXT_DATE = re.compile(r'(\d{1,2})\s+(?:de\s+)?([a-z]{3})[a-z]*\.?\s+(?:de\s+)?(\d{4})')
+MONTHS = {'ene': 1, 'feb': 2, 'mar': 3, 'abr': 4, 'may': 5, 'jun': 6, 'jul': 7, 'ago': 8, 'sep': 9, 'set': 9,
+          'oct': 10, 'nov': 11, 'dic': 12, 'jan': 1, 'apr': 4, 'aug': 8, 'dec': 12}
+
+def parse_price(text: str) -> float:
+    try:
+        return float(_PRICE_CHARS.sub('', text or '').replace(',', '.'))
+    except ValueError:
+        return 0.0
+
+def parse_sold_date(text: str) -> str:
+    # "Vendido 12 oct 2024", "12 de octubre de 2024" or an ISO timestamp; '' when the card has no usable date
+    text = (text or '').lower()
+    match = _ISO_DATE.search(text)
+    try:
+        if match:
+            return date(*map(int, match.groups())).isoformat()
+        match = _TEXT_DATE.search(text)
+        if match and match.group(2) in MONTHS:
+            return date(int(match.group(3)), MONTHS[match.group(2)], int(match.group(1))).isoformat()
+    except ValueError:
+        pass
+    return ''
+
+def field_specs(card_fields: Dict[str, Tuple[str, str]]) -> List[Optional[List[str]]]:
+    return [list(card_fields[name]) if card_fields.get(name) else None for name in FIELDS]
+
+async def extract_cards(page: Page, card_selector: str, card_fields: Dict[str, Tuple[str, str]],
+                        limit: Optional[int] = None, offset: int = 0, platform: str = '') -> List[List[str]]:
+    with span('extraction', platform):
+        return await page.evaluate(EXTRACT_CARDS_JS, {
+            'cardSelector': card_selector,
+            'fields': field_specs(card_fields),
+            'limit': limit,
+            'offset': offset
+        })
+
+def _pick(card, spec: Optional[List[str]]) -> str:
+    # Same rules as the pick() helper in EXTRACT_CARDS_JS
+    if not spec:
+        return ''
+    selector, attrs = spec
+    el = card.select_one(selector) if selector else card
+    if el is None:
+        return ''
+    for attr in attrs.split('|'):
+        value = el.get_text(' ', strip=True) if attr == 'text' else el.get(attr)
+        if value:
+            return value
+    return ''
+
+def extract_cards_html(html: str, selectors: List[str], card_fields: Dict[str, Tuple[str, str]],
+                       limit: Optional[int] = None, offset: int = 0, platform: str = '') -> List[List[str]]:
+    with span('extraction', platform):
+        soup = BeautifulSoup(html, 'lxml')
+        specs = field_specs(card_fields)
+        for selector in selectors:
+            cards = soup.select(selector)
+            if cards:
+                cards = cards[offset:None if limit is None else offset + limit]
+                return [[_pick(card, spec) for spec in specs] for card in cards]
+        return []
+
+def absolute_url(base_url: str, href: str) -> str:
+    if href.startswith('//'):
+        return f"https:{href}"
+    return f"{base_url}{href}" if href.startswith('/') else href
+
+def build_products(rows: Iterable[List[str]], platform: str, base_url: str, default_location: str,
+                   skip_titles: Tuple[str, ...] = ()) -> List[Product]:
+    products = []
+    for title, price_text, href, image, location, sold_text in rows:
+        title = title.strip()
+        price = parse_price(price_text)
+        if not title or price <= 0 or any(skip in title for skip in skip_titles):
+            continue
+        products.append(Product(
+            title=title,
+            price=price,
+            url=absolute_url(base_url, href),
+            platform=platform,
+            image_url=absolute_url(base_url, image),
+            location=location.strip() or default_location,
+            sold_at=parse_sold_date(sold_text)
+        ))
+    return products
+
+def take_new(products: List[Product], seen: set, limit: int) -> List[Product]:
+    fresh = []
+    for product in products:
+        if len(fresh) >= limit:
+            break
+        key = product.url or (product.title, product.price)
+        if key in seen:
+            continue
+        seen.add(key)
+        fresh.append(product)
+    return fresh
@@ -0,0 +1,100 @@
+import os
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+import httpx
+
+from extraction import extract_cards_html
+from logger import get_logger
+from metrics import record
+
+FETCH_MODES = ('auto', 'http', 'browser')
+DEFAULT_FETCH_MODE = 'auto'
+
+HTTP_TIMEOUT_SECONDS = float(os.getenv("SCRAPER_HTTP_TIMEOUT_SECONDS", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("SCRAPER_HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("SCRAPER_HTTP_MAX_KEEPALIVE", "20"))
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/124.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/json;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'es-ES,es;q=0.9,en;q=0.8'
+}
+
+logger = get_logger(__name__)
+
+class HttpFallback(Exception):
+    pass
+
+def fetch_mode(platform: str) -> str:
+    mode = os.getenv(f"SCRAPER_FETCH_{platform.upper()}", DEFAULT_FETCH_MODE).lower()
+    return mode if mode in FETCH_MODES else DEFAULT_FETCH_MODE
+
+def base_url(platform: str, default: str) -> str:
+    # Lets a deployment (or a local fixture server) stand in for the marketplace
+    return os.getenv(f"SCRAPER_BASE_URL_{platform.upper()}", default).rstrip('/')
+
+class HttpFetcher:
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self.counters: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                headers=HEADERS,
+                follow_redirects=True,
+                timeout=HTTP_TIMEOUT_SECONDS,
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+            )
+        return self._client
+
+    def _count(self, platform: str, name: str):
+        counters = self.counters.setdefault(platform, {'requests': 0, 'errors': 0, 'fallbacks': 0})
+        counters[name] += 1
+
+    async def get_text(self, platform: str, url: str) -> Tuple[str, float]:
+        self._count(platform, 'requests')
+        start = time.perf_counter()
+        response = await self.client.get(url)
+        elapsed = time.perf_counter() - start
+        record('http_fetch', elapsed, platform)
+        response.raise_for_status()
+        return response.text, elapsed * 1000
+
+    async def results(self, platform: str, urls: Iterable[str], selectors: List[str],
+                      card_fields: Dict[str, Tuple[str, str]]) -> AsyncIterator[List[List[str]]]:
+        # Raises HttpFallback when the first page is unusable over plain HTTP and the
+        # platform may still be scraped with the browser; later pages just end the search
+        strict = fetch_mode(platform) == 'http'
+        for number, url in enumerate(urls):
+            try:
+                html, elapsed_ms = await self.get_text(platform, url)
+            except httpx.HTTPError as e:
+                self._count(platform, 'errors')
+                if number == 0 and not strict:
+                    self._count(platform, 'fallbacks')
+                    raise HttpFallback(f"{type(e).__name__}: {e}")
+                if number == 0:
+                    raise
+                return
+            rows = extract_cards_html(html, selectors, card_fields, platform=platform)
+            logger.debug(f"⚡ {platform} página {number + 1} por HTTP en {elapsed_ms:.0f} ms ({len(rows)} tarjetas)")
+            if not rows:
+                if number == 0 and not strict:
+                    self._count(platform, 'fallbacks')
+                    raise HttpFallback("sin resultados en el HTML")
+                return
+            yield rows
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {platform: dict(counters) for platform, counters in self.counters.items()}
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+http_fetcher = HttpFetcher()
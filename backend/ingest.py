@@ -0,0 +1,203 @@
+import json
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Type
+from fastapi import HTTPException
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from supabase import Client
+from postgrest.types import ReturnMethod
+
+from models import ListingIn, BrowserSearchIn, ObservedSaleIn
+from price_history import RAW_RETENTION_DAYS, PriceSeries, from_day, to_day, today
+from sales_stats import SALES_WINDOW, sales_stats
+from supabase_client import chunks, select_all, select_in
+from whatif import snapshot_cache
+
+INGEST_MAX_ITEMS = int(os.getenv("INGEST_MAX_ITEMS", "10000"))
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+_adapters: Dict[Type[BaseModel], TypeAdapter] = {}
+
+def _adapter(model: Type[BaseModel]) -> TypeAdapter:
+    if model not in _adapters:
+        _adapters[model] = TypeAdapter(model)
+    return _adapters[model]
+
+def _error(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc']) or 'item'}: {err['msg']}" for err in e.errors())
+
+def parse_items(raw: bytes, content_type: str, model: Type[BaseModel]) -> Tuple[list, List[dict]]:
+    adapter = _adapter(model)
+    items, rejected = [], []
+    if (content_type or "").split(";")[0].strip().lower() in NDJSON_TYPES:
+        lines = [line for line in raw.splitlines() if line.strip()]
+        if len(lines) > INGEST_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"Máximo {INGEST_MAX_ITEMS} elementos por petición")
+        for index, line in enumerate(lines):
+            try:
+                items.append(adapter.validate_json(line))
+            except ValidationError as e:
+                rejected.append({"index": index, "error": _error(e)})
+        return items, rejected
+
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON inválido")
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        raise HTTPException(status_code=400, detail="Se esperaba un array JSON o NDJSON")
+    if len(data) > INGEST_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {INGEST_MAX_ITEMS} elementos por petición")
+    for index, item in enumerate(data):
+        try:
+            items.append(adapter.validate_python(item))
+        except ValidationError as e:
+            rejected.append({"index": index, "error": _error(e)})
+    return items, rejected
+
+def listing_row(user_id: str, item: ListingIn) -> dict:
+    return {
+        "user_id": user_id, "platform": item.platform, "url": item.url, "title": item.title,
+        "price": item.price, "currency": item.currency, "shipping_price": item.shipping_price,
+        "category": item.category, "item_condition": item.condition, "location": item.location,
+        "images": item.images, "is_demo": item.is_demo
+    }
+
+def browser_search_rows(user_id: str, search: BrowserSearchIn) -> List[dict]:
+    return [
+        listing_row(user_id, ListingIn(platform=search.platform, url=r.url, title=r.title, price=r.price,
+                                       location=r.location, is_demo=search.is_demo))
+        for r in search.results
+    ]
+
+def sale_row(user_id: str, item: ObservedSaleIn) -> dict:
+    return {
+        "user_id": user_id, "platform": item.platform, "product_id": item.product_id, "keyword": item.keyword,
+        "sold_price": item.sold_price, "sold_at": item.sold_at.isoformat(), "item_condition": item.condition,
+        "url": item.url, "notes": item.notes, "is_demo": item.is_demo
+    }
+
+def dedupe(rows: List[dict]) -> List[dict]:
+    # Last capture of the same (user_id, platform, url) wins; rows without url are kept as they are
+    unique = {}
+    for i, row in enumerate(rows):
+        key = (row["user_id"], row["platform"], row["url"]) if row.get("url") else i
+        unique.pop(key, None)
+        unique[key] = row
+    return list(unique.values())
+
+def upsert_listings(sb: Client, rows: List[dict], returning: bool = False) -> List[dict]:
+    upserted = []
+    for chunk in chunks(dedupe(rows)):
+        res = sb.table("listings").upsert(
+            chunk, on_conflict="user_id,platform,url",
+            returning=ReturnMethod.representation if returning else ReturnMethod.minimal
+        ).execute()
+        if returning:
+            upserted.extend(res.data)
+    for user_id in {row["user_id"] for row in rows}:
+        snapshot_cache.invalidate(user_id)
+    return upserted
+
+def insert_sales(sb: Client, user_id: str, rows: List[dict]) -> Tuple[List[dict], int]:
+    rows = dedupe(rows)
+    # Sales already stored under the same (user_id, platform, url) are skipped by the unique index
+    new_rows = _drop_compacted(sb, user_id, rows)
+    inserted = []
+    for chunk in chunks(new_rows):
+        inserted.extend(sb.table("observed_sales").upsert(
+            chunk, on_conflict="user_id,platform,url", ignore_duplicates=True).execute().data)
+    sales_stats.record_many(user_id, inserted)
+    if inserted:
+        snapshot_cache.invalidate(user_id)
+    return inserted, len(rows) - len(inserted)
+
+def _drop_compacted(sb: Client, user_id: str, rows: List[dict]) -> List[dict]:
+    # Compacted sales are gone from observed_sales, so their url no longer dedupes a second capture.
+    # A sale from before a series' compacted_through day is taken to be one of them
+    old = [row for row in rows if row.get("url") and row.get("product_id")
+           and to_day(row["sold_at"]) < today() - RAW_RETENTION_DAYS]
+    if not old:
+        return rows
+    through = {(h["product_id"], h["platform"], h["is_demo"]): h["compacted_through"] for h in select_in(
+        lambda: sb.table("price_history").select("product_id,platform,is_demo,compacted_through").eq("user_id", user_id)
+        .order("product_id").order("platform").order("is_demo"),
+        "product_id", sorted({row["product_id"] for row in old}))}
+    compacted = {id(row) for row in old
+                 if to_day(row["sold_at"]) < (through.get((row["product_id"], row["platform"], bool(row.get("is_demo")))) or 0)}
+    return [row for row in rows if id(row) not in compacted]
+
+def compact_price_history(sb: Client, user_id: str, now: Optional[int] = None) -> dict:
+    # Folds observed sales older than the raw retention window into the price_history series. The latest
+    # SALES_WINDOW sales of every series stay raw whatever their age, so sell price estimates do not move
+    now = today() if now is None else now
+    cutoff = now - RAW_RETENTION_DAYS
+    old = [sale for sale in select_all(
+        lambda: sb.table("observed_sales").select("id,product_id,platform,is_demo,sold_price,sold_at")
+        .eq("user_id", user_id).lt("sold_at", from_day(cutoff)).order("id")) if sale.get("product_id")]
+    if not old:
+        return {"compacted": 0, "series": 0}
+
+    ranked = defaultdict(list)
+    for sale in select_in(
+            lambda: sb.table("observed_sales").select("id,product_id,platform,is_demo,sold_at").eq("user_id", user_id)
+            .order("sold_at", desc=True).order("id"), "product_id", sorted({sale["product_id"] for sale in old})):
+        ranked[(sale["product_id"], sale["platform"], None)].append(sale["id"])
+        if not sale.get("is_demo"):
+            ranked[(sale["product_id"], sale["platform"], False)].append(sale["id"])
+    # Kept if it is among the latest of the view with demo sales or of the one without
+    keep = {sale_id for ids in ranked.values() for sale_id in ids[:SALES_WINDOW]}
+
+    points = defaultdict(lambda: ([], []))
+    compacted = [sale for sale in old if sale["id"] not in keep]
+    for sale in compacted:
+        days, prices = points[(sale["product_id"], sale["platform"], bool(sale.get("is_demo")))]
+        days.append(to_day(sale["sold_at"]))
+        prices.append(float(sale["sold_price"]))
+
+    existing = {(h["product_id"], h["platform"], h["is_demo"]): h for h in select_all(
+        lambda: sb.table("price_history").select("product_id,platform,is_demo,days,counts,mins,medians,maxs,compacted_through")
+        .eq("user_id", user_id).order("product_id").order("platform").order("is_demo"))}
+    rows = []
+    for key in sorted(set(existing) | set(points)):
+        row = existing.get(key)
+        series = PriceSeries.from_row(row) if row else PriceSeries()
+        if key in points:
+            series = series.merge(PriceSeries.from_points(*points[key]))
+        series = series.compact(now)
+        through = max((row or {}).get("compacted_through") or 0, cutoff if key in points else 0)
+        if row is None or key in points or len(series) != len(row["days"] or []):
+            rows.append({"user_id": user_id, "product_id": key[0], "platform": key[1], "is_demo": key[2],
+                         "compacted_through": through, **series.to_row()})
+
+    # Series are written before the raw sales go: an interruption counts those sales twice rather than losing them
+    for chunk in chunks(rows):
+        sb.table("price_history").upsert(chunk, on_conflict="user_id,product_id,platform,is_demo",
+                                         returning=ReturnMethod.minimal).execute()
+    for chunk in chunks([sale["id"] for sale in compacted]):
+        sb.table("observed_sales").delete().eq("user_id", user_id).in_("id", chunk).execute()
+
+    sales_stats.invalidate(user_id, {key[0] for key in points})
+    if compacted:
+        snapshot_cache.invalidate(user_id)
+    return {"compacted": len(compacted), "series": len(rows)}
+
+def ingest_listings(sb: Client, user_id: str, items: List[ListingIn]) -> dict:
+    rows = [listing_row(user_id, item) for item in items]
+    unique = dedupe(rows)
+    upsert_listings(sb, unique)
+    return {"received": len(rows), "duplicates": len(rows) - len(unique), "upserted": len(unique)}
+
+def ingest_browser_searches(sb: Client, user_id: str, searches: List[BrowserSearchIn]) -> dict:
+    rows = [row for search in searches for row in browser_search_rows(user_id, search)]
+    unique = dedupe(rows)
+    upsert_listings(sb, unique)
+    return {"received": len(rows), "duplicates": len(rows) - len(unique), "upserted": len(unique)}
+
+def ingest_sales(sb: Client, user_id: str, items: List[ObservedSaleIn]) -> dict:
+    rows = [sale_row(user_id, item) for item in items]
+    unique = dedupe(rows)
+    inserted, existing = insert_sales(sb, user_id, unique)
+    return {"received": len(rows), "duplicates": len(rows) - len(unique) + existing, "inserted": len(inserted)}
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional
+
+from products import Product, products_from_rows
+
+SCRAPE_QUEUE_PATH = os.getenv("SCRAPE_QUEUE_PATH", "")
+JOB_TIMEOUT_SECONDS = float(os.getenv("SCRAPE_JOB_TIMEOUT_SECONDS", "60"))
+JOB_LEASE_SECONDS = float(os.getenv("SCRAPE_JOB_LEASE_SECONDS", "30"))
+JOB_RETENTION_SECONDS = float(os.getenv("SCRAPE_JOB_RETENTION_SECONDS", "3600"))
+POLL_SECONDS = 0.1
+MAX_POLL_SECONDS = 0.5
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_EXPIRED = 'expired'
+
+# Worker-side outcomes the API maps back onto its own scraper statuses
+ERROR_TIMED_OUT = 'timed_out'
+
+class JobFailed(Exception):
+    pass
+
+class SQLiteJobQueue:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit: claims open their own BEGIN IMMEDIATE so two workers never take the same job
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scrape_jobs ("
+            "id TEXT PRIMARY KEY, platform TEXT NOT NULL, keywords TEXT NOT NULL, max_results INTEGER NOT NULL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, expires_at REAL NOT NULL, leased_until REAL, finished_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scrape_jobs_pending ON scrape_jobs (status, created_at)")
+
+    def enqueue(self, platform: str, keywords: List[str], max_results: int,
+                timeout: float = JOB_TIMEOUT_SECONDS) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO scrape_jobs (id, platform, keywords, max_results, status, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, platform, json.dumps(keywords, ensure_ascii=False), max_results, JOB_QUEUED, now, now + timeout)
+            )
+        return job_id
+
+    def claim(self, worker: str, platforms: List[str]) -> Optional[dict]:
+        if not platforms:
+            return None
+        now = time.time()
+        marks = ", ".join("?" for _ in platforms)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE scrape_jobs SET status = ?, finished_at = ? WHERE status IN (?, ?) AND expires_at <= ?",
+                    (JOB_EXPIRED, now, JOB_QUEUED, JOB_RUNNING, now)
+                )
+                # A running job whose lease lapsed belonged to a worker that died; it goes back in line
+                row = self._conn.execute(
+                    f"SELECT id, platform, keywords, max_results, expires_at FROM scrape_jobs "
+                    f"WHERE (status = ? OR (status = ? AND leased_until <= ?)) AND platform IN ({marks}) "
+                    f"ORDER BY created_at LIMIT 1",
+                    (JOB_QUEUED, JOB_RUNNING, now, *platforms)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE scrape_jobs SET status = ?, worker = ?, attempts = attempts + 1, leased_until = ? WHERE id = ?",
+                        (JOB_RUNNING, worker, now + JOB_LEASE_SECONDS, row[0])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {'id': row[0], 'platform': row[1], 'keywords': json.loads(row[2]), 'max_results': row[3],
+                'expires_at': row[4]}
+
+    def renew(self, worker: str, job_ids: List[str]):
+        if not job_ids:
+            return
+        marks = ", ".join("?" for _ in job_ids)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE scrape_jobs SET leased_until = ? WHERE worker = ? AND status = ? AND id IN ({marks})",
+                (time.time() + JOB_LEASE_SECONDS, worker, JOB_RUNNING, *job_ids)
+            )
+
+    def _finish(self, job_id: str, worker: str, status: str, result: Optional[str], error: Optional[str]):
+        # Only the worker holding the lease may finish a job; a requeued copy belongs to someone else
+        with self._lock:
+            self._conn.execute(
+                "UPDATE scrape_jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (status, result, error, time.time(), job_id, worker, JOB_RUNNING)
+            )
+
+    def complete(self, job_id: str, worker: str, products: List[Product]):
+        payload = json.dumps([product.to_row() for product in products], ensure_ascii=False)
+        self._finish(job_id, worker, JOB_DONE, payload, None)
+
+    def fail(self, job_id: str, worker: str, error: str):
+        self._finish(job_id, worker, JOB_FAILED, None, error)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, platform, keywords, max_results, status, attempts, worker, result, error, "
+                "created_at, expires_at, finished_at FROM scrape_jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(('id', 'platform', 'keywords', 'max_results', 'status', 'attempts', 'worker', 'result',
+                        'error', 'created_at', 'expires_at', 'finished_at'), row))
+        job['keywords'] = json.loads(job['keywords'])
+        if job['status'] in (JOB_QUEUED, JOB_RUNNING) and job['expires_at'] <= time.time():
+            job['status'] = JOB_EXPIRED
+        job['products'] = products_from_rows(json.loads(job.pop('result'))) if job['status'] == JOB_DONE else None
+        return job
+
+    def purge(self, retention: float = JOB_RETENTION_SECONDS):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM scrape_jobs WHERE status IN (?, ?, ?) AND COALESCE(finished_at, expires_at) <= ?",
+                (JOB_DONE, JOB_FAILED, JOB_EXPIRED, time.time() - retention)
+            )
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM scrape_jobs GROUP BY status").fetchall())
+            workers = self._conn.execute(
+                "SELECT COUNT(DISTINCT worker) FROM scrape_jobs WHERE status = ? AND leased_until > ?",
+                (JOB_RUNNING, time.time())
+            ).fetchone()[0]
+        return {**{status: counts.get(status, 0) for status in (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_EXPIRED)},
+                'busy_workers': workers, 'path': self.path}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+async def wait_for_job(queue: SQLiteJobQueue, job_id: str, timeout: float) -> dict:
+    # Returns the job as soon as it finishes, or as it stands when the timeout runs out
+    deadline = time.monotonic() + timeout
+    delay = POLL_SECONDS
+    while True:
+        job = await asyncio.to_thread(queue.get, job_id)
+        remaining = deadline - time.monotonic()
+        if job is None or job['status'] not in (JOB_QUEUED, JOB_RUNNING) or remaining <= 0:
+            return job
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, MAX_POLL_SECONDS)
+
+async def run_job(queue: SQLiteJobQueue, platform: str, keywords: List[str], max_results: int) -> List[Product]:
+    job_id = await asyncio.to_thread(queue.enqueue, platform, keywords, max_results)
+    job = await wait_for_job(queue, job_id, JOB_TIMEOUT_SECONDS)
+    if job is None:
+        raise JobFailed(f"{platform}: trabajo {job_id} desaparecido de la cola")
+    if job['status'] == JOB_DONE:
+        return job['products']
+    if job['status'] in (JOB_QUEUED, JOB_RUNNING, JOB_EXPIRED) or job['error'] == ERROR_TIMED_OUT:
+        raise asyncio.TimeoutError(f"{platform}: trabajo {job_id} sin terminar")
+    raise JobFailed(job['error'])
+
+def queued_search(queue: SQLiteJobQueue, platform: str):
+    async def search(keywords: List[str], max_results: int = 20) -> List[Product]:
+        return await run_job(queue, platform, keywords, max_results)
+    return search
+
+def queued_stream(queue: SQLiteJobQueue, platform: str):
+    # Workers hand back a platform's results in one piece, so the stream gets a single batch
+    async def stream(keywords: List[str], max_results: int = 20) -> AsyncIterator[List[Product]]:
+        products = await run_job(queue, platform, keywords, max_results)
+        if products:
+            yield products
+    return stream
+
+def _default_queue() -> Optional[SQLiteJobQueue]:
+    return SQLiteJobQueue(SCRAPE_QUEUE_PATH) if SCRAPE_QUEUE_PATH else None
+
+job_queue = _default_queue()
@@ -0,0 +1,21 @@
+import logging
+import os
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+ROOT_LOGGER = "arbitraje"
+
+def _configure() -> logging.Logger:
+    root = logging.getLogger(ROOT_LOGGER)
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        # Uvicorn installs its own handlers on the root logger; ours must not print twice
+        root.propagate = False
+    return root
+
+def get_logger(name: str) -> logging.Logger:
+    _configure()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
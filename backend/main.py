@@ -1,15 +1,72 @@
-﻿from fastapi import FastAPI, HTTPException
+﻿from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, List, Literal, Optional
+from contextlib import asynccontextmanager
 import asyncio
+import json
+import time
+import os
+import orjson
 
-from wallapop_scraper import search_wallapop
-from ebay_scraper import search_ebay_sold
-from vinted_scraper import search_vinted
-from catawiki_scraper import search_catawiki_closed
+from auth import current_user, jwks_cache
+from compression import CompressionMiddleware
+from browser_pool import browser_pool
+from http_fetch import fetch_mode, http_fetcher
+from job_queue import JOB_QUEUED, job_queue, queued_search, queued_stream, wait_for_job
+from logger import get_logger
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, registry, span, timing_breakdown
+from ingest import parse_items, ingest_listings, ingest_browser_searches, ingest_sales, compact_price_history
+from models import ListingIn, BrowserSearchIn, ObservedSaleIn, RefreshIn, DemoLoadIn, WhatIfIn, OpportunityQuery, ScrapeJobIn, \
+    PriceHistoryQuery
+from supabase_client import get_supabase, close_supabase, run_sync
+from opportunities import OPPORTUNITY_COLUMNS, list_opportunities, refresh as refresh_opportunities
+from demo import load_demo
+from sales_stats import price_history
+from whatif import what_if
+from search_cache import search_cache
+from watchlist_scheduler import watchlist_scheduler, SCHEDULER_ENABLED
+from scraper_runner import SEARCH_DEADLINE_SECONDS, search_platforms, get_runner, runner_states, record_result, BreakerOpenError, RateLimitedError, \
+    STATUS_OK, STATUS_CACHED, STATUS_STALE, STATUS_TIMED_OUT, STATUS_BREAKER_OPEN, STATUS_RATE_LIMITED, STATUS_ERROR
+from product_matching import DEFAULT_THRESHOLD
+from arbitrage_engine import find_opportunities, find_page
+from pagination import encode_cursor, decode_cursor, cursor_number, cursor_sort, cursor_uuid
+from products import OPPORTUNITY_FIELDS
 
-app = FastAPI(title="Arbitraje Inteligente API")
+from wallapop_scraper import search_wallapop, stream_wallapop
+from ebay_scraper import search_ebay_sold, stream_ebay_sold
+from vinted_scraper import search_vinted, stream_vinted
+from catawiki_scraper import search_catawiki_closed, stream_catawiki_closed
+from scrape_worker import spawn_workers, stop_workers
+
+logger = get_logger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    jwks_url = os.getenv("SUPABASE_JWKS_URL", "")
+    if jwks_url:
+        await jwks_cache(jwks_url).start()
+    # With a job queue the browsers live in the worker processes, never in the API
+    workers = []
+    if job_queue is not None:
+        workers = spawn_workers(job_queue.path)
+    else:
+        await browser_pool.start()
+    if SCHEDULER_ENABLED:
+        watchlist_scheduler.start(PLATFORM_SEARCHES)
+    try:
+        yield
+    finally:
+        await watchlist_scheduler.stop()
+        await asyncio.to_thread(stop_workers, workers)
+        await browser_pool.stop()
+        await http_fetcher.close()
+        if jwks_url:
+            await jwks_cache(jwks_url).stop()
+        close_supabase()
+
+app = FastAPI(title="Arbitraje Inteligente API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,72 +75,61 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 class SearchRequest(BaseModel):
     keywords: List[str]
-    max_results: int = 20
+    max_results: int = Field(20, ge=1, le=200)
+    min_match_confidence: float = DEFAULT_THRESHOLD
+    deadline_seconds: Optional[float] = None
+    buy_platforms: Optional[List[str]] = None
+    sell_platforms: Optional[List[str]] = None
+    min_net_profit: Optional[float] = None
+    min_roi: Optional[float] = None
+    sort_by: Literal['roi_percent', 'net_profit'] = 'roi_percent'
+    limit: int = Field(50, ge=1, le=500)
+    cursor: Optional[str] = None
+    fields: Optional[List[str]] = None
 
-PLATFORM_FEES = {
-    'wallapop': {'buy': 0.05, 'sell': 0.05},
-    'ebay': {'buy': 0.0, 'sell': 0.125},
-    'vinted': {'buy': 0.0, 'sell': 0.05},
-    'catawiki': {'buy': 0.09, 'sell': 0.09}
+    def projection(self) -> Optional[List[str]]:
+        unknown = [name for name in self.fields or [] if name not in OPPORTUNITY_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Campos desconocidos: {', '.join(unknown)}")
+        return self.fields
+
+    def sides(self, platforms) -> tuple:
+        buy = [p for p in platforms if self.buy_platforms is None or p in self.buy_platforms]
+        sell = [p for p in platforms if self.sell_platforms is None or p in self.sell_platforms]
+        return buy, sell
+
+    def filters(self) -> dict:
+        return {'sort_by': self.sort_by, 'min_net_profit': self.min_net_profit, 'min_roi': self.min_roi}
+
+PLATFORM_SEARCHES = {
+    'wallapop': search_wallapop,
+    'ebay': search_ebay_sold,
+    'vinted': search_vinted,
+    'catawiki': search_catawiki_closed
 }
 
-SHIPPING_COSTS = {
-    'wallapop': 5.0,
-    'ebay': 7.0,
-    'vinted': 6.0,
-    'catawiki': 8.0
+PLATFORM_STREAMS = {
+    'wallapop': stream_wallapop,
+    'ebay': stream_ebay_sold,
+    'vinted': stream_vinted,
+    'catawiki': stream_catawiki_closed
 }
 
-def calculate_arbitrage_opportunity(buy_product: dict, sell_product: dict) -> dict:
-    buy_platform = buy_product['platform']
-    sell_platform = sell_product['platform']
-    
-    buy_price = buy_product['price']
-    buy_commission = buy_price * PLATFORM_FEES[buy_platform]['buy']
-    buy_shipping = SHIPPING_COSTS[buy_platform]
-    
-    sell_price = sell_product['price']
-    sell_commission = sell_price * PLATFORM_FEES[sell_platform]['sell']
-    sell_shipping = SHIPPING_COSTS[sell_platform]
-    payment_fee = sell_price * 0.03
-    
-    packaging = 2.0
-    taxes = (sell_price - buy_price) * 0.19 if sell_price > buy_price else 0
-    
-    total_investment = buy_price + buy_commission + buy_shipping + packaging
-    total_costs = total_investment + sell_commission + sell_shipping + payment_fee + taxes
-    net_profit = sell_price - total_costs
-    
-    roi_percent = (net_profit / total_investment * 100) if total_investment > 0 else 0
-    score = min(100, max(0, roi_percent))
-    
-    return {
-        'buy_title': buy_product['title'],
-        'buy_price': round(buy_price, 2),
-        'buy_platform': buy_platform,
-        'buy_url': buy_product.get('url', ''),
-        'sell_title': sell_product['title'],
-        'sell_price': round(sell_price, 2),
-        'sell_platform': sell_platform,
-        'sell_url': sell_product.get('url', ''),
-        'net_profit': round(net_profit, 2),
-        'roi_percent': round(roi_percent, 2),
-        'score': round(score, 2),
-        'total_investment': round(total_investment, 2),
-        'costs_breakdown': {
-            'buy_price': round(buy_price, 2),
-            'buy_commission': round(buy_commission, 2),
-            'buy_shipping': round(buy_shipping, 2),
-            'sell_commission': round(sell_commission, 2),
-            'sell_shipping': round(sell_shipping, 2),
-            'payment_fee': round(payment_fee, 2),
-            'packaging': round(packaging, 2),
-            'taxes': round(taxes, 2)
-        }
-    }
+if job_queue is not None:
+    # Scrapes go to the worker processes; the API keeps its cache, deadlines and circuit breakers in front
+    PLATFORM_SEARCHES = {platform: search_cache.cached(platform)(queued_search(job_queue, platform))
+                         for platform in PLATFORM_SEARCHES}
+    PLATFORM_STREAMS = {platform: queued_stream(job_queue, platform) for platform in PLATFORM_STREAMS}
+
+def require_job_queue():
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Cola de scraping desactivada (SCRAPE_QUEUE_PATH)")
+    return job_queue
 
 @app.get("/")
 async def root():
@@ -93,68 +139,275 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return search_cache.stats()
+
+@app.get("/api/scrapers/status")
+async def scrapers_status():
+    http = http_fetcher.stats()
+    return {
+        platform: {**state, 'fetch_mode': fetch_mode(platform), 'http': http.get(platform)}
+        for platform, state in runner_states().items()
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+registry.collected("arbitraje_search_cache_lookups_total", "Consultas a la caché de búsquedas", "counter",
+                   lambda: {(name,): search_cache.counters[name] for name in ('hits', 'stale_hits', 'misses')},
+                   ("result",))
+registry.collected("arbitraje_search_cache_bytes", "Bytes ocupados por la caché de búsquedas", "gauge",
+                   lambda: {(): search_cache.stats()['bytes']})
+registry.collected("arbitraje_browser_active_pages", "Páginas del navegador en uso", "gauge",
+                   lambda: {(): browser_pool.stats()['active_pages']})
+registry.collected("arbitraje_http_fetch_total", "Peticiones HTTP de los scrapers por resultado", "counter",
+                   lambda: {(platform, name): value for platform, counters in http_fetcher.stats().items()
+                            for name, value in counters.items()},
+                   ("platform", "result"))
+if job_queue is not None:
+    registry.collected("arbitraje_scrape_jobs", "Trabajos de scraping en la cola por estado", "gauge",
+                       lambda: {(status,): count for status, count in job_queue.stats().items()
+                                if status not in ('busy_workers', 'path')},
+                       ("status",))
+
+@app.post("/api/scrape-jobs")
+async def create_scrape_job(body: ScrapeJobIn):
+    queue = require_job_queue()
+    try:
+        await get_runner(body.platform).bucket.acquire(0)
+    except RateLimitedError:
+        raise HTTPException(status_code=429, detail=f"Límite de peticiones para {body.platform}")
+    job_id = await asyncio.to_thread(queue.enqueue, body.platform, body.keywords, body.max_results)
+    return {'job_id': job_id, 'status': JOB_QUEUED}
+
+@app.get("/api/scrape-jobs/stats")
+async def scrape_jobs_stats():
+    return await asyncio.to_thread(require_job_queue().stats)
+
+@app.get("/api/scrape-jobs/{job_id}")
+async def get_scrape_job(job_id: str, wait: float = Query(0, ge=0, le=30)):
+    job = await wait_for_job(require_job_queue(), job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    products = job.pop('products')
+    return ORJSONResponse({**job, 'products': [product.to_dict() for product in products] if products is not None else None})
+
+@app.get("/api/scheduler/status")
+async def scheduler_status():
+    return watchlist_scheduler.stats()
+
 @app.post("/api/search-arbitrage")
 async def search_arbitrage(request: SearchRequest):
+    after = cursor_sort(decode_cursor(request.cursor, (str,), (int,), (str,), (str,)), request.sort_by)
+    fields = request.projection()
     try:
         keywords = request.keywords
         max_results = request.max_results
+        buy, sell = request.sides(PLATFORM_SEARCHES)
+        searches = {platform: search for platform, search in PLATFORM_SEARCHES.items() if platform in buy or platform in sell}
         
-        print(f"🔍 Buscando en todas las plataformas: {keywords}")
-        
-        results = await asyncio.gather(
-            search_wallapop(keywords, max_results),
-            search_ebay_sold(keywords, max_results),
-            search_vinted(keywords, max_results),
-            search_catawiki_closed(keywords, max_results),
-            return_exceptions=True
-        )
-        
-        wallapop_products = results[0] if not isinstance(results[0], Exception) else []
-        ebay_products = results[1] if not isinstance(results[1], Exception) else []
-        vinted_products = results[2] if not isinstance(results[2], Exception) else []
-        catawiki_products = results[3] if not isinstance(results[3], Exception) else []
-        
-        all_products = {
-            'wallapop': wallapop_products,
-            'ebay': ebay_products,
-            'vinted': vinted_products,
-            'catawiki': catawiki_products
-        }
+        logger.info(f"🔍 Buscando en {', '.join(searches)}: {keywords}")
         
-        print(f"📊 Resultados: Wallapop={len(wallapop_products)}, eBay={len(ebay_products)}, Vinted={len(vinted_products)}, Catawiki={len(catawiki_products)}")
+        results = await search_platforms(searches, keywords, max_results, request.deadline_seconds)
+        all_products = {platform: result['products'] for platform, result in results.items()}
         
-        opportunities = []
+        logger.info("📊 Resultados: " + ", ".join(f"{platform}={len(result['products'])} ({result['status']})" for platform, result in results.items()))
         
-        for buy_platform, buy_products in all_products.items():
-            for sell_platform, sell_products in all_products.items():
-                if buy_platform == sell_platform:
-                    continue
-                
-                for buy_product in buy_products:
-                    for sell_product in sell_products:
-                        if sell_product['price'] > buy_product['price'] * 1.2:
-                            opportunity = calculate_arbitrage_opportunity(buy_product, sell_product)
-                            
-                            if opportunity['roi_percent'] > 0:
-                                opportunities.append(opportunity)
-        
-        opportunities.sort(key=lambda x: x['roi_percent'], reverse=True)
-        opportunities = opportunities[:50]
+        opportunities, last = find_page(
+            {p: all_products[p] for p in buy}, {p: all_products[p] for p in sell},
+            top_k=request.limit, min_confidence=request.min_match_confidence,
+            after=tuple(after) if after else None, **request.filters()
+        )
         
-        print(f"✅ Encontradas {len(opportunities)} oportunidades de arbitraje")
+        logger.info(f"✅ Encontradas {len(opportunities)} oportunidades de arbitraje")
         
-        return {
+        # Built from plain dicts/str/float only, so orjson can render it without FastAPI's encoder pass
+        body = {
             'success': True,
             'total_opportunities': len(opportunities),
-            'opportunities': opportunities,
+            'opportunities': [opportunity.to_dict(fields) for opportunity in opportunities],
+            'next_cursor': encode_cursor([request.sort_by, *last]) if last else None,
+            'partial': any(result['status'] not in (STATUS_OK, STATUS_CACHED, STATUS_STALE) for result in results.values()),
             'platforms_searched': {
-                'wallapop': len(wallapop_products),
-                'ebay': len(ebay_products),
-                'vinted': len(vinted_products),
-                'catawiki': len(catawiki_products)
+                platform: {'count': len(result['products']), 'status': result['status']}
+                for platform, result in results.items()
             }
         }
+        timings = timing_breakdown()
+        if timings is not None:
+            body['timings'] = timings
+        return ORJSONResponse(body)
         
     except Exception as e:
-        print(f"❌ Error en búsqueda: {str(e)}")
+        logger.error(f"❌ Error en búsqueda: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _stream_opportunities(request: SearchRequest) -> AsyncIterator[str]:
+    keywords, max_results, min_confidence = request.keywords, request.max_results, request.min_match_confidence
+    buy, sell = request.sides(PLATFORM_STREAMS)
+    filters = request.filters()
+    fields = request.projection()
+    queue: asyncio.Queue = asyncio.Queue()
+    # Same overall deadline as the non-streaming search: a hung platform ends as timed_out
+    deadline = time.monotonic() + (request.deadline_seconds or SEARCH_DEADLINE_SECONDS)
+    
+    async def consume(platform: str):
+        cached = await search_cache.peek(platform, keywords, max_results)
+        if cached is not None:
+            if cached:
+                await queue.put((platform, cached, None))
+            await queue.put((platform, None, STATUS_CACHED))
+            return
+        
+        products = []
+        async def pump():
+            async with get_runner(platform).guard(deadline - time.monotonic(), deadline):
+                async for batch in PLATFORM_STREAMS[platform](keywords, max_results):
+                    products.extend(batch)
+                    await queue.put((platform, batch, None))
+        
+        try:
+            with span('search', platform):
+                await asyncio.wait_for(pump(), max(0.0, deadline - time.monotonic()))
+        except BreakerOpenError:
+            status = STATUS_BREAKER_OPEN
+        except RateLimitedError:
+            status = STATUS_RATE_LIMITED
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱️ {platform} superó el tiempo límite (streaming)")
+            status = STATUS_TIMED_OUT
+        except Exception as e:
+            logger.error(f"❌ Error scraping {platform}: {str(e)}")
+            status = STATUS_ERROR
+        else:
+            await search_cache.put(platform, search_cache.key(platform, keywords, max_results), products)
+            await queue.put((platform, None, STATUS_OK))
+            return
+        # Nothing streamed yet: an expired cache entry beats an empty platform
+        stale = None if products else await search_cache.peek(platform, keywords, max_results, allow_stale=True)
+        if stale:
+            await queue.put((platform, stale, None))
+            status = STATUS_STALE
+        await queue.put((platform, None, status))
+    
+    platforms = [platform for platform in PLATFORM_STREAMS if platform in buy or platform in sell]
+    tasks = [asyncio.create_task(consume(platform)) for platform in platforms]
+    all_products = {platform: [] for platform in platforms}
+    statuses = {}
+    total_opportunities = 0
+    pending = len(tasks)
+    
+    try:
+        while pending:
+            platform, batch, status = await queue.get()
+            if batch is None:
+                pending -= 1
+                statuses[platform] = status
+                record_result(platform, status, len(all_products[platform]))
+                yield json.dumps({'type': 'platform_done', 'platform': platform, 'count': len(all_products[platform]), 'status': status}) + "\n"
+                continue
+            
+            new_batch = {platform: batch}
+            buy_side = {p: products for p, products in all_products.items() if p in buy}
+            sell_side = {p: products for p, products in all_products.items() if p in sell}
+            opportunities = (find_opportunities(new_batch, sell_side, min_confidence=min_confidence, **filters) if platform in buy else []) \
+                + (find_opportunities(buy_side, new_batch, min_confidence=min_confidence, **filters) if platform in sell else [])
+            all_products[platform].extend(batch)
+            
+            yield json.dumps({'type': 'products', 'platform': platform, 'count': len(all_products[platform])}) + "\n"
+            if opportunities:
+                opportunities.sort(key=lambda x: getattr(x, request.sort_by), reverse=True)
+                total_opportunities += len(opportunities)
+                yield orjson.dumps({'type': 'opportunities', 'opportunities': [o.to_dict(fields) for o in opportunities]}) + b"\n"
+        
+        logger.info(f"✅ Streaming completado: {total_opportunities} oportunidades de arbitraje")
+        done = {
+            'type': 'done',
+            'total_opportunities': total_opportunities,
+            'platforms_searched': {
+                platform: {'count': len(products), 'status': statuses.get(platform)}
+                for platform, products in all_products.items()
+            }
+        }
+        timings = timing_breakdown()
+        if timings is not None:
+            done['timings'] = timings
+        yield json.dumps(done) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@app.post("/api/search-arbitrage/stream")
+async def search_arbitrage_stream(request: SearchRequest):
+    request.projection()
+    logger.info(f"🔍 Buscando (streaming) en todas las plataformas: {request.keywords}")
+    return StreamingResponse(
+        _stream_opportunities(request),
+        media_type="application/x-ndjson"
+    )
+
+async def _ingest(request: Request, model, ingest, user_id: str) -> dict:
+    items, rejected = parse_items(await request.body(), request.headers.get("content-type", ""), model)
+    result = await run_sync(ingest, get_supabase(), user_id, items) if items else {"received": 0}
+    logger.info(f"📥 Ingesta {model.__name__}: {len(items)} válidos, {len(rejected)} rechazados")
+    return {**result, "rejected": rejected}
+
+@app.post("/api/ingest/listings")
+async def ingest_listings_route(request: Request, user_id: str = Depends(current_user)):
+    return await _ingest(request, ListingIn, ingest_listings, user_id)
+
+@app.post("/api/ingest/browser-searches")
+async def ingest_browser_searches_route(request: Request, user_id: str = Depends(current_user)):
+    return await _ingest(request, BrowserSearchIn, ingest_browser_searches, user_id)
+
+@app.post("/api/ingest/observed-sales")
+async def ingest_observed_sales_route(request: Request, user_id: str = Depends(current_user)):
+    return await _ingest(request, ObservedSaleIn, ingest_sales, user_id)
+
+@app.get("/api/opportunities")
+async def list_opportunities_route(query: OpportunityQuery = Depends(), user_id: str = Depends(current_user)):
+    params = query.model_dump()
+    sort = f"{query.sort_by}.{query.order}"
+    after = cursor_sort(decode_cursor(query.cursor, (str,), (int, float), (str,)), sort)
+    if after:
+        after = [cursor_number(after[0], integer=query.sort_by == "est_days_to_sell"), cursor_uuid(after[1])]
+    params["after"] = after
+    params["fields"] = [name.strip() for name in query.fields.split(",") if name.strip()] if query.fields else None
+    unknown = [name for name in params["fields"] or [] if name not in OPPORTUNITY_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos desconocidos: {', '.join(unknown)}")
+    result = await run_sync(list_opportunities, get_supabase(), user_id, params)
+    return ORJSONResponse({
+        "opportunities": result["opportunities"],
+        "next_cursor": encode_cursor([sort, *result["after"]]) if result["after"] else None,
+    })
+
+@app.get("/api/price-history")
+async def price_history_route(query: PriceHistoryQuery = Depends(), user_id: str = Depends(current_user)):
+    if query.start and query.end and query.start > query.end:
+        raise HTTPException(status_code=400, detail="start debe ser anterior a end")
+    return await run_sync(price_history, get_supabase(), user_id, query.model_dump())
+
+@app.post("/api/price-history/compact")
+async def compact_price_history_route(user_id: str = Depends(current_user)):
+    result = await run_sync(compact_price_history, get_supabase(), user_id)
+    logger.info(f"🗜️ Historial de precios compactado: {result['compacted']} ventas en {result['series']} series")
+    return result
+
+@app.post("/api/opportunities/refresh")
+async def refresh_route(body: RefreshIn, user_id: str = Depends(current_user)):
+    return await run_sync(refresh_opportunities, get_supabase(), user_id, body.model_dump())
+
+@app.post("/api/opportunities/what-if")
+async def what_if_route(body: WhatIfIn, user_id: str = Depends(current_user)):
+    return await run_sync(what_if, get_supabase(), user_id, body.model_dump())
+
+@app.post("/api/demo/load")
+async def demo_load_route(body: DemoLoadIn, user_id: str = Depends(current_user)):
+    result = await run_sync(load_demo, get_supabase(), user_id, body.force)
+    if not result["ok"]:
+        raise HTTPException(status_code=result["status"], detail=result["message"])
+    return result
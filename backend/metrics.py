@@ -0,0 +1,229 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+TIMING_HEADER = "x-timing"
+TIMING_PARAM = "timing"
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in [*zip(names, values), *extra]]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    return "+Inf" if value == float('inf') else repr(float(value))
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in items]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class Collected(_Metric):
+    # Values read from a callback at scrape time, for state other modules already keep
+    def __init__(self, name: str, help: str, kind: str, collect: Callable[[], Dict[Tuple[str, ...], float]],
+                 labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> Iterable[str]:
+        values = self.collect()
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in sorted(values.items())]
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collected(self, name: str, help: str, kind: str, collect: Callable[[], Dict[Tuple[str, ...], float]],
+                  labels: Sequence[str] = ()) -> Collected:
+        return self.register(Collected(name, help, kind, collect, labels))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                continue
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram("arbitraje_stage_seconds", "Duración de cada etapa del camino crítico",
+                                   ("stage", "platform"))
+HTTP_REQUESTS = registry.counter("arbitraje_http_requests_total", "Peticiones HTTP atendidas",
+                                 ("method", "route", "status"))
+HTTP_SECONDS = registry.histogram("arbitraje_http_request_seconds", "Duración de las peticiones HTTP",
+                                  ("method", "route"))
+
+# Set per request when the caller opts into a timing breakdown; None means nobody is listening
+_timings: ContextVar[Optional[list]] = ContextVar("arbitraje_timings", default=None)
+
+def add_timing(stage: str, label: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, label, seconds))
+
+def record(stage: str, seconds: float, platform: str = ''):
+    STAGE_SECONDS.observe(seconds, stage=stage, platform=platform)
+    add_timing(stage, platform, seconds)
+
+@contextmanager
+def span(stage: str, platform: str = ''):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, platform)
+
+def timing_breakdown() -> Optional[List[dict]]:
+    timings = _timings.get()
+    if timings is None:
+        return None
+    totals: Dict[Tuple[str, str], list] = {}
+    for stage, label, seconds in list(timings):
+        entry = totals.setdefault((stage, label), [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    return [
+        {'stage': stage, 'label': label or None, 'ms': round(total * 1000, 1), 'count': count}
+        for (stage, label), (total, count) in totals.items()
+    ]
+
+def server_timing(breakdown: List[dict]) -> str:
+    return ", ".join(
+        f"{entry['stage']}{'.' + entry['label'] if entry['label'] else ''};dur={entry['ms']}" for entry in breakdown
+    )
+
+def _opted_in(scope: Scope) -> bool:
+    flag = Headers(scope=scope).get(TIMING_HEADER) or QueryParams(scope.get("query_string", b"")).get(TIMING_PARAM)
+    return (flag or '').lower() in ('1', 'true', 'yes')
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    def _route(self, scope: Scope) -> str:
+        # Labelled by route template, not raw path, so path parameters cannot blow up cardinality
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._routes.get(endpoint)
+        if path is None:
+            routes = getattr(getattr(scope.get("app"), "router", None), "routes", [])
+            path = next((route.path for route in routes if getattr(route, "endpoint", None) is endpoint), "unmatched")
+            self._routes[endpoint] = path
+        return path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _timings.set([] if _opted_in(scope) else None)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                breakdown = timing_breakdown()
+                if breakdown is not None:
+                    breakdown.append({'stage': 'total', 'label': None,
+                                      'ms': round((time.perf_counter() - start) * 1000, 1), 'count': 1})
+                    MutableHeaders(raw=message["headers"]).append("server-timing", server_timing(breakdown))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            route = self._route(scope)
+            HTTP_REQUESTS.inc(method=scope["method"], route=route, status=str(status))
+            HTTP_SECONDS.observe(time.perf_counter() - start, method=scope["method"], route=route)
+            _timings.reset(token)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, List, Literal
+from pydantic import BaseModel, Field
+from typing import Dict, Optional, List, Literal
 from datetime import date
 
 Platform = Literal["wallapop","vinted","ebay","catawiki","miravia"]
@@ -49,6 +49,52 @@ class RefreshIn(BaseModel):
     min_net_margin: float = 10.0
     limit: int = 200
     include_demo: bool = False
+    listing_ids: Optional[List[str]] = None
+    full: bool = False
+
+class FeeOverride(BaseModel):
+    fee_percent: Optional[float] = None
+    fee_fixed: Optional[float] = None
+
+class WhatIfIn(BaseModel):
+    platforms_buy: List[Platform] = ["wallapop","vinted"]
+    platforms_sell: List[Platform] = ["ebay"]
+    min_roi: float = 0.10
+    min_net_margin: float = 10.0
+    limit: int = 200
+    include_demo: bool = False
+    packaging_cost: Optional[float] = None
+    tax_rate: Optional[float] = None
+    tax_enabled: Optional[bool] = None
+    risk_buffer: Optional[float] = None
+    platform_fees: Dict[Platform, FeeOverride] = {}
+    sweep: Dict[str, List[float]] = {}
+    top: int = 20
+
+class OpportunityQuery(BaseModel):
+    buy_platform: Optional[Platform] = None
+    sell_platform: Optional[Platform] = None
+    category: Optional[str] = None
+    min_net_margin: Optional[float] = None
+    min_roi: Optional[float] = None
+    include_demo: bool = False
+    sort_by: Literal["total_score","net_margin","roi","est_sell_price","est_days_to_sell"] = "total_score"
+    order: Literal["desc","asc"] = "desc"
+    limit: int = Field(50, ge=1, le=500)
+    cursor: Optional[str] = None
+    fields: Optional[str] = None
+
+class PriceHistoryQuery(BaseModel):
+    product_id: str
+    platform: Platform
+    start: Optional[date] = None
+    end: Optional[date] = None
+    include_demo: bool = False
 
 class DemoLoadIn(BaseModel):
     force: bool = False
+
+class ScrapeJobIn(BaseModel):
+    platform: Literal["wallapop","vinted","ebay","catawiki"]
+    keywords: List[str] = Field(..., min_length=1)
+    max_results: int = Field(20, ge=1, le=200)
@@ -1,6 +1,21 @@
-from statistics import median
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+import numpy as np
 from urllib.parse import quote_plus
 from supabase import Client
+from postgrest.types import CountMethod, ReturnMethod
+
+from product_index import product_index_cache
+from supabase_client import chunks, run_parallel, select_all, select_in
+from sales_stats import SalesWindow, sales_stats
+from scoring import demand_scores, estimate_sell_price, score_batch
+
+PRODUCT_MATCH_THRESHOLD = 0.6
+# imported_at is the inserting transaction's start time, so a listing can commit after a refresh
+# with an earlier stamp; incremental refreshes re-scan this far back and skip ids already seen
+LISTINGS_LAG_SECONDS = float(os.getenv("REFRESH_LISTINGS_LAG_SECONDS", "300"))
 
 def sell_search_url(platform: str, keyword: str) -> str:
     q = quote_plus(keyword)
@@ -28,103 +43,343 @@ def breakeven(invested: float, fee_sell_percent: float, fee_sell_fixed: float,
         return 999999.0
     return (invested + fee_sell_fixed + ship_sell + packaging) / denom
 
+def _resolve_products(sb: Client, user_id: str, listings: list, persist: bool = True) -> dict:
+    listing_ids = [lst["id"] for lst in listings]
+    product_of = {}
+    for m in select_in(lambda: sb.table("listing_product_match").select("listing_id,product_id").eq("user_id", user_id).order("listing_id"),
+                        "listing_id", listing_ids):
+        product_of.setdefault(m["listing_id"], m["product_id"])
+
+    unmatched = [lst for lst in listings if lst["id"] not in product_of]
+    if not unmatched:
+        return product_of
+
+    # product match or create simple product by title; the index is kept per user across refreshes
+    index = product_index_cache.get(sb, user_id)
+    if not persist:
+        # Read-only callers match against existing products only; a title nothing matches has no product yet
+        with index.lock:
+            for lst in unmatched:
+                best = index.best(lst["title"] or "", PRODUCT_MATCH_THRESHOLD)
+                product_of[lst["id"]] = best[0] if best else None
+        return product_of
+
+    with index.lock:
+        new_products = []
+        resolved = []
+        try:
+            for lst in unmatched:
+                best = index.best(lst["title"] or "", PRODUCT_MATCH_THRESHOLD)
+                if best:
+                    resolved.append((lst, best[0], round(best[1], 2)))
+                    continue
+                canonical = (lst["title"] or "")[:120]
+                placeholder = ("new", len(new_products))
+                index.add(placeholder, [canonical])
+                resolved.append((lst, placeholder, 0.7))
+                new_products.append({
+                    "user_id": user_id, "canonical_name": canonical, "category": lst.get("category"),
+                    "aliases": [], "liquidity_class": "medium", "is_demo": bool(lst.get("is_demo", False))
+                })
+
+            created = []
+            for chunk in chunks(new_products):
+                created.extend(sb.table("products").insert(chunk).execute().data)
+            index.resolve({("new", i): product["id"] for i, product in enumerate(created)})
+        except Exception:
+            # Placeholders must not outlive this refresh
+            product_index_cache.invalidate(user_id)
+            raise
+
+    match_rows = []
+    for lst, product_id, confidence in resolved:
+        if isinstance(product_id, tuple):
+            product_id = created[product_id[1]]["id"]
+        product_of[lst["id"]] = product_id
+        match_rows.append({
+            "listing_id": lst["id"], "product_id": product_id, "user_id": user_id,
+            "confidence": confidence, "method": "auto_title"
+        })
+    for chunk in chunks(match_rows):
+        sb.table("listing_product_match").upsert(chunk, returning=ReturnMethod.minimal).execute()
+    return product_of
+
+def _listings_query(sb: Client, user_id: str, body: dict, columns: str = "*", count=None):
+    q = sb.table("listings").select(columns, count=count).eq("user_id", user_id).in_("platform", body["platforms_buy"])
+    if not body.get("include_demo", False):
+        q = q.eq("is_demo", False)
+    return q
+
 def refresh(sb: Client, user_id: str, body: dict) -> dict:
-    settings = sb.table("user_settings").select("*").eq("user_id", user_id).single().execute().data
-    fees = sb.table("platform_fees").select("*").eq("user_id", user_id).execute().data
+    targeted = body.get("listing_ids") is not None
+    settings, fees, watermark = run_parallel(
+        lambda: sb.table("user_settings").select("*").eq("user_id", user_id).single().execute().data,
+        lambda: sb.table("platform_fees").select("*").eq("user_id", user_id).execute().data,
+        lambda: None if targeted else sb.table("refresh_watermarks").select("*").eq("user_id", user_id).limit(1).execute().data
+    )
     fee = {f["platform"]: f for f in fees}
 
-    q = sb.table("listings").select("*").eq("user_id", user_id).in_("platform", body["platforms_buy"]).order("imported_at", desc=True).limit(body["limit"])
-    if not body.get("include_demo", False):
+    def listings_query(columns: str = "*", count=None):
+        return _listings_query(sb, user_id, body, columns, count)
+
+    def sales_query():
+        q = sb.table("observed_sales").select("id,product_id,sold_at").eq("user_id", user_id).in_("platform", body["platforms_sell"])
+        if not body.get("include_demo", False):
+            q = q.eq("is_demo", False)
+        return q
+
+    version = _config_version(settings, fees, body)
+    watermark = watermark[0] if watermark else None
+    skipped = 0
+    if targeted:
+        mode = "targeted"
+        listings = select_in(lambda: listings_query().order("id"), "id", body["listing_ids"])
+    else:
+        if body.get("full") or watermark is None or watermark["config_version"] != version:
+            mode = "full"
+            listings = listings_query().order("imported_at", desc=True).limit(body["limit"]).execute().data
+            latest = sales_query().order("sold_at", desc=True).limit(1).execute().data
+            sales_mark = str(latest[0]["sold_at"]) if latest else None
+            new_sales = sales_query().eq("sold_at", sales_mark).execute().data if sales_mark else []
+        else:
+            mode = "incremental"
+            listings, new_sales, scanned = _changed_listings(sb, user_id, watermark, listings_query, sales_query)
+            sales_mark = watermark["sales_sold_at"]
+            total = listings_query("id", CountMethod.exact).limit(1).execute().count or 0
+            skipped = max(0, total - len(listings))
+
+        sales_mark, sales_ids = _advance_sales_mark(watermark if mode == "incremental" else None, sales_mark, new_sales)
+        listings_mark, listing_ids = _advance_listings_mark(watermark if mode == "incremental" else None,
+                                                            [*scanned, *listings] if mode == "incremental" else listings)
+
+    if not listings:
+        result = {"updated": 0, "recomputed": 0, "skipped": skipped, "mode": mode}
+    else:
+        result = _recompute(sb, user_id, body, settings, fee, listings)
+        result.update({"recomputed": len(listings), "skipped": skipped, "mode": mode})
+
+    if mode != "targeted":
+        sb.table("refresh_watermarks").upsert({
+            "user_id": user_id, "config_version": version, "listings_imported_at": listings_mark,
+            "listings_boundary_ids": listing_ids, "sales_sold_at": sales_mark, "sales_boundary_ids": sales_ids
+        }, on_conflict="user_id", returning=ReturnMethod.minimal).execute()
+    return result
+
+def _config_version(settings: dict, fees: list, body: dict) -> str:
+    # Any change to settings, fees or the refresh scope invalidates every stored opportunity
+    scope = {k: body.get(k) for k in ("platforms_buy", "platforms_sell", "min_roi", "min_net_margin", "include_demo")}
+    payload = json.dumps([settings, sorted(fees, key=lambda f: f["platform"]), scope], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+def _changed_listings(sb: Client, user_id: str, watermark: dict, listings_query, sales_query):
+    def new_listings():
+        q = listings_query()
+        if watermark["listings_imported_at"]:
+            q = q.gte("imported_at", _lagged(watermark["listings_imported_at"]))
+        return q.order("imported_at").order("id")
+
+    def new_sales():
+        q = sales_query()
+        if watermark["sales_sold_at"]:
+            q = q.gte("sold_at", watermark["sales_sold_at"])
+        return q.order("sold_at").order("id")
+
+    scanned = select_all(new_listings)
+    seen_listings = set(watermark.get("listings_boundary_ids") or [])
+    listings = [lst for lst in scanned if lst["id"] not in seen_listings]
+    seen = set(watermark.get("sales_boundary_ids") or [])
+    sales = [sale for sale in select_all(new_sales) if sale["id"] not in seen]
+
+    sold_products = sorted({sale["product_id"] for sale in sales if sale.get("product_id")})
+    if sold_products:
+        sales_stats.invalidate(user_id, sold_products)
+        known = {lst["id"] for lst in listings}
+        listing_ids = sorted({m["listing_id"] for m in select_in(
+            lambda: sb.table("listing_product_match").select("listing_id").eq("user_id", user_id).order("listing_id"),
+            "product_id", sold_products)} - known)
+        listings.extend(select_in(lambda: listings_query().order("id"), "id", listing_ids))
+    return listings, sales, scanned
+
+def _parse_time(value) -> datetime:
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+def _lagged(mark) -> str:
+    return (_parse_time(mark) - timedelta(seconds=LISTINGS_LAG_SECONDS)).isoformat()
+
+def _advance_listings_mark(watermark: dict, listings: list):
+    # Every listing seen inside the lag window below the new mark is remembered, so the next
+    # re-scan of that window skips it; the scan brings back the earlier ones as well
+    stamped = {(_parse_time(lst["imported_at"]), lst["id"]) for lst in listings if lst.get("imported_at")}
+    marks = [stamp for stamp, _ in stamped]
+    if watermark and watermark["listings_imported_at"]:
+        marks.append(_parse_time(watermark["listings_imported_at"]))
+    if not marks:
+        return None, []
+    mark = max(marks)
+    floor = mark - timedelta(seconds=LISTINGS_LAG_SECONDS)
+    return mark.isoformat(), sorted(listing_id for stamp, listing_id in stamped if stamp >= floor)
+
+def _advance_sales_mark(watermark: dict, sales_mark: str, new_sales: list):
+    # sold_at is a date, so remember which sales on the boundary day were already seen
+    ids = set(watermark.get("sales_boundary_ids") or []) if watermark else set()
+    for sale in new_sales:
+        sold_at = str(sale["sold_at"])
+        if sales_mark is None or sold_at > sales_mark:
+            sales_mark, ids = sold_at, set()
+        if sold_at == sales_mark:
+            ids.add(sale["id"])
+    return sales_mark, sorted(ids)
+
+LIQUIDITY_CLASSES = ("high", "medium", "low")
+
+def _load_snapshot_inputs(sb: Client, user_id: str, body: dict, listings: list, persist: bool = True):
+    product_of = _resolve_products(sb, user_id, listings, persist)
+    product_ids = sorted({pid for pid in product_of.values() if pid is not None})
+    products, sales = run_parallel(
+        lambda: {p["id"]: p for p in select_in(
+            lambda: sb.table("products").select("id,canonical_name,liquidity_class").eq("user_id", user_id).order("id"), "id", product_ids)},
+        lambda: sales_stats.summaries(sb, user_id, product_ids, body["platforms_sell"], body.get("include_demo", False))
+    )
+    sales.update({(None, plat): SalesWindow().summary() for plat in body["platforms_sell"]})
+    return product_of, products, sales
+
+def build_snapshot(listings: list, product_of: dict, products: dict, sales: dict, sell_platforms: list) -> dict:
+    # One row per listing x sell platform, listing-major like the original nested loop.
+    # Only inputs that do not depend on settings or fees are stored, so they can be re-scored freely
+    platforms = list(dict.fromkeys([*(lst["platform"] for lst in listings), *sell_platforms]))
+    code = {platform: i for i, platform in enumerate(platforms)}
+    n_sell = len(sell_platforms)
+    liquidity = {name: i for i, name in enumerate(LIQUIDITY_CLASSES)}
+
+    buy_cols = np.array([
+        (float(lst["price"]), float(lst["shipping_price"] or 0.0), code[lst["platform"]],
+         liquidity.get(products.get(product_of[lst["id"]], {}).get("liquidity_class", "medium"), liquidity["medium"]))
+        for lst in listings
+    ], dtype=np.float64).reshape(-1, 4)
+    p_buy, ship_buy, buy_code, liquidity_code = (np.repeat(buy_cols[:, i], n_sell) for i in range(4))
+
+    window, median, p25, velocity, trend = np.array([
+        (stats["window"], stats["median"] if stats["median"] is not None else np.nan, stats["p25"] if stats["p25"] is not None else np.nan,
+         stats["velocity"], stats["trend"])
+        for stats in (sales[(product_of[lst["id"]], sell_plat)] for lst in listings for sell_plat in sell_platforms)
+    ], dtype=np.float64).reshape(-1, 5).T
+
+    return {
+        "listing_ids": [lst["id"] for lst in listings],
+        "product_ids": [product_of[lst["id"]] for lst in listings],
+        "is_demo": [bool(lst.get("is_demo", False)) for lst in listings],
+        "sell_platforms": list(sell_platforms),
+        "platforms": platforms,
+        "listing_idx": np.repeat(np.arange(len(listings)), n_sell),
+        "sell_idx": np.tile(np.arange(n_sell), len(listings)),
+        "buy_code": buy_code.astype(np.int64),
+        "sell_code": np.tile(np.array([code[p] for p in sell_platforms], dtype=np.int64), len(listings)),
+        "liquidity_code": liquidity_code.astype(np.int64),
+        "p_buy": p_buy,
+        "ship_buy": ship_buy,
+        "p_sell": estimate_sell_price(p_buy, window, median, p25),
+        "demand": demand_scores(velocity, trend),
+    }
+
+def evaluate_snapshot(snapshot: dict, settings: dict, fee: dict) -> dict:
+    no_fee = {"fee_percent": 0.0, "fee_fixed": 0.0}
+    fee_percent = np.array([float(fee.get(p, no_fee)["fee_percent"]) for p in snapshot["platforms"]], dtype=np.float64)
+    fee_fixed = np.array([float(fee.get(p, no_fee)["fee_fixed"]) for p in snapshot["platforms"]], dtype=np.float64)
+    liquidity_days = np.array([int(settings[f"liquidity_days_{name}"]) for name in LIQUIDITY_CLASSES], dtype=np.int64)
+    est_days = liquidity_days[snapshot["liquidity_code"]]
+    buy_code, sell_code = snapshot["buy_code"], snapshot["sell_code"]
+
+    scores = score_batch(snapshot["p_buy"], snapshot["ship_buy"], fee_percent[buy_code], fee_fixed[buy_code],
+                         snapshot["p_sell"], fee_percent[sell_code], fee_fixed[sell_code], est_days,
+                         float(settings["packaging_cost"]), float(settings["tax_rate"]),
+                         bool(settings["tax_enabled"]), float(settings["risk_buffer"]), snapshot.get("demand"))
+    scores["est_sell_price"] = snapshot["p_sell"]
+    scores["est_days_to_sell"] = est_days
+    return scores
+
+def passes_thresholds(scores: dict, min_net_margin: float, min_roi: float) -> np.ndarray:
+    return ~((scores["net_margin"] < min_net_margin) | (scores["roi"] < min_roi))
+
+def opportunity_row(user_id: str, snapshot: dict, scores: dict, i: int) -> dict:
+    listing = snapshot["listing_idx"][i]
+    return {
+        "user_id": user_id,
+        "buy_listing_id": snapshot["listing_ids"][listing],
+        "sell_platform": snapshot["sell_platforms"][snapshot["sell_idx"][i]],
+        "product_id": snapshot["product_ids"][listing],
+        "est_sell_price": round(float(scores["est_sell_price"][i]),2),
+        "net_margin": round(float(scores["net_margin"][i]),2),
+        "roi": round(float(scores["roi"][i]),4),
+        "breakeven_sell_price": round(float(scores["breakeven_sell_price"][i]),2),
+        "est_days_to_sell": int(scores["est_days_to_sell"][i]),
+        "demand_score": round(float(scores["demand_score"][i]),2),
+        "liquidity_score": round(float(scores["liquidity_score"][i]),2),
+        "total_score": round(float(scores["total_score"][i]),2),
+        "is_demo": snapshot["is_demo"][listing],
+    }
+
+def load_settings(sb: Client, user_id: str):
+    settings, fees = run_parallel(
+        lambda: sb.table("user_settings").select("*").eq("user_id", user_id).single().execute().data,
+        lambda: sb.table("platform_fees").select("*").eq("user_id", user_id).execute().data
+    )
+    return settings, {f["platform"]: f for f in fees}
+
+def load_snapshot(sb: Client, user_id: str, body: dict) -> dict:
+    # Read-only: unlike a refresh it never creates products or listing matches
+    listings = _listings_query(sb, user_id, body).order("imported_at", desc=True).limit(body["limit"]).execute().data
+    product_of, products, sales = _load_snapshot_inputs(sb, user_id, body, listings, persist=False) if listings else ({}, {}, {})
+    return build_snapshot(listings, product_of, products, sales, body["platforms_sell"])
+
+def _recompute(sb: Client, user_id: str, body: dict, settings: dict, fee: dict, listings: list) -> dict:
+    snapshot = build_snapshot(listings, *_load_snapshot_inputs(sb, user_id, body, listings), body["platforms_sell"])
+    scores = evaluate_snapshot(snapshot, settings, fee)
+    keep = passes_thresholds(scores, body["min_net_margin"], body["min_roi"])
+    rows = [opportunity_row(user_id, snapshot, scores, i) for i in np.flatnonzero(keep).tolist()]
+
+    for chunk in chunks(rows):
+        sb.table("opportunities").upsert(chunk, on_conflict="user_id,buy_listing_id,sell_platform", returning=ReturnMethod.minimal).execute()
+
+    return {"updated": len(rows)}
+
+OPPORTUNITY_COLUMNS = ("id", "buy_listing_id", "sell_platform", "product_id", "est_sell_price", "net_margin", "roi",
+                       "breakeven_sell_price", "est_days_to_sell", "demand_score", "liquidity_score", "total_score",
+                       "is_demo", "listings")
+LISTING_EMBED = "listings!inner(platform,title,url,price,category)"
+
+def opportunity_columns(fields: list, sort_by: str, embed: bool) -> str:
+    # id and the sort column always travel along because the next cursor is built from them
+    wanted = [c for c in OPPORTUNITY_COLUMNS if c in fields or c in ("id", sort_by)] if fields else list(OPPORTUNITY_COLUMNS)
+    if "listings" in wanted:
+        wanted[wanted.index("listings")] = LISTING_EMBED
+    elif embed:
+        wanted.append("listings!inner(platform,category)")
+    return ",".join(wanted)
+
+def list_opportunities(sb: Client, user_id: str, query: dict) -> dict:
+    # Keyset pagination over (sort column, id) so deep pages cost the same as the first one
+    col, desc = query["sort_by"], query["order"] == "desc"
+    columns = opportunity_columns(query.get("fields") or [], col, bool(query.get("buy_platform") or query.get("category")))
+    q = sb.table("opportunities").select(columns).eq("user_id", user_id)
+    if query.get("buy_platform"):
+        q = q.eq("listings.platform", query["buy_platform"])
+    if query.get("sell_platform"):
+        q = q.eq("sell_platform", query["sell_platform"])
+    if query.get("category"):
+        q = q.eq("listings.category", query["category"])
+    if query.get("min_net_margin") is not None:
+        q = q.gte("net_margin", query["min_net_margin"])
+    if query.get("min_roi") is not None:
+        q = q.gte("roi", query["min_roi"])
+    if not query.get("include_demo", False):
         q = q.eq("is_demo", False)
-    listings = q.execute().data
-
-    updated = 0
-    for lst in listings:
-        # product match or create simple product by title
-        m = sb.table("listing_product_match").select("product_id").eq("user_id", user_id).eq("listing_id", lst["id"]).limit(1).execute().data
-        product_id = m[0]["product_id"] if m else None
-        if not product_id:
-            canonical = (lst["title"] or "")[:120]
-            ex = sb.table("products").select("id").eq("user_id", user_id).eq("canonical_name", canonical).limit(1).execute().data
-            if ex:
-                product_id = ex[0]["id"]
-            else:
-                product_id = sb.table("products").insert({
-                    "user_id": user_id, "canonical_name": canonical, "category": lst.get("category"),
-                    "aliases": [], "liquidity_class": "medium", "is_demo": bool(lst.get("is_demo", False))
-                }).execute().data[0]["id"]
-            sb.table("listing_product_match").upsert({
-                "listing_id": lst["id"], "product_id": product_id, "user_id": user_id,
-                "confidence": 0.7, "method": "auto_title"
-            }).execute()
-
-        prod = sb.table("products").select("*").eq("user_id", user_id).eq("id", product_id).single().execute().data
-        keyword = prod["canonical_name"]
-
-        liquidity = prod.get("liquidity_class","medium")
-        est_days = int(settings["liquidity_days_medium"])
-        if liquidity == "high":
-            est_days = int(settings["liquidity_days_high"])
-        elif liquidity == "low":
-            est_days = int(settings["liquidity_days_low"])
-
-        p_buy = float(lst["price"])
-        ship_buy = float(lst["shipping_price"] or 0.0)
-
-        fb = fee.get(lst["platform"], {"fee_percent":0.0,"fee_fixed":0.0})
-        fee_buy = p_buy * float(fb["fee_percent"]) + float(fb["fee_fixed"])
-        invested = p_buy + fee_buy + ship_buy
-
-        for sell_plat in body["platforms_sell"]:
-            obsq = sb.table("observed_sales").select("sold_price").eq("user_id", user_id).eq("platform", sell_plat).eq("product_id", product_id).order("sold_at", desc=True).limit(50)
-            if not body.get("include_demo", False):
-                obsq = obsq.eq("is_demo", False)
-            obs = obsq.execute().data
-            if len(obs) >= 5:
-                p_sell = float(median([float(x["sold_price"]) for x in obs]))
-            else:
-                p_sell = p_buy * 1.35
-
-            fs = fee.get(sell_plat, {"fee_percent":0.0,"fee_fixed":0.0})
-            fee_sell = p_sell * float(fs["fee_percent"]) + float(fs["fee_fixed"])
-
-            ship_sell = 0.0
-            packaging = float(settings["packaging_cost"])
-            tax_enabled = bool(settings["tax_enabled"])
-            tax_rate = float(settings["tax_rate"])
-            risk_buffer = float(settings["risk_buffer"])
-            tax = p_sell * tax_rate if tax_enabled else 0.0
-            risk = p_sell * risk_buffer
-
-            net_margin = (p_sell - fee_sell - ship_sell - packaging - tax - risk) - invested
-            roi = (net_margin / invested) if invested > 0 else 0.0
-            be = breakeven(invested, float(fs["fee_percent"]), float(fs["fee_fixed"]), ship_sell, packaging, tax_rate, tax_enabled, risk_buffer)
-
-            score_nm = clamp(net_margin/100.0, 0.0, 1.0) * 30.0
-            score_roi = clamp(roi/0.40, 0.0, 1.0) * 20.0
-            profit_score = score_nm + score_roi
-            liquidity_score = clamp(1.0 - (est_days/60.0), 0.0, 1.0) * 25.0
-            demand_score = 12.5
-            total_score = profit_score + liquidity_score + demand_score
-
-            if net_margin < body["min_net_margin"] or roi < body["min_roi"]:
-                continue
-
-            sb.table("opportunities").upsert({
-                "user_id": user_id,
-                "buy_listing_id": lst["id"],
-                "sell_platform": sell_plat,
-                "product_id": product_id,
-                "est_sell_price": round(p_sell,2),
-                "net_margin": round(net_margin,2),
-                "roi": round(roi,4),
-                "breakeven_sell_price": round(be,2),
-                "est_days_to_sell": est_days,
-                "demand_score": round(demand_score,2),
-                "liquidity_score": round(liquidity_score,2),
-                "total_score": round(total_score,2),
-                "is_demo": bool(lst.get("is_demo", False)),
-            }, on_conflict="user_id,buy_listing_id,sell_platform").execute()
-            updated += 1
-
-    return {"updated": updated}
+    if query.get("after"):
+        # Both parts were validated when the cursor was decoded (a number and a uuid)
+        value, last_id = query["after"]
+        op = "lt" if desc else "gt"
+        q = q.or_(f"{col}.{op}.{value},and({col}.eq.{value},id.{op}.{last_id})")
+
+    rows = q.order(col, desc=desc).order("id", desc=desc).limit(query["limit"] + 1).execute().data
+    page = rows[:query["limit"]]
+    after = [page[-1][col], page[-1]["id"]] if len(rows) > query["limit"] else None
+    return {"opportunities": page, "after": after}
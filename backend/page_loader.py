@@ -0,0 +1,109 @@
+import os
+import time
+from typing import List, Optional
+from urllib.parse import urlparse
+from playwright.async_api import BrowserContext, Page, Route, TimeoutError as PlaywrightTimeoutError
+
+from metrics import record
+
+BLOCKED_RESOURCE_TYPES = {'image', 'media', 'font'}
+
+TRACKER_DOMAINS = (
+    'google-analytics.com',
+    'googletagmanager.com',
+    'googlesyndication.com',
+    'googleadservices.com',
+    'doubleclick.net',
+    'facebook.net',
+    'connect.facebook.com',
+    'hotjar.com',
+    'criteo.com',
+    'criteo.net',
+    'scorecardresearch.com',
+    'taboola.com',
+    'outbrain.com',
+    'bat.bing.com',
+    'tiktok.com',
+    'segment.io',
+    'optimizely.com',
+    'newrelic.com',
+    'nr-data.net',
+    'sentry.io',
+    'datadoghq.com',
+    'onetrust.com',
+    'cookielaw.org'
+)
+
+NAVIGATION_TIMEOUT_MS = int(os.getenv("SCRAPER_NAV_TIMEOUT_MS", "30000"))
+RESULTS_TIMEOUT_MS = int(os.getenv("SCRAPER_WAIT_TIMEOUT_MS", "8000"))
+SCROLL_TIMEOUT_MS = int(os.getenv("SCRAPER_SCROLL_TIMEOUT_MS", "4000"))
+MAX_PAGES = int(os.getenv("SCRAPER_MAX_PAGES", "10"))
+BLOCK_RESOURCES = os.getenv("SCRAPER_BLOCK_RESOURCES", "1") not in ("0", "false", "False")
+
+class PageLoad:
+    def __init__(self, selector: Optional[str], navigation_ms: float, wait_ms: float):
+        self.selector = selector
+        self.navigation_ms = navigation_ms
+        self.wait_ms = wait_ms
+
+    @property
+    def ready(self) -> bool:
+        return self.selector is not None
+
+    def as_dict(self) -> dict:
+        return {
+            'selector': self.selector,
+            'navigation_ms': round(self.navigation_ms, 1),
+            'wait_ms': round(self.wait_ms, 1)
+        }
+
+def is_tracker(url: str) -> bool:
+    host = urlparse(url).hostname or ''
+    return any(host == domain or host.endswith('.' + domain) for domain in TRACKER_DOMAINS)
+
+async def _route_handler(route: Route):
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or is_tracker(request.url):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def install_resource_blocking(context: BrowserContext):
+    if BLOCK_RESOURCES:
+        await context.route("**/*", _route_handler)
+
+async def load_results(page: Page, url: str, selectors: List[str], timeout_ms: Optional[int] = None,
+                       platform: str = '') -> PageLoad:
+    timeout_ms = RESULTS_TIMEOUT_MS if timeout_ms is None else timeout_ms
+
+    start = time.perf_counter()
+    await page.goto(url, wait_until='domcontentloaded', timeout=NAVIGATION_TIMEOUT_MS)
+    navigated = time.perf_counter()
+
+    selector = None
+    try:
+        await page.wait_for_selector(", ".join(selectors), state='attached', timeout=timeout_ms)
+        for candidate in selectors:
+            if await page.query_selector(candidate):
+                selector = candidate
+                break
+    except PlaywrightTimeoutError:
+        pass
+
+    done = time.perf_counter()
+    record('navigation', navigated - start, platform)
+    record('wait', done - navigated, platform)
+    return PageLoad(selector, (navigated - start) * 1000, (done - navigated) * 1000)
+
+async def scroll_for_more(page: Page, card_selector: str, known: int, timeout_ms: Optional[int] = None) -> bool:
+    timeout_ms = SCROLL_TIMEOUT_MS if timeout_ms is None else timeout_ms
+    await page.evaluate("() => window.scrollTo(0, document.body.scrollHeight)")
+    try:
+        await page.wait_for_function(
+            "([selector, known]) => document.querySelectorAll(selector).length > known",
+            arg=[card_selector, known],
+            timeout=timeout_ms
+        )
+        return True
+    except PlaywrightTimeoutError:
+        return False
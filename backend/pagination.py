@@ -0,0 +1,47 @@
+import base64
+import json
+import math
+import uuid
+from typing import Any, List, Optional, Tuple
+from fastapi import HTTPException
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: Optional[str], *types: Tuple[type, ...]) -> Optional[list]:
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if not isinstance(values, list) or len(values) != len(types) \
+            or not all(isinstance(v, t) and not isinstance(v, bool) for v, t in zip(values, types)):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return values
+
+def cursor_sort(values: Optional[list], sort: str) -> Optional[list]:
+    # Cursors lead with the ordering they were issued for; resuming another ordering would skip or repeat rows
+    if values is None:
+        return None
+    if values[0] != sort:
+        raise HTTPException(status_code=400, detail="El cursor corresponde a otra ordenación")
+    return values[1:]
+
+# Cursor values that end up inside a PostgREST filter string are re-checked and rewritten
+# in canonical form, so a crafted cursor cannot smuggle in filter syntax
+
+def cursor_uuid(value: str) -> str:
+    try:
+        return str(uuid.UUID(value))
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def cursor_number(value, integer: bool = False):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if integer:
+        if isinstance(value, float) and not value.is_integer():
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        return int(value)
+    return value
@@ -0,0 +1,134 @@
+import os
+from datetime import date, timedelta
+from typing import Iterable, Optional, Tuple
+import numpy as np
+
+RAW_RETENTION_DAYS = int(os.getenv("PRICE_HISTORY_RAW_DAYS", "30"))
+DAILY_RETENTION_DAYS = int(os.getenv("PRICE_HISTORY_DAILY_DAYS", "180"))
+MAX_WEEKS = int(os.getenv("PRICE_HISTORY_MAX_WEEKS", "104"))
+VELOCITY_WINDOW_DAYS = 28
+TREND_WINDOW_DAYS = 84
+
+EPOCH = date(1970, 1, 1)
+
+def to_day(value) -> int:
+    return (date.fromisoformat(str(value)[:10]) - EPOCH).days
+
+def from_day(day: int) -> str:
+    return (EPOCH + timedelta(days=int(day))).isoformat()
+
+def today() -> int:
+    return (date.today() - EPOCH).days
+
+def week_start(days):
+    # Day 0 was a Thursday; weekly buckets start on Mondays
+    return days - (days + 3) % 7
+
+class PriceSeries:
+    # Sales of one product on one platform as parallel arrays of buckets, oldest first.
+    # A bucket covers one day, or one week once it is older than the daily retention window
+    __slots__ = ('day', 'count', 'low', 'median', 'high')
+
+    def __init__(self, day: Iterable = (), count: Iterable = (), low: Iterable = (), median: Iterable = (),
+                 high: Iterable = ()):
+        self.day = np.asarray(day, dtype=np.int32)
+        self.count = np.asarray(count, dtype=np.int32)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.median = np.asarray(median, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.day)
+
+    @classmethod
+    def from_points(cls, days: Iterable[int], prices: Iterable[float]) -> "PriceSeries":
+        days = np.asarray(days, dtype=np.int32)
+        prices = np.asarray(prices, dtype=np.float64)
+        if not len(days):
+            return cls()
+        order = np.lexsort((prices, days))
+        days, prices = days[order], prices[order]
+        unique, starts, counts = np.unique(days, return_index=True, return_counts=True)
+        median = (prices[starts + (counts - 1) // 2] + prices[starts + counts // 2]) / 2
+        return cls(unique, counts, prices[starts], median, prices[starts + counts - 1])
+
+    @classmethod
+    def from_row(cls, row: dict) -> "PriceSeries":
+        return cls(row["days"] or [], row["counts"] or [], row["mins"] or [], row["medians"] or [], row["maxs"] or [])
+
+    def to_row(self) -> dict:
+        return {
+            "days": self.day.tolist(),
+            "counts": self.count.tolist(),
+            "mins": np.round(self.low, 2).tolist(),
+            "medians": np.round(self.median, 2).tolist(),
+            "maxs": np.round(self.high, 2).tolist(),
+        }
+
+    def buckets(self) -> list:
+        return [
+            {"start": from_day(d), "count": int(c), "min": round(float(lo), 2), "median": round(float(m), 2),
+             "max": round(float(hi), 2)}
+            for d, c, lo, m, hi in zip(self.day, self.count, self.low, self.median, self.high)
+        ]
+
+    def merge(self, other: "PriceSeries") -> "PriceSeries":
+        if not len(other):
+            return self
+        if not len(self):
+            return other
+        return _collapse(np.concatenate([self.day, other.day]), np.concatenate([self.count, other.count]),
+                         np.concatenate([self.low, other.low]), np.concatenate([self.median, other.median]),
+                         np.concatenate([self.high, other.high]))
+
+    def between(self, start: int, end: int) -> "PriceSeries":
+        # Buckets starting in [start, end)
+        lo, hi = np.searchsorted(self.day, [start, end], side='left')
+        return PriceSeries(self.day[lo:hi], self.count[lo:hi], self.low[lo:hi], self.median[lo:hi], self.high[lo:hi])
+
+    def downsample(self, before: int) -> "PriceSeries":
+        before = int(week_start(before))
+        old = self.day < before
+        if not old.any():
+            return self
+        return _collapse(np.where(old, week_start(self.day), self.day), self.count, self.low, self.median, self.high)
+
+    def compact(self, now: int) -> "PriceSeries":
+        # Weekly past the daily window, nothing past MAX_WEEKS: a series stays bounded however long it runs
+        oldest = int(week_start(now)) - MAX_WEEKS * 7
+        return self.downsample(now - DAILY_RETENTION_DAYS).between(oldest, np.iinfo(np.int32).max)
+
+def _collapse(day: np.ndarray, count: np.ndarray, low: np.ndarray, median: np.ndarray, high: np.ndarray) -> PriceSeries:
+    # Buckets with the same start are combined; their median is the count-weighted median of the bucket medians
+    order = np.lexsort((median, day))
+    day, count, low, median, high = day[order], count[order], low[order], median[order], high[order]
+    unique, starts = np.unique(day, return_index=True)
+    totals = np.add.reduceat(count, starts)
+    group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(day))))
+    cumulative = np.cumsum(count)
+    within = cumulative - (cumulative[starts] - count[starts])[group]
+    reached = np.flatnonzero(within * 2 >= totals[group])
+    first = reached[np.searchsorted(group[reached], np.arange(len(starts)))]
+    return PriceSeries(unique, totals, np.minimum.reduceat(low, starts), median[first], np.maximum.reduceat(high, starts))
+
+def signals(series: PriceSeries, now: Optional[int] = None) -> Tuple[float, float]:
+    # (sales per week over the velocity window, relative median change per week over the trend window);
+    # NaN where the history is too thin to say
+    if not len(series):
+        return float('nan'), float('nan')
+    now = today() if now is None else now
+    recent = series.between(now - VELOCITY_WINDOW_DAYS + 1, now + 1)
+    velocity = float(recent.count.sum()) * 7 / VELOCITY_WINDOW_DAYS
+
+    span = series.between(now - TREND_WINDOW_DAYS + 1, now + 1)
+    if len(span) < 2:
+        return velocity, float('nan')
+    weights = span.count.astype(np.float64)
+    x = span.day.astype(np.float64)
+    x_mean = np.average(x, weights=weights)
+    y_mean = np.average(span.median, weights=weights)
+    spread = np.sum(weights * (x - x_mean) ** 2)
+    if spread == 0 or y_mean <= 0:
+        return velocity, float('nan')
+    slope = np.sum(weights * (x - x_mean) * (span.median - y_mean)) / spread
+    return velocity, float(slope * 7 / y_mean)
@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from supabase import Client
+
+from product_matching import TitleMatcher
+from supabase_client import select_all
+
+PRODUCT_INDEX_TTL_SECONDS = int(os.getenv("PRODUCT_INDEX_TTL_SECONDS", "600"))
+PRODUCT_INDEX_MAX_USERS = int(os.getenv("PRODUCT_INDEX_MAX_USERS", "256"))
+
+class ProductIndex:
+    # Title index over a user's product names and aliases; doc ids map to product ids
+    def __init__(self, products: List[dict]):
+        self.matcher = TitleMatcher()
+        self.product_ids: List[object] = []
+        # Held while matching, and while adding products the same refresh creates
+        self.lock = threading.Lock()
+        for p in products:
+            self.add(p["id"], [p["canonical_name"], *(p.get("aliases") or [])])
+
+    def add(self, product_id, names: List[str]):
+        for name in names:
+            self.matcher.add(name)
+            self.product_ids.append(product_id)
+
+    def best(self, title: str, threshold: float) -> Optional[Tuple[object, float]]:
+        best = self.matcher.best(title, threshold)
+        return (self.product_ids[best[0]], best[1]) if best else None
+
+    def resolve(self, placeholders: dict):
+        # Swaps the placeholders of products added before they were inserted for their real ids
+        self.product_ids = [placeholders.get(p, p) if isinstance(p, tuple) else p for p in self.product_ids]
+
+class ProductIndexCache:
+    def __init__(self, ttl: int = PRODUCT_INDEX_TTL_SECONDS, max_entries: int = PRODUCT_INDEX_MAX_USERS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, ProductIndex]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, sb: Client, user_id: str) -> ProductIndex:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.counters['hits'] += 1
+                return entry[1]
+            self.counters['misses'] += 1
+
+        products = select_all(lambda: sb.table("products").select("id,canonical_name,aliases").eq("user_id", user_id).order("id"))
+        index = ProductIndex(products)
+        with self._lock:
+            self._entries[user_id] = (time.monotonic(), index)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.counters['invalidations'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, 'entries': len(self._entries)}
+
+product_index_cache = ProductIndexCache()
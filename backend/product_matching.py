@@ -0,0 +1,258 @@
+import functools
+import math
+import re
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+STOPWORDS = {
+    'a', 'al', 'con', 'como', 'de', 'del', 'el', 'en', 'la', 'las', 'los', 'para', 'por', 'sin', 'un', 'una', 'y', 'o',
+    'and', 'for', 'in', 'of', 'the', 'with', 'or',
+    'nuevo', 'nueva', 'nuevos', 'nuevas', 'new', 'usado', 'usada', 'used', 'perfecto', 'estado', 'buen', 'muy',
+    'original', 'originales', 'oferta', 'envio', 'gratis', 'vendo', 'precintado', 'sealed',
+    'gen', 'generation', 'generacion'
+}
+
+_STORAGE = re.compile(r'\b(\d+(?:[.,]\d+)?)\s*(gb|tb|mb|go|to)\b')
+_STORAGE_TOKEN = re.compile(r'^\d+(?:\.\d+)?(gb|tb|mb)$')
+_ORDINAL = re.compile(r'\b(\d+)\s*(st|nd|rd|th|a|o)\b')
+_JOINED = re.compile(r'\b([a-z]+)[-_/]([a-z]*\d[a-z0-9]*)\b')
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+MODEL_WEIGHT = 2.0
+DEFAULT_THRESHOLD = 0.35
+MAX_POSTING_SHARE = 0.5
+REBUILD_GROWTH = 0.1
+
+def _strip_accents(text: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+def normalize_title(title: str) -> List[str]:
+    text = _strip_accents((title or '').lower())
+    text = _ORDINAL.sub(r'\1', text)
+    text = _STORAGE.sub(lambda m: m.group(1).replace(',', '.') + {'go': 'gb', 'to': 'tb'}.get(m.group(2), m.group(2)), text)
+    text = _JOINED.sub(r'\1\2 \1 \2', text)
+    tokens = []
+    seen = set()
+    for token in _TOKEN.findall(text):
+        if token in STOPWORDS or (len(token) < 2 and not token.isdigit()):
+            continue
+        if token not in seen:
+            seen.add(token)
+            tokens.append(token)
+    return tokens
+
+@functools.lru_cache(maxsize=65536)
+def _title_tokens(title: str) -> frozenset:
+    # The same buy titles are matched against every sell platform in a search
+    return frozenset(normalize_title(title))
+
+def is_model_token(token: str) -> bool:
+    return any(c.isdigit() for c in token)
+
+def _split_models(tokens: frozenset) -> Tuple[frozenset, frozenset]:
+    storage = frozenset(t for t in tokens if _STORAGE_TOKEN.match(t))
+    models = frozenset(t for t in tokens if is_model_token(t)) - storage
+    return storage, models
+
+def _disjoint(a: frozenset, b: frozenset) -> bool:
+    return bool(a and b and a.isdisjoint(b))
+
+class TitleMatcher:
+    def __init__(self, titles: Sequence[str] = ()):
+        self.docs: List[frozenset] = []
+        self.storage: List[frozenset] = []
+        self.models: List[frozenset] = []
+        self.postings: Dict[str, List[int]] = {}
+        self._weights: Dict[str, float] = {}
+        self._totals: List[Optional[float]] = []
+        self._built_size = 0
+        self._arrays: Optional[dict] = None
+        for title in titles:
+            self.add(title)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, title: str) -> int:
+        doc_id = len(self.docs)
+        tokens = frozenset(normalize_title(title))
+        storage, models = _split_models(tokens)
+        self.docs.append(tokens)
+        self.storage.append(storage)
+        self.models.append(models)
+        for token in tokens:
+            self.postings.setdefault(token, []).append(doc_id)
+        self._totals.append(None)
+        return doc_id
+
+    def _build(self):
+        # Weights are fixed when first queried. Titles added between queries reuse them until the
+        # index has grown by REBUILD_GROWTH, so interleaved add/query stays linear overall
+        if self._built_size and len(self.docs) <= self._built_size * (1 + REBUILD_GROWTH):
+            return
+        self._weights = {}
+        self._totals = [None] * len(self.docs)
+        self._arrays = None
+        self._built_size = len(self.docs)
+
+    def weight(self, token: str) -> float:
+        weight = self._weights.get(token)
+        if weight is None:
+            df = len(self.postings.get(token, ()))
+            idf = math.log(1.0 + (len(self.docs) + 1) / (df + 1))
+            weight = self._weights[token] = idf * (MODEL_WEIGHT if is_model_token(token) else 1.0)
+        return weight
+
+    def _total(self, doc_id: int) -> float:
+        total = self._totals[doc_id]
+        if total is None:
+            total = self._totals[doc_id] = sum(self.weight(t) for t in self.docs[doc_id])
+        return total
+
+    def _plan(self, tokens: frozenset, threshold: float) -> Tuple[float, List[str], List[str]]:
+        # Prefix filter: a title sharing only the lightest tokens, worth `rest` together, scores at most
+        # 2 * rest / (query_total + rest). Once that is below the threshold those tokens (and very common
+        # ones such as the search keyword) only add their weight to candidates the others already found
+        limit = max(20, int(len(self.docs) * MAX_POSTING_SHARE))
+        query_total = sum(self.weight(t) for t in tokens)
+        present = sorted((t for t in tokens if t in self.postings), key=lambda t: (-self.weight(t), t))
+        rest = sum(self.weight(t) for t in present)
+        driving, common = [], []
+        for token in present:
+            if 2.0 * rest < threshold * (query_total + rest) or len(self.postings[token]) > limit:
+                common.append(token)
+                continue
+            rest -= self.weight(token)
+            driving.append(token)
+        return query_total, driving, common
+
+    def query(self, title: str, threshold: float = DEFAULT_THRESHOLD) -> List[Tuple[int, float]]:
+        self._build()
+        tokens = frozenset(normalize_title(title))
+        storage, models = _split_models(tokens)
+        query_total, driving, common = self._plan(tokens, threshold)
+
+        shared: Dict[int, float] = {}
+        for token in driving:
+            weight = self.weight(token)
+            for doc_id in self.postings[token]:
+                shared[doc_id] = shared.get(doc_id, 0.0) + weight
+        if not shared and common:
+            shared = dict.fromkeys(min((self.postings[t] for t in common), key=len), 0.0)
+        matches = []
+        for doc_id, weight in shared.items():
+            if _disjoint(storage, self.storage[doc_id]) or _disjoint(models, self.models[doc_id]):
+                continue
+            doc = self.docs[doc_id]
+            weight += sum(self.weight(t) for t in common if t in doc)
+            score = 2.0 * weight / (query_total + self._total(doc_id))
+            if score >= threshold:
+                matches.append((doc_id, score))
+        matches.sort(key=lambda m: (-m[1], m[0]))
+        return matches
+
+    def _index_arrays(self) -> dict:
+        # Postings and per-document figures as flat arrays for match_many, rebuilt when titles were added
+        self._build()
+        if self._arrays is not None and self._arrays["size"] == len(self.docs):
+            return self._arrays
+        vocab = {token: i for i, token in enumerate(self.postings)}
+        lengths = np.fromiter((len(p) for p in self.postings.values()), dtype=np.int64, count=len(vocab))
+        pointers = np.concatenate([[0], np.cumsum(lengths)])
+        docs = np.fromiter((d for p in self.postings.values() for d in p), dtype=np.int64, count=int(pointers[-1]))
+        n = max(len(self.docs), 1)
+        self._arrays = {
+            "size": len(self.docs),
+            "vocab": vocab,
+            "weight": np.fromiter((self.weight(t) for t in vocab), dtype=np.float64, count=len(vocab)),
+            "storage": np.fromiter((bool(_STORAGE_TOKEN.match(t)) for t in vocab), dtype=bool, count=len(vocab)),
+            "model": np.fromiter((is_model_token(t) and not _STORAGE_TOKEN.match(t) for t in vocab), dtype=bool, count=len(vocab)),
+            "pointers": pointers,
+            "docs": docs,
+            # token * n + doc for every posting, sorted, to test "doc has token" with searchsorted
+            "members": np.sort(np.repeat(np.arange(len(vocab), dtype=np.int64), lengths) * n + docs),
+            "totals": np.fromiter((self._total(d) for d in range(len(self.docs))), dtype=np.float64, count=len(self.docs)),
+            "doc_storage": np.fromiter((len(s) for s in self.storage), dtype=np.int64, count=len(self.docs)),
+            "doc_models": np.fromiter((len(m) for m in self.models), dtype=np.int64, count=len(self.docs)),
+        }
+        return self._arrays
+
+    def match_many(self, titles: Sequence[str], threshold: float = DEFAULT_THRESHOLD) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Same matches as calling query() per title, scored in bulk: (title index, doc id, score) by title, then doc
+        index = self._index_arrays()
+        vocab, n = index["vocab"], max(len(self.docs), 1)
+        totals, q_storage, q_models = [], [], []
+        drive_q, drive_tok, drive_factor, common_q, common_tok = [], [], [], [], []
+        for i, title in enumerate(titles):
+            tokens = _title_tokens(title or '')
+            storage, models = _split_models(tokens)
+            query_total, driving, common = self._plan(tokens, threshold)
+            totals.append(query_total)
+            q_storage.append(len(storage))
+            q_models.append(len(models))
+            if not driving and common:
+                # Nothing selective: candidates are the shortest common posting, scored on common tokens only
+                drive_q.append(i)
+                drive_tok.append(vocab[min(common, key=lambda t: len(self.postings[t]))])
+                drive_factor.append(0.0)
+            for token in driving:
+                drive_q.append(i)
+                drive_tok.append(vocab[token])
+                drive_factor.append(1.0)
+            common_q.extend([i] * len(common))
+            common_tok.extend(vocab[t] for t in common)
+
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        if not drive_q:
+            return empty
+        drive_q, drive_tok = np.asarray(drive_q, dtype=np.int64), np.asarray(drive_tok, dtype=np.int64)
+        q_of, docs = _expand(index["pointers"], index["docs"], drive_q, drive_tok)
+        contribution = _repeat(drive_tok, index["pointers"])
+        factor = _repeat(np.asarray(drive_factor), index["pointers"], drive_tok)
+
+        pairs, inverse = np.unique(q_of * n + docs, return_inverse=True)
+        weight = np.bincount(inverse, index["weight"][contribution] * factor, len(pairs))
+        storage_shared = np.bincount(inverse, index["storage"][contribution] * factor, len(pairs))
+        models_shared = np.bincount(inverse, index["model"][contribution] * factor, len(pairs))
+        pair_q, pair_doc = pairs // n, pairs % n
+
+        if common_q:
+            # Each candidate checks the common tokens of its title against its doc's tokens
+            common_q, common_tok = np.asarray(common_q, dtype=np.int64), np.asarray(common_tok, dtype=np.int64)
+            per_title = np.bincount(common_q, minlength=len(titles))
+            first = np.concatenate([[0], np.cumsum(per_title)])[:-1]
+            counts = per_title[pair_q]
+            pair_rep = np.repeat(np.arange(len(pairs)), counts)
+            offsets = np.arange(len(pair_rep)) - np.repeat(np.cumsum(counts) - counts, counts)
+            tok = common_tok[np.repeat(first[pair_q], counts) + offsets]
+            keys = tok * n + pair_doc[pair_rep]
+            found = np.searchsorted(index["members"], keys)
+            hit = (found < len(index["members"])) & (index["members"][np.minimum(found, len(index["members"]) - 1)] == keys)
+            weight += np.bincount(pair_rep[hit], index["weight"][tok[hit]], len(pairs))
+            storage_shared += np.bincount(pair_rep[hit], index["storage"][tok[hit]], len(pairs))
+            models_shared += np.bincount(pair_rep[hit], index["model"][tok[hit]], len(pairs))
+
+        q_storage, q_models = np.asarray(q_storage)[pair_q], np.asarray(q_models)[pair_q]
+        disjoint = ((q_storage > 0) & (index["doc_storage"][pair_doc] > 0) & (storage_shared == 0)) | \
+                   ((q_models > 0) & (index["doc_models"][pair_doc] > 0) & (models_shared == 0))
+        score = 2.0 * weight / (np.asarray(totals)[pair_q] + index["totals"][pair_doc])
+        keep = ~disjoint & (score >= threshold)
+        return pair_q[keep], pair_doc[keep], score[keep]
+
+    def best(self, title: str, threshold: float = DEFAULT_THRESHOLD) -> Optional[Tuple[int, float]]:
+        matches = self.query(title, threshold)
+        return matches[0] if matches else None
+
+def _repeat(values: np.ndarray, pointers: np.ndarray, tokens: Optional[np.ndarray] = None) -> np.ndarray:
+    # values[k] once per doc in the posting of tokens[k] (tokens defaults to values)
+    tokens = values if tokens is None else tokens
+    return np.repeat(values, pointers[tokens + 1] - pointers[tokens])
+
+def _expand(pointers: np.ndarray, docs: np.ndarray, query: np.ndarray, tokens: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    lengths = pointers[tokens + 1] - pointers[tokens]
+    offsets = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(query, lengths), docs[np.repeat(pointers[tokens], lengths) + offsets]
+
+def match_pairs(buy_titles: Sequence[str], matcher: TitleMatcher, threshold: float = DEFAULT_THRESHOLD) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return matcher.match_many(buy_titles, threshold)
@@ -0,0 +1,76 @@
+import sys
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Union
+
+@dataclass(slots=True, frozen=True)
+class Product:
+    title: str
+    price: float
+    url: str
+    platform: str
+    image_url: str = ''
+    location: str = ''
+    sold_at: str = ''
+
+    def __post_init__(self):
+        # Every product of a platform shares one platform string instead of a copy per card
+        object.__setattr__(self, 'platform', sys.intern(self.platform))
+
+    def to_row(self) -> list:
+        return [self.title, self.price, self.url, self.platform, self.image_url, self.location, self.sold_at]
+
+    def to_dict(self) -> dict:
+        return {'title': self.title, 'price': self.price, 'url': self.url, 'platform': self.platform,
+                'image_url': self.image_url, 'location': self.location, 'sold_at': self.sold_at}
+
+def products_from_rows(rows: Iterable[Union[list, dict]]) -> List[Product]:
+    # Cache payloads are compact rows; dicts are what older cache entries still hold
+    return [Product(**row) if isinstance(row, dict) else Product(*row) for row in rows]
+
+@dataclass(slots=True)
+class Opportunity:
+    buy: Product
+    sell: Product
+    net_profit: float
+    roi_percent: float
+    score: float
+    total_investment: float
+    buy_commission: float
+    buy_shipping: float
+    sell_commission: float
+    sell_shipping: float
+    payment_fee: float
+    packaging: float
+    taxes: float
+    match_confidence: Optional[float] = None
+
+    def to_dict(self, fields: Optional[Sequence[str]] = None) -> dict:
+        if fields is None:
+            return {name: get(self) for name, get in OPPORTUNITY_FIELDS.items()}
+        return {name: OPPORTUNITY_FIELDS[name](self) for name in fields}
+
+OPPORTUNITY_FIELDS: Dict[str, Callable[[Opportunity], object]] = {
+    'buy_title': lambda o: o.buy.title,
+    'buy_price': lambda o: round(o.buy.price, 2),
+    'buy_platform': lambda o: o.buy.platform,
+    'buy_url': lambda o: o.buy.url,
+    'sell_title': lambda o: o.sell.title,
+    'sell_price': lambda o: round(o.sell.price, 2),
+    'sell_platform': lambda o: o.sell.platform,
+    'sell_url': lambda o: o.sell.url,
+    'net_profit': lambda o: o.net_profit,
+    'roi_percent': lambda o: o.roi_percent,
+    'score': lambda o: o.score,
+    'total_investment': lambda o: o.total_investment,
+    'costs_breakdown': lambda o: {
+        'buy_price': round(o.buy.price, 2),
+        'buy_commission': o.buy_commission,
+        'buy_shipping': o.buy_shipping,
+        'sell_commission': o.sell_commission,
+        'sell_shipping': o.sell_shipping,
+        'payment_fee': o.payment_fee,
+        'packaging': o.packaging,
+        'taxes': o.taxes
+    },
+    'match_confidence': lambda o: o.match_confidence,
+}
@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from supabase import Client
+
+from price_history import PriceSeries, signals, to_day, today
+from scoring import demand_scores
+from supabase_client import select_in
+
+SALES_WINDOW = 50
+STATS_TTL_SECONDS = int(os.getenv("SALES_STATS_TTL_SECONDS", "900"))
+STATS_MAX_KEYS = int(os.getenv("SALES_STATS_MAX_KEYS", "50000"))
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+class SalesWindow:
+    def __init__(self, size: int = SALES_WINDOW):
+        self.size = size
+        self.entries: List[Tuple[str, str, float]] = []
+        self.prices: List[float] = []
+        self.count = 0
+        self.last_sold_at: Optional[str] = None
+        # Daily buckets of the sales still in observed_sales, and the compacted price_history buckets
+        self.recent = PriceSeries()
+        self.history = PriceSeries()
+        self._signals: Optional[Tuple[int, float, float]] = None
+
+    def add(self, price: float, sold_at: str, sale_id: str = ""):
+        self.count += 1
+        if self.last_sold_at is None or sold_at > self.last_sold_at:
+            self.last_sold_at = sold_at
+
+        insort(self.entries, (sold_at, sale_id, price))
+        insort(self.prices, price)
+        if len(self.entries) > self.size:
+            # Drop the oldest sale; on equal dates the highest id goes first, like "order by sold_at desc, id"
+            i = 0
+            while i + 1 < len(self.entries) and self.entries[i + 1][0] == self.entries[0][0]:
+                i += 1
+            victim = self.entries.pop(i)
+            del self.prices[bisect_left(self.prices, victim[2])]
+
+    @property
+    def median(self) -> Optional[float]:
+        n = len(self.prices)
+        if not n:
+            return None
+        if n % 2:
+            return self.prices[n // 2]
+        return (self.prices[n // 2 - 1] + self.prices[n // 2]) / 2
+
+    def record(self, price: float, sold_at: str, sale_id: str = ""):
+        # A sale stored after the backfill goes into the window and into its day's bucket
+        self.add(price, sold_at, sale_id)
+        self.add_recent(PriceSeries.from_points([to_day(sold_at)], [price]))
+
+    def add_recent(self, series: PriceSeries):
+        self.recent = self.recent.merge(series)
+        self._signals = None
+
+    def add_history(self, series: PriceSeries):
+        self.history = self.history.merge(series)
+        self._signals = None
+
+    def series(self) -> PriceSeries:
+        return self.history.merge(self.recent)
+
+    def signals(self) -> Tuple[float, float]:
+        now = today()
+        if self._signals is None or self._signals[0] != now:
+            self._signals = (now, *signals(self.series(), now))
+        return self._signals[1], self._signals[2]
+
+    def summary(self) -> dict:
+        velocity, trend = self.signals()
+        return {
+            "count": self.count + int(self.history.count.sum()),
+            "window": len(self.prices),
+            "median": self.median,
+            "p10": percentile(self.prices, 0.10),
+            "p25": percentile(self.prices, 0.25),
+            "p75": percentile(self.prices, 0.75),
+            "p90": percentile(self.prices, 0.90),
+            "last_sold_at": self.last_sold_at,
+            "velocity": velocity,
+            "trend": trend,
+        }
+
+class SalesStatsStore:
+    def __init__(self, window: int = SALES_WINDOW, ttl: int = STATS_TTL_SECONDS, max_keys: int = STATS_MAX_KEYS):
+        self.window = window
+        self.ttl = ttl
+        self.max_keys = max_keys
+        # (user, product, platform, include_demo) -> (loaded_at, window), least recently used first
+        self._windows: "OrderedDict[tuple, Tuple[float, SalesWindow]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fresh(self, key: tuple, now: float) -> bool:
+        entry = self._windows.get(key)
+        return entry is not None and now - entry[0] < self.ttl
+
+    def _get(self, key: tuple) -> SalesWindow:
+        entry = self._windows.get(key)
+        if entry is None:
+            return SalesWindow(self.window)
+        self._windows.move_to_end(key)
+        return entry[1]
+
+    def record(self, user_id: str, sale: dict):
+        # Only keys already backfilled are updated; others are loaded in full on first use
+        views = (True,) if sale.get("is_demo") else (True, False)
+        with self._lock:
+            for include_demo in views:
+                key = (user_id, sale["product_id"], sale["platform"], include_demo)
+                if key in self._windows:
+                    self._windows[key][1].record(
+                        float(sale["sold_price"]), str(sale["sold_at"]), str(sale.get("id", "")))
+
+    def record_many(self, user_id: str, sales: Iterable[dict]):
+        for sale in sales:
+            if sale.get("product_id"):
+                self.record(user_id, sale)
+
+    def invalidate(self, user_id: str, product_ids: Optional[Iterable[str]] = None):
+        products = set(product_ids) if product_ids is not None else None
+        with self._lock:
+            for key in [k for k in self._windows if k[0] == user_id and (products is None or k[1] in products)]:
+                del self._windows[key]
+
+    def _backfill(self, sb: Client, user_id: str, product_ids: List[str], platforms: List[str], include_demo: bool):
+        # The view ranks each product/platform's sales newest first, so only the last `window` of them are read
+        rank, total = ("rank_all", "count_all") if include_demo else ("rank_real", "count_real")
+
+        def make_query():
+            return sb.table("observed_sales_ranked").select(f"id,product_id,platform,sold_price,sold_at,{total}") \
+                .eq("user_id", user_id).in_("platform", platforms).lte(rank, self.window) \
+                .order("product_id").order("platform").order(rank)
+
+        def make_daily_query():
+            q = sb.table("observed_sales_daily").select("product_id,platform,is_demo,sold_at,sales,low,median,high") \
+                .eq("user_id", user_id).in_("platform", platforms) \
+                .order("product_id").order("platform").order("is_demo").order("sold_at")
+            if not include_demo:
+                q = q.eq("is_demo", False)
+            return q
+
+        def make_history_query():
+            q = sb.table("price_history").select("product_id,platform,days,counts,mins,medians,maxs").eq("user_id", user_id) \
+                .in_("platform", platforms).order("product_id").order("platform").order("is_demo")
+            if not include_demo:
+                q = q.eq("is_demo", False)
+            return q
+
+        windows = {(user_id, pid, plat, include_demo): SalesWindow(self.window) for pid in product_ids for plat in platforms}
+        for row in select_in(make_query, "product_id", product_ids):
+            window = windows[(user_id, row["product_id"], row["platform"], include_demo)]
+            window.add(float(row["sold_price"]), str(row["sold_at"]), str(row["id"]))
+            window.count = int(row[total])
+        # One row per day with sales still in observed_sales: the raw retention window plus the latest sales
+        daily = {}
+        for row in select_in(make_daily_query, "product_id", product_ids):
+            columns = daily.setdefault((row["product_id"], row["platform"], row["is_demo"]), ([], [], [], [], []))
+            for values, value in zip(columns, (to_day(row["sold_at"]), row["sales"], row["low"], row["median"], row["high"])):
+                values.append(value)
+        for (pid, plat, _), columns in daily.items():
+            windows[(user_id, pid, plat, include_demo)].add_recent(PriceSeries(*columns))
+        for row in select_in(make_history_query, "product_id", product_ids):
+            windows[(user_id, row["product_id"], row["platform"], include_demo)].add_history(PriceSeries.from_row(row))
+        now = time.monotonic()
+        with self._lock:
+            for key, window in windows.items():
+                self._windows[key] = (now, window)
+                self._windows.move_to_end(key)
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+
+    def _ensure(self, sb: Client, user_id: str, product_ids: List[str], platforms: List[str], include_demo: bool):
+        now = time.monotonic()
+        with self._lock:
+            stale = sorted({pid for pid in product_ids for plat in platforms
+                            if not self._fresh((user_id, pid, plat, include_demo), now)})
+        if stale:
+            self._backfill(sb, user_id, stale, platforms, include_demo)
+
+    def summaries(self, sb: Client, user_id: str, product_ids: List[str], platforms: List[str],
+                  include_demo: bool) -> Dict[Tuple[str, str], dict]:
+        self._ensure(sb, user_id, product_ids, platforms, include_demo)
+        with self._lock:
+            return {
+                (pid, plat): self._get((user_id, pid, plat, include_demo)).summary()
+                for pid in product_ids for plat in platforms
+            }
+
+    def sales_window(self, sb: Client, user_id: str, product_id: str, platform: str, include_demo: bool) -> SalesWindow:
+        self._ensure(sb, user_id, [product_id], [platform], include_demo)
+        with self._lock:
+            return self._windows.get((user_id, product_id, platform, include_demo), SalesWindow(self.window))
+
+sales_stats = SalesStatsStore()
+
+def price_history(sb: Client, user_id: str, params: dict) -> dict:
+    window = sales_stats.sales_window(sb, user_id, params["product_id"], params["platform"], params["include_demo"])
+    start = to_day(params["start"]) if params.get("start") else 0
+    end = to_day(params["end"]) + 1 if params.get("end") else today() + 1
+    velocity, trend = window.signals()
+    return {
+        "product_id": params["product_id"],
+        "platform": params["platform"],
+        "buckets": window.series().between(start, end).buckets(),
+        "velocity": None if np.isnan(velocity) else round(velocity, 3),
+        "trend": None if np.isnan(trend) else round(trend, 4),
+        "demand_score": round(float(demand_scores(np.float64(velocity), np.float64(trend))), 2),
+    }
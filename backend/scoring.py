@@ -0,0 +1,68 @@
+from typing import Dict, Optional
+import numpy as np
+
+DEMAND_SCORE = 12.5
+DEMAND_MAX = 25.0
+DEMAND_FULL_VELOCITY = 5.0
+DEMAND_TREND_SPAN = 0.05
+DEMAND_TREND_WEIGHT = 0.2
+FALLBACK_MARKUP = 1.35
+MIN_WINDOW_FOR_MEDIAN = 5
+BREAKEVEN_UNREACHABLE = 999999.0
+
+def _clamp(x: np.ndarray, lo: float, hi: float) -> np.ndarray:
+    return np.maximum(lo, np.minimum(hi, x))
+
+def estimate_sell_price(p_buy: np.ndarray, window: np.ndarray, median: np.ndarray, p25: np.ndarray) -> np.ndarray:
+    # Median of recent sales once there are enough of them, else the conservative p25, else a fixed markup
+    return np.where(window >= MIN_WINDOW_FOR_MEDIAN, median,
+                    np.where(window > 0, p25, p_buy * FALLBACK_MARKUP))
+
+def demand_scores(velocity: np.ndarray, trend: np.ndarray) -> np.ndarray:
+    # Mostly sales per week (full marks at DEMAND_FULL_VELOCITY), nudged by the weekly price trend
+    # saturating at +-DEMAND_TREND_SPAN; products without any sales history keep the neutral DEMAND_SCORE
+    velocity_part = _clamp(np.nan_to_num(velocity) / DEMAND_FULL_VELOCITY, 0.0, 1.0)
+    trend_part = np.where(np.isnan(trend), 0.5, _clamp(0.5 + np.nan_to_num(trend) / (2 * DEMAND_TREND_SPAN), 0.0, 1.0))
+    score = DEMAND_MAX * ((1 - DEMAND_TREND_WEIGHT) * velocity_part + DEMAND_TREND_WEIGHT * trend_part)
+    return np.where(np.isnan(velocity), DEMAND_SCORE, score)
+
+def score_batch(p_buy: np.ndarray, ship_buy: np.ndarray, fee_buy_percent: np.ndarray, fee_buy_fixed: np.ndarray,
+                p_sell: np.ndarray, fee_sell_percent: np.ndarray, fee_sell_fixed: np.ndarray, est_days: np.ndarray,
+                packaging: float, tax_rate: float, tax_enabled: bool, risk_buffer: float,
+                demand: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    # Same operation order as the scalar formulas it replaced, so every value matches bit for bit
+    fee_buy = p_buy * fee_buy_percent + fee_buy_fixed
+    invested = p_buy + fee_buy + ship_buy
+
+    fee_sell = p_sell * fee_sell_percent + fee_sell_fixed
+    ship_sell = 0.0
+    tax = p_sell * tax_rate if tax_enabled else np.zeros_like(p_sell)
+    risk = p_sell * risk_buffer
+
+    net_margin = (p_sell - fee_sell - ship_sell - packaging - tax - risk) - invested
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roi = np.where(invested > 0, net_margin / invested, 0.0)
+
+    pct = fee_sell_percent + (tax_rate if tax_enabled else 0.0) + risk_buffer
+    denom = 1.0 - pct
+    with np.errstate(divide='ignore', invalid='ignore'):
+        breakeven = np.where(denom <= 0.05, BREAKEVEN_UNREACHABLE,
+                             (invested + fee_sell_fixed + ship_sell + packaging) / denom)
+
+    score_nm = _clamp(net_margin / 100.0, 0.0, 1.0) * 30.0
+    score_roi = _clamp(roi / 0.40, 0.0, 1.0) * 20.0
+    profit_score = score_nm + score_roi
+    liquidity_score = _clamp(1.0 - (est_days / 60.0), 0.0, 1.0) * 25.0
+    demand_score = np.full(np.shape(net_margin), DEMAND_SCORE) if demand is None \
+        else np.broadcast_to(demand, np.shape(net_margin))
+    total_score = profit_score + liquidity_score + demand_score
+
+    return {
+        "invested": invested,
+        "net_margin": net_margin,
+        "roi": roi,
+        "breakeven_sell_price": breakeven,
+        "liquidity_score": np.broadcast_to(liquidity_score, np.shape(net_margin)),
+        "demand_score": demand_score,
+        "total_score": total_score,
+    }
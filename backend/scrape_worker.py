@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from browser_pool import browser_pool
+from job_queue import ERROR_TIMED_OUT, JOB_LEASE_SECONDS, SQLiteJobQueue, SCRAPE_QUEUE_PATH
+from logger import get_logger
+from metrics import span
+
+from wallapop_scraper import search_wallapop
+from ebay_scraper import search_ebay_sold
+from vinted_scraper import search_vinted
+from catawiki_scraper import search_catawiki_closed
+
+WORKER_CONCURRENCY = int(os.getenv("SCRAPE_WORKER_CONCURRENCY", "4"))
+LOCAL_WORKERS = int(os.getenv("SCRAPE_LOCAL_WORKERS", "1"))
+WORKER_PLATFORMS = [p.strip() for p in os.getenv("SCRAPE_WORKER_PLATFORMS", "").split(",") if p.strip()]
+IDLE_POLL_SECONDS = 0.1
+MAX_IDLE_POLL_SECONDS = 1.0
+STOP_GRACE_SECONDS = 10.0
+PURGE_EVERY_SECONDS = 300.0
+
+# The API side already checked and fills the search cache; a worker scrapes the marketplace every time
+SCRAPERS = {
+    'wallapop': search_wallapop.uncached,
+    'ebay': search_ebay_sold.uncached,
+    'vinted': search_vinted.uncached,
+    'catawiki': search_catawiki_closed.uncached
+}
+
+logger = get_logger(__name__)
+
+class ScrapeWorker:
+    def __init__(self, queue: SQLiteJobQueue, concurrency: int = WORKER_CONCURRENCY,
+                 platforms: Optional[List[str]] = None, name: Optional[str] = None):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.platforms = [p for p in platforms or SCRAPERS if p in SCRAPERS]
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        # Per-platform caps follow the browser pool, so a claimed job never waits on a page slot
+        self.limits = {p: browser_pool.platform_limits.get(p, 1) for p in self.platforms}
+        self.busy: Dict[str, int] = {p: 0 for p in self.platforms}
+        self.running: Dict[str, asyncio.Task] = {}
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _free_platforms(self) -> List[str]:
+        if len(self.running) >= self.concurrency:
+            return []
+        return [p for p in self.platforms if self.busy[p] < self.limits[p]]
+
+    async def _execute(self, job: dict):
+        platform = job['platform']
+        self.busy[platform] += 1
+        try:
+            with span('job', platform):
+                products = await asyncio.wait_for(SCRAPERS[platform](job['keywords'], job['max_results']),
+                                                  job['expires_at'] - time.time())
+            await asyncio.to_thread(self.queue.complete, job['id'], self.name, products)
+            logger.info(f"📦 Trabajo {job['id']} ({platform}): {len(products)} productos")
+        except asyncio.TimeoutError:
+            await asyncio.to_thread(self.queue.fail, job['id'], self.name, ERROR_TIMED_OUT)
+            logger.warning(f"⏱️ Trabajo {job['id']} ({platform}) superó el tiempo límite")
+        except Exception as e:
+            await asyncio.to_thread(self.queue.fail, job['id'], self.name, f"{type(e).__name__}: {e}")
+            logger.error(f"❌ Trabajo {job['id']} ({platform}) falló: {str(e)}")
+        finally:
+            self.busy[platform] -= 1
+            self.running.pop(job['id'], None)
+
+    async def _renew_leases(self):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                await asyncio.to_thread(self.queue.renew, self.name, list(self.running))
+            except Exception as e:
+                logger.error(f"❌ Error renovando trabajos: {str(e)}")
+
+    async def run(self):
+        logger.info(f"👷 Worker {self.name} listo ({', '.join(self.platforms)}; máx {self.concurrency} trabajos)")
+        renewer = asyncio.create_task(self._renew_leases())
+        idle = IDLE_POLL_SECONDS
+        purged_at = 0.0
+        try:
+            while not self._stopping.is_set():
+                if time.monotonic() - purged_at >= PURGE_EVERY_SECONDS:
+                    await asyncio.to_thread(self.queue.purge)
+                    purged_at = time.monotonic()
+                job = await asyncio.to_thread(self.queue.claim, self.name, self._free_platforms())
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self._stopping.wait(), idle)
+                    except asyncio.TimeoutError:
+                        pass
+                    idle = min(idle * 2, MAX_IDLE_POLL_SECONDS)
+                    continue
+                idle = IDLE_POLL_SECONDS
+                self.running[job['id']] = asyncio.create_task(self._execute(job))
+        finally:
+            # Unfinished jobs keep their lease until it lapses, then another worker picks them up
+            if self.running:
+                await asyncio.wait(list(self.running.values()), timeout=STOP_GRACE_SECONDS)
+            for task in [renewer, *self.running.values()]:
+                task.cancel()
+            await asyncio.gather(renewer, *self.running.values(), return_exceptions=True)
+            logger.info(f"👷 Worker {self.name} detenido")
+
+async def serve(path: str, concurrency: int, platforms: List[str]):
+    worker = ScrapeWorker(SQLiteJobQueue(path), concurrency, platforms)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    # The browser starts on the first job that needs it; HTTP-only platforms never launch one
+    try:
+        await worker.run()
+    finally:
+        await browser_pool.stop()
+        worker.queue.close()
+
+def spawn_workers(path: str, count: int = LOCAL_WORKERS) -> List[subprocess.Popen]:
+    # Workers started next to the API; more can join from any host that sees the same queue file
+    script = os.path.abspath(__file__)
+    command = [sys.executable, script, "--queue", os.path.abspath(path)]
+    return [subprocess.Popen(command, cwd=os.path.dirname(script)) for _ in range(count)]
+
+def stop_workers(processes: List[subprocess.Popen], timeout: float = STOP_GRACE_SECONDS + 5):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        try:
+            process.wait(max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Worker de scraping que atiende la cola de trabajos")
+    parser.add_argument("--queue", default=SCRAPE_QUEUE_PATH, help="Fichero SQLite de la cola (SCRAPE_QUEUE_PATH)")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    parser.add_argument("--platforms", default=",".join(WORKER_PLATFORMS), help="Plataformas separadas por comas")
+    args = parser.parse_args(argv)
+    if not args.queue:
+        parser.error("Falta la ruta de la cola (--queue o SCRAPE_QUEUE_PATH)")
+    platforms = [p.strip() for p in args.platforms.split(",") if p.strip()]
+    asyncio.run(serve(args.queue, args.concurrency, platforms))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from logger import get_logger
+from metrics import registry, span
+from products import Product
+from search_cache import search_cache
+
+PLATFORM_RATES = {
+    'wallapop': (1.0, 3),
+    'ebay': (0.5, 2),
+    'vinted': (1.0, 3),
+    'catawiki': (0.5, 2)
+}
+
+SEARCH_DEADLINE_SECONDS = float(os.getenv("SEARCH_DEADLINE_SECONDS", "25"))
+SCRAPER_RETRIES = int(os.getenv("SCRAPER_RETRIES", "1"))
+RETRY_BACKOFF_SECONDS = float(os.getenv("SCRAPER_RETRY_BACKOFF_SECONDS", "0.5"))
+BREAKER_FAILURES = int(os.getenv("SCRAPER_BREAKER_FAILURES", "3"))
+BREAKER_RESET_SECONDS = float(os.getenv("SCRAPER_BREAKER_RESET_SECONDS", "60"))
+DEADLINE_SLACK_SECONDS = 0.05
+
+STATUS_OK = 'ok'
+STATUS_CACHED = 'cached'
+# Served from a cache entry past its TTL, either while it revalidates or because the scrape failed
+STATUS_STALE = 'stale'
+STATUS_TIMED_OUT = 'timed_out'
+STATUS_BREAKER_OPEN = 'breaker_open'
+STATUS_RATE_LIMITED = 'rate_limited'
+STATUS_ERROR = 'error'
+
+logger = get_logger(__name__)
+
+SCRAPER_RESULTS = registry.counter("arbitraje_scraper_results_total", "Búsquedas por plataforma y resultado",
+                                   ("platform", "status"))
+SCRAPED_PRODUCTS = registry.counter("arbitraje_scraped_products_total", "Productos devueltos por plataforma",
+                                    ("platform",))
+
+class BreakerOpenError(Exception):
+    pass
+
+class RateLimitedError(Exception):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, timeout: Optional[float] = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    raise RateLimitedError()
+                await asyncio.sleep(wait)
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+class PlatformRunner:
+    def __init__(self, platform: str, rate: float, burst: int):
+        self.platform = platform
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker()
+
+    @asynccontextmanager
+    async def guard(self, timeout: Optional[float] = None, deadline: Optional[float] = None):
+        # With a deadline (time.monotonic()), being cancelled once it has passed counts as a failure like any timeout
+        if not self.breaker.allow():
+            raise BreakerOpenError(self.platform)
+        try:
+            await self.bucket.acquire(timeout)
+        except RateLimitedError:
+            self.breaker.trial_running = False
+            raise
+        try:
+            yield
+        except asyncio.CancelledError:
+            if deadline is not None and time.monotonic() >= deadline - DEADLINE_SLACK_SECONDS:
+                self.breaker.record_failure()
+            else:
+                self.breaker.trial_running = False
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+    async def run(self, search: Callable[[List[str], int], Awaitable[List[Product]]], keywords: List[str],
+                  max_results: int, deadline: float) -> List[Product]:
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                async with self.guard(remaining):
+                    return await asyncio.wait_for(search(keywords, max_results), deadline - time.monotonic())
+            except (BreakerOpenError, RateLimitedError, asyncio.TimeoutError):
+                raise
+            except Exception as e:
+                attempt += 1
+                delay = RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                if attempt > SCRAPER_RETRIES or time.monotonic() + delay >= deadline:
+                    raise
+                logger.warning(f"🔁 Reintentando {self.platform} ({attempt}/{SCRAPER_RETRIES}) tras error: {str(e)}")
+                await asyncio.sleep(delay)
+
+    def state(self) -> dict:
+        return {
+            'breaker': self.breaker.state,
+            'failures': self.breaker.failures,
+            'tokens': round(self.bucket.tokens, 2)
+        }
+
+def _rate(platform: str) -> tuple:
+    rate, burst = PLATFORM_RATES.get(platform, (0.5, 2))
+    return (
+        float(os.getenv(f"SCRAPER_RATE_{platform.upper()}", rate)),
+        int(os.getenv(f"SCRAPER_BURST_{platform.upper()}", burst))
+    )
+
+runners: Dict[str, PlatformRunner] = {platform: PlatformRunner(platform, *_rate(platform)) for platform in PLATFORM_RATES}
+
+def get_runner(platform: str) -> PlatformRunner:
+    if platform not in runners:
+        runners[platform] = PlatformRunner(platform, *_rate(platform))
+    return runners[platform]
+
+def record_result(platform: str, status: str, count: int):
+    SCRAPER_RESULTS.inc(platform=platform, status=status)
+    SCRAPED_PRODUCTS.inc(count, platform=platform)
+
+async def run_platform(platform: str, search: Callable[[List[str], int], Awaitable[List[Product]]],
+                       keywords: List[str], max_results: int, deadline: float) -> dict:
+    with span('search', platform):
+        result = await _run_platform(platform, search, keywords, max_results, deadline)
+    record_result(platform, result['status'], len(result['products']))
+    return result
+
+async def _run_platform(platform: str, search: Callable[[List[str], int], Awaitable[List[Product]]],
+                        keywords: List[str], max_results: int, deadline: float) -> dict:
+    cached = await search_cache.peek(platform, keywords, max_results)
+    if cached is not None:
+        return {'products': cached, 'status': STATUS_CACHED}
+    runner = get_runner(platform)
+    if await search_cache.is_stale(platform, keywords, max_results):
+        # The expired entry is served without waiting for a token; the background revalidation takes one when it runs
+        fetch = getattr(search, 'uncached', search)
+        products = await search_cache.get_or_fetch(platform, keywords, max_results, lambda: runner.run(
+            fetch, keywords, max_results, time.monotonic() + SEARCH_DEADLINE_SECONDS))
+        return {'products': products, 'status': STATUS_STALE}
+
+    try:
+        products = await runner.run(search, keywords, max_results, deadline)
+        return {'products': products, 'status': STATUS_OK}
+    except BreakerOpenError:
+        logger.warning(f"⛔ {platform} omitido: circuito abierto")
+        return {'products': [], 'status': STATUS_BREAKER_OPEN}
+    except RateLimitedError:
+        logger.warning(f"🚦 {platform} omitido: límite de peticiones")
+        return {'products': [], 'status': STATUS_RATE_LIMITED}
+    except asyncio.TimeoutError:
+        logger.warning(f"⏱️ {platform} superó el tiempo límite")
+        return {'products': [], 'status': STATUS_TIMED_OUT}
+    except Exception as e:
+        logger.error(f"❌ Error en {platform}: {str(e)}")
+        return {'products': [], 'status': STATUS_ERROR, 'error': str(e)}
+
+async def search_platforms(searches: Dict[str, Callable[[List[str], int], Awaitable[List[Product]]]],
+                           keywords: List[str], max_results: int,
+                           deadline_seconds: Optional[float] = None) -> Dict[str, dict]:
+    deadline = time.monotonic() + (deadline_seconds or SEARCH_DEADLINE_SECONDS)
+    results = await asyncio.gather(*[
+        run_platform(platform, search, keywords, max_results, deadline)
+        for platform, search in searches.items()
+    ])
+    return dict(zip(searches, results))
+
+def runner_states() -> Dict[str, dict]:
+    return {platform: runner.state() for platform, runner in runners.items()}
+
+registry.collected("arbitraje_scraper_breaker_open", "1 si el circuito de la plataforma está abierto", "gauge",
+                   lambda: {(platform,): float(runner.breaker.state == 'open') for platform, runner in runners.items()},
+                   ("platform",))
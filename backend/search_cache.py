@@ -0,0 +1,220 @@
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from products import Product, products_from_rows
+
+PLATFORM_TTLS = {
+    'ebay': 6 * 3600,
+    'catawiki': 6 * 3600,
+    'wallapop': 5 * 60,
+    'vinted': 10 * 60
+}
+DEFAULT_TTL = 5 * 60
+EMPTY_TTL = 60
+STALE_FACTOR = 1.0
+
+def _ttl(platform: str) -> int:
+    return int(os.getenv(f"SEARCH_CACHE_TTL_{platform.upper()}", PLATFORM_TTLS.get(platform, DEFAULT_TTL)))
+
+def normalize_keywords(keywords: List[str]) -> str:
+    text = unicodedata.normalize('NFKC', " ".join(keywords)).lower()
+    return " ".join(text.split())
+
+def _consume_result(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()
+
+class _Entry:
+    def __init__(self, value: Any, size: int, fresh_until: float, stale_until: float):
+        self.value = value
+        self.size = size
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+class SQLiteCacheBackend:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, fresh_until REAL NOT NULL, stale_until REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, float, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, fresh_until, stale_until FROM search_cache WHERE key = ? AND stale_until > ?",
+                (key, time.time())
+            ).fetchone()
+        return row
+
+    def set(self, key: str, value: str, fresh_until: float, stale_until: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, value, fresh_until, stale_until) VALUES (?, ?, ?, ?)",
+                (key, value, fresh_until, stale_until)
+            )
+            self._conn.execute("DELETE FROM search_cache WHERE stale_until <= ?", (time.time(),))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class SearchCache:
+    def __init__(self, max_bytes: Optional[int] = None, backend: Optional[SQLiteCacheBackend] = None):
+        self.max_bytes = max_bytes or int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.backend = backend
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._bytes = 0
+        self.counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'disk_hits': 0,
+            'revalidations': 0,
+            'evictions': 0,
+            'errors': 0
+        }
+
+    @staticmethod
+    def key(platform: str, keywords: List[str], max_results: int) -> str:
+        return f"{platform}|{max_results}|{normalize_keywords(keywords)}"
+
+    def _store(self, key: str, entry: _Entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.counters['evictions'] += 1
+
+    async def _lookup(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.stale_until > time.time():
+                self._entries.move_to_end(key)
+                return entry
+            self._bytes -= entry.size
+            del self._entries[key]
+        if self.backend is None:
+            return None
+        row = await asyncio.to_thread(self.backend.get, key)
+        if row is None:
+            return None
+        payload, fresh_until, stale_until = row
+        entry = _Entry(products_from_rows(json.loads(payload)), len(payload), fresh_until, stale_until)
+        self._store(key, entry)
+        self.counters['disk_hits'] += 1
+        return entry
+
+    async def put(self, platform: str, key: str, value: List[Product]):
+        payload = json.dumps([product.to_row() for product in value], ensure_ascii=False)
+        ttl = _ttl(platform) if value else min(EMPTY_TTL, _ttl(platform))
+        now = time.time()
+        entry = _Entry(value, len(payload), now + ttl, now + ttl * (1 + STALE_FACTOR))
+        self._store(key, entry)
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.set, key, payload, entry.fresh_until, entry.stale_until)
+
+    def _fetch(self, platform: str, key: str, fetch: Callable[[], Awaitable[List[Product]]]) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.counters['coalesced'] += 1
+            return task
+
+        async def run():
+            try:
+                value = await fetch()
+                await self.put(platform, key, value)
+                return value
+            except Exception:
+                self.counters['errors'] += 1
+                raise
+            finally:
+                self._inflight.pop(key, None)
+
+        task = asyncio.create_task(run())
+        self._inflight[key] = task
+        return task
+
+    async def peek(self, platform: str, keywords: List[str], max_results: int,
+                   allow_stale: bool = False) -> Optional[List[Product]]:
+        entry = await self._lookup(self.key(platform, keywords, max_results))
+        if entry is None:
+            return None
+        if entry.fresh_until <= time.time():
+            if not allow_stale:
+                return None
+            self.counters['stale_hits'] += 1
+        else:
+            self.counters['hits'] += 1
+        return list(entry.value)
+
+    async def is_stale(self, platform: str, keywords: List[str], max_results: int) -> bool:
+        # An entry past its TTL that get_or_fetch would still serve while it revalidates
+        entry = await self._lookup(self.key(platform, keywords, max_results))
+        return entry is not None and entry.fresh_until <= time.time()
+
+    async def get_or_fetch(self, platform: str, keywords: List[str], max_results: int,
+                           fetch: Callable[[], Awaitable[List[Product]]]) -> List[Product]:
+        key = self.key(platform, keywords, max_results)
+        entry = await self._lookup(key)
+        now = time.time()
+        if entry is not None and entry.fresh_until > now:
+            self.counters['hits'] += 1
+            return list(entry.value)
+        if entry is not None:
+            self.counters['stale_hits'] += 1
+            if key not in self._inflight:
+                self.counters['revalidations'] += 1
+                self._fetch(platform, key, fetch).add_done_callback(_consume_result)
+            return list(entry.value)
+
+        self.counters['misses'] += 1
+        return list(await asyncio.shield(self._fetch(platform, key, fetch)))
+
+    def cached(self, platform: str):
+        def decorator(fn: Callable[..., Awaitable[List[Product]]]):
+            @functools.wraps(fn)
+            async def wrapper(keywords: List[str], max_results: int = 20) -> List[Product]:
+                return await self.get_or_fetch(platform, keywords, max_results, lambda: fn(keywords, max_results))
+            wrapper.uncached = fn
+            return wrapper
+        return decorator
+
+    def stats(self) -> dict:
+        lookups = self.counters['hits'] + self.counters['stale_hits'] + self.counters['misses']
+        return {
+            **self.counters,
+            'hit_ratio': round((self.counters['hits'] + self.counters['stale_hits']) / lookups, 4) if lookups else 0.0,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'inflight': len(self._inflight),
+            'disk': self.backend.path if self.backend else None
+        }
+
+def _default_backend() -> Optional[SQLiteCacheBackend]:
+    path = os.getenv("SEARCH_CACHE_SQLITE_PATH", "")
+    return SQLiteCacheBackend(path) if path else None
+
+search_cache = SearchCache(backend=_default_backend())
@@ -1,5 +1,117 @@
+import asyncio
+import contextvars
+import functools
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+import httpx
+from postgrest.utils import SyncClient
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
+
+from metrics import add_timing, registry
+
+CHUNK_SIZE = 500
+IN_CHUNK_SIZE = 200
+PAGE_SIZE = 1000
+
+MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "10"))
+KEEPALIVE_SECONDS = float(os.getenv("SUPABASE_KEEPALIVE_SECONDS", "30"))
+TIMEOUT_SECONDS = float(os.getenv("SUPABASE_TIMEOUT_SECONDS", "30"))
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("SUPABASE_CONNECT_TIMEOUT_SECONDS", "5"))
+WORKERS = int(os.getenv("SUPABASE_WORKERS", "8"))
+
+_client: Optional[Client] = None
+_client_lock = threading.Lock()
+
+# Blocking refresh/ingest jobs and the individual queries they fan out run on separate
+# pools, so a job waiting on its own queries can never starve them of threads
+_offload_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="supabase-job")
+_query_pool = ThreadPoolExecutor(max_workers=MAX_CONNECTIONS, thread_name_prefix="supabase-query")
+
+SUPABASE_SECONDS = registry.histogram("arbitraje_supabase_call_seconds", "Duración de cada llamada a PostgREST",
+                                      ("table", "method"))
+SUPABASE_ERRORS = registry.counter("arbitraje_supabase_errors_total", "Respuestas de error de PostgREST",
+                                   ("table", "method", "status"))
+
+def _start_call(request: httpx.Request):
+    request.extensions["started_at"] = time.perf_counter()
+
+def _observe_call(response: httpx.Response):
+    # Timed up to the response headers; every select/upsert/insert of a job passes through here
+    request = response.request
+    started_at = request.extensions.get("started_at")
+    table = request.url.path.rsplit("/", 1)[-1]
+    if started_at is not None:
+        elapsed = time.perf_counter() - started_at
+        SUPABASE_SECONDS.observe(elapsed, table=table, method=request.method)
+        add_timing('supabase', table, elapsed)
+    if response.status_code >= 400:
+        SUPABASE_ERRORS.inc(table=table, method=request.method, status=str(response.status_code))
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS)
+
+def _pooled_session(session: SyncClient) -> SyncClient:
+    return SyncClient(
+        base_url=session.base_url,
+        headers=session.headers,
+        timeout=_timeout(),
+        follow_redirects=True,
+        http2=True,
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE,
+                            keepalive_expiry=KEEPALIVE_SECONDS),
+        event_hooks={"request": [_start_call], "response": [_observe_call]},
+    )
 
 def get_supabase() -> Client:
-    return create_client(os.environ['SUPABASE_URL'], os.environ['SUPABASE_SERVICE_ROLE_KEY'])
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client = create_client(os.environ['SUPABASE_URL'], os.environ['SUPABASE_SERVICE_ROLE_KEY'],
+                                       options=ClientOptions(postgrest_client_timeout=_timeout()))
+                postgrest = client.postgrest
+                default_session = postgrest.session
+                postgrest.session = _pooled_session(default_session)
+                default_session.close()
+                _client = client
+    return _client
+
+def close_supabase():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.postgrest.session.close()
+            _client = None
+
+async def run_sync(fn: Callable, *args, **kwargs):
+    # The copied context carries the caller's request timings into the worker thread
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_offload_pool, functools.partial(context.run, fn, *args, **kwargs))
+
+def run_parallel(*calls: Callable) -> list:
+    futures = [_query_pool.submit(contextvars.copy_context().run, call) for call in calls]
+    return [future.result() for future in futures]
+
+def chunks(items: list, size: int = CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def select_all(make_query) -> list:
+    rows, start = [], 0
+    while True:
+        page = make_query().range(start, start + PAGE_SIZE - 1).execute().data
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+def select_in(make_query, column: str, values: list) -> list:
+    rows = []
+    for chunk in chunks(values, IN_CHUNK_SIZE):
+        rows.extend(select_all(lambda: make_query().in_(column, chunk)))
+    return rows
@@ -0,0 +1,118 @@
+import dataclasses
+import random
+
+import numpy as np
+import pytest
+
+from arbitrage_engine import ArbitrageEngine, calculate_arbitrage_opportunity, find_opportunities, find_page, round_cents, top_k_indices
+from products import Product
+
+PLATFORMS = ['wallapop', 'ebay', 'vinted', 'catawiki']
+
+# The nested loop search-arbitrage ran before the engine, kept as the reference. Ties on ROI now
+# break on (buy url, sell url) so that a cursor can resume a page
+
+def loop_opportunities(all_products, top_k=None):
+    opportunities = []
+    for buy_platform, buy_products in all_products.items():
+        for sell_platform, sell_products in all_products.items():
+            if buy_platform == sell_platform:
+                continue
+            for buy_product in buy_products:
+                for sell_product in sell_products:
+                    if sell_product.price > buy_product.price * 1.2:
+                        opportunity = calculate_arbitrage_opportunity(buy_product, sell_product)
+                        if opportunity.roi_percent > 0:
+                            opportunities.append(opportunity)
+    opportunities.sort(key=lambda x: (-x.roi_percent, x.buy.url, x.sell.url))
+    return opportunities[:top_k] if top_k is not None else opportunities
+
+def without_confidence(opportunities):
+    # Only matched searches fill match_confidence; the plain cross product leaves it None
+    assert all(o.match_confidence is None for o in opportunities)
+    return opportunities
+
+def random_products(rng: random.Random, sizes):
+    products = {}
+    for platform, size in zip(PLATFORMS, sizes):
+        products[platform] = [Product(
+            title=f'{platform} {i}',
+            # Whole and half euros make exact ROI ties likely, so tie order is exercised too
+            price=rng.choice([float(rng.randint(1, 400)), rng.randint(2, 800) / 2, round(rng.uniform(0.5, 900), 2)]),
+            url=f'https://{platform}.example/{i}',
+            platform=platform,
+        ) for i in range(size)]
+    return products
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("top_k", [None, 1, 50])
+def test_engine_matches_nested_loop(seed, top_k):
+    rng = random.Random(seed)
+    products = random_products(rng, [rng.randint(0, 60) for _ in PLATFORMS])
+    assert without_confidence(find_opportunities(products, products, top_k)) == loop_opportunities(products, top_k)
+
+def pages(products, page_size, shuffle=None, **options):
+    found, after = [], None
+    while True:
+        if shuffle is not None:
+            # Each page is a new search: the platforms return the same products in another order
+            products = {platform: shuffle.sample(items, len(items)) for platform, items in products.items()}
+        page, after = find_page(products, products, page_size, after=after, **options)
+        found.extend(page)
+        if after is None:
+            return found
+
+@pytest.mark.parametrize("page_size", [1, 7, 50])
+@pytest.mark.parametrize("sort_by", ['roi_percent', 'net_profit'])
+def test_cursor_pages_cover_every_opportunity_once(page_size, sort_by):
+    products = random_products(random.Random(4), [10, 10, 8, 8])
+    # Relisted copies at the same price tie exactly with the originals
+    for platform, items in products.items():
+        items.extend(dataclasses.replace(p, url=p.url + '/copy') for p in items[:3])
+    everything = find_opportunities(products, products, None, sort_by=sort_by)
+    assert pages(products, page_size, random.Random(page_size), sort_by=sort_by) == everything
+    keys = [getattr(o, sort_by) for o in everything]
+    assert keys == sorted(keys, reverse=True)
+
+def test_thresholds_filter_before_paging():
+    products = random_products(random.Random(5), [20, 20, 10, 15])
+    found = pages(products, 10, min_net_profit=25.0, min_roi=40.0)
+    assert found == [o for o in find_opportunities(products, products)
+                     if o.net_profit >= 25.0 and o.roi_percent >= 40.0]
+    assert found
+
+def test_cursor_resumes_when_its_urls_are_gone():
+    products = random_products(random.Random(6), [30, 30, 20, 25])
+    everything = find_opportunities(products, products)
+    page, after = find_page(products, products, 10)
+    last = page[-1]
+    # The last returned pair sold meanwhile; the next page starts right after where it was
+    remaining = {platform: [p for p in items if p.url not in (last.buy.url, last.sell.url)]
+                 for platform, items in products.items()}
+    expected = [o for o in everything[10:] if last.buy.url not in (o.buy.url, o.sell.url)
+                and last.sell.url not in (o.buy.url, o.sell.url)]
+    assert find_page(remaining, remaining, len(expected) + 1, after=after)[0] == expected
+
+def test_chunked_rows_match_single_block():
+    products = random_products(random.Random(11), [40, 35, 0, 25])
+    # Three cells per chunk forces one buy row per block
+    chunked = ArbitrageEngine(max_pair_cells=3).find_opportunities(products, products)
+    assert without_confidence(chunked) == loop_opportunities(products)
+
+def test_unknown_and_same_platform_are_skipped():
+    product = Product(title='x', price=10.0, url='', platform='wallapop')
+    unknown = Product(title='y', price=500.0, url='', platform='etsy')
+    assert find_opportunities({'wallapop': [product]}, {'wallapop': [dataclasses.replace(product, price=500.0)]}) == []
+    assert find_opportunities({'wallapop': [product]}, {'etsy': [unknown]}) == []
+    assert find_opportunities({}, {}) == []
+
+def test_round_cents_matches_python_round():
+    values = np.array([0.125, 0.135, 1.005, 2.675, -0.125, 12.344999, 7.0, 1e-9])
+    assert round_cents(values).tolist() == [round(round(float(v), 2) * 100) for v in values]
+
+def test_top_k_keeps_tie_order():
+    values = np.array([3, 5, 5, 1, 5, 3], dtype=np.int64)
+    assert top_k_indices(values).tolist() == [1, 2, 4, 0, 5, 3]
+    assert top_k_indices(values, 2).tolist() == [1, 2]
+    assert top_k_indices(values, 4).tolist() == [1, 2, 4, 0]
+    assert top_k_indices(values, 0).tolist() == []
@@ -0,0 +1,129 @@
+import gzip
+import json
+import zlib
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from auth import current_user
+import compression
+from compression import CompressionMiddleware, choose_encoding
+from main import app
+from products import OPPORTUNITY_FIELDS, Opportunity, Product
+
+@pytest.fixture
+def no_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+
+@pytest.mark.parametrize("header,expected", [
+    ("", ""),
+    ("identity", ""),
+    ("gzip", "gzip"),
+    ("GZip ; Q=0.5", "gzip"),
+    ("gzip;q=0", ""),
+    ("gzip;q=0.0, *", ""),
+    ("*", "gzip"),
+    ("*;q=0, gzip;q=0.1", "gzip"),
+    ("br, gzip;q=0.2", "gzip"),
+    # A malformed weight counts as q=0
+    ("gzip;q=high", ""),
+    ("deflate, gzip;q=0.001", "gzip"),
+])
+def test_choose_encoding_without_brotli(no_brotli, header, expected):
+    assert choose_encoding(header) == expected
+
+@pytest.mark.parametrize("header,expected", [
+    ("br, gzip", "br"),
+    ("gzip, br", "br"),
+    ("gzip;q=1.0, br;q=0.9", "gzip"),
+    ("br;q=0, *", "gzip"),
+    ("*", "br"),
+    ("gzip;q=0, br;q=0", ""),
+])
+def test_choose_encoding_with_brotli(header, expected):
+    pytest.importorskip("brotli")
+    assert choose_encoding(header) == expected
+
+BIG = json.dumps([{"title": f"Nintendo Switch {i}", "price": i} for i in range(200)]).encode()
+
+def make_client(minimum_size: int = 1024) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=minimum_size)
+
+    @app.get("/big")
+    async def big():
+        return Response(BIG, media_type="application/json")
+
+    @app.get("/small")
+    async def small():
+        return Response(b'{"ok":true}', media_type="application/json")
+
+    @app.get("/encoded")
+    async def encoded():
+        return Response(gzip.compress(BIG), media_type="application/json", headers={"content-encoding": "gzip"})
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            for i in range(50):
+                yield json.dumps({"line": i}).encode() + b"\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return TestClient(app)
+
+def raw_get(client: TestClient, path: str, accept_encoding: str):
+    # Streamed so the client hands back the bytes as sent, without decoding them
+    with client.stream("GET", path, headers={"accept-encoding": accept_encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+def test_large_body_is_gzipped(no_brotli):
+    response, body = raw_get(make_client(), "/big", "gzip")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "accept-encoding" in response.headers["vary"].lower()
+    assert int(response.headers["content-length"]) == len(body) < len(BIG)
+    assert gzip.decompress(body) == BIG
+
+def test_small_or_refused_bodies_pass_through(no_brotli):
+    response, body = raw_get(make_client(), "/small", "gzip")
+    assert "content-encoding" not in response.headers and body == b'{"ok":true}'
+    response, body = raw_get(make_client(), "/big", "gzip;q=0")
+    assert "content-encoding" not in response.headers and body == BIG
+
+def test_already_encoded_body_is_left_alone(no_brotli):
+    response, body = raw_get(make_client(), "/encoded", "gzip")
+    assert gzip.decompress(body) == BIG
+
+def test_stream_is_compressed_chunk_by_chunk(no_brotli):
+    response, body = raw_get(make_client(), "/stream", "gzip")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    lines = zlib.decompress(body, 16 + zlib.MAX_WBITS).splitlines()
+    assert [json.loads(line)["line"] for line in lines] == list(range(50))
+
+def test_brotli_body():
+    brotli = pytest.importorskip("brotli")
+    response, body = raw_get(make_client(), "/big", "br, gzip")
+    assert response.headers["content-encoding"] == "br"
+    assert brotli.decompress(body) == BIG
+
+def test_projection_keeps_requested_fields_in_order():
+    opportunity = Opportunity(buy=Product("Switch", 100.0, "https://a/1", "wallapop"),
+                              sell=Product("Switch OLED", 180.0, "https://b/2", "ebay"),
+                              net_profit=30.5, roi_percent=25.1, score=25.1, total_investment=112.0,
+                              buy_commission=5.0, buy_shipping=5.0, sell_commission=22.5, sell_shipping=7.0,
+                              payment_fee=5.4, packaging=2.0, taxes=15.2)
+    assert list(opportunity.to_dict()) == list(OPPORTUNITY_FIELDS)
+    assert opportunity.to_dict(["roi_percent", "buy_url"]) == {"roi_percent": 25.1, "buy_url": "https://a/1"}
+    assert opportunity.to_dict([]) == {}
+
+def test_unknown_fields_are_rejected():
+    app.dependency_overrides[current_user] = lambda: "user-1"
+    try:
+        client = TestClient(app)
+        response = client.post("/api/search-arbitrage", json={"keywords": ["switch"], "fields": ["roi_percent", "secret"]})
+        assert response.status_code == 400 and "secret" in response.json()["detail"]
+        assert client.get("/api/opportunities", params={"fields": "total_score,secret"}).status_code == 400
+    finally:
+        app.dependency_overrides.pop(current_user, None)
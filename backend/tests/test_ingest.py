@@ -0,0 +1,87 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import ingest
+from ingest import dedupe, ingest_browser_searches, ingest_listings, ingest_sales, parse_items
+from benchmarks.memory_supabase import MemorySupabase
+from models import BrowserSearchIn, ListingIn, ObservedSaleIn
+from sales_stats import sales_stats
+
+USER = "user-1"
+
+def listing(url: str, price: float = 10.0) -> dict:
+    return {"platform": "wallapop", "url": url, "title": f"Switch {url}", "price": price}
+
+def sale(url, price: float = 100.0, sold_at: str = "2024-03-01") -> dict:
+    return {"platform": "ebay", "product_id": "P1", "sold_price": price, "sold_at": sold_at, "url": url}
+
+@pytest.fixture(autouse=True)
+def clean_stats():
+    sales_stats.invalidate(USER)
+    yield
+    sales_stats.invalidate(USER)
+
+def test_parse_json_array_and_single_object():
+    items, rejected = parse_items(json.dumps([listing("a"), {"platform": "ebay"}, listing("b")]).encode(),
+                                  "application/json", ListingIn)
+    assert [item.url for item in items] == ["a", "b"]
+    assert [r["index"] for r in rejected] == [1]
+    items, rejected = parse_items(json.dumps(listing("a")).encode(), "application/json", ListingIn)
+    assert len(items) == 1 and not rejected
+
+def test_parse_ndjson_reports_line_indexes():
+    raw = "\n".join([json.dumps(listing("a")), "", "{not json", json.dumps({**listing("c"), "price": "x"}),
+                     json.dumps(listing("d"))]).encode()
+    items, rejected = parse_items(raw, "application/x-ndjson; charset=utf-8", ListingIn)
+    assert [item.url for item in items] == ["a", "d"]
+    assert [r["index"] for r in rejected] == [1, 2]
+    assert "price" in rejected[1]["error"]
+
+@pytest.mark.parametrize("raw,status", [(b"{oops", 400), (b'"text"', 400), (b"[{}, {}, {}]", 413)])
+def test_parse_rejects_whole_body(monkeypatch, raw, status):
+    monkeypatch.setattr(ingest, "INGEST_MAX_ITEMS", 2)
+    with pytest.raises(HTTPException) as e:
+        parse_items(raw, "application/json", ListingIn)
+    assert e.value.status_code == status
+
+def test_dedupe_keeps_last_capture():
+    rows = [{"user_id": USER, "platform": "ebay", "url": "a", "n": 1},
+            {"user_id": USER, "platform": "ebay", "url": None, "n": 2},
+            {"user_id": USER, "platform": "vinted", "url": "a", "n": 3},
+            {"user_id": USER, "platform": "ebay", "url": None, "n": 4},
+            {"user_id": USER, "platform": "ebay", "url": "a", "n": 5}]
+    assert [row["n"] for row in dedupe(rows)] == [2, 3, 4, 5]
+
+def test_listings_upsert_on_url():
+    db = MemorySupabase()
+    items = [ListingIn(**listing(url, price)) for url, price in [("a", 10), ("b", 20), ("a", 12)]]
+    assert ingest_listings(db, USER, items) == {"received": 3, "duplicates": 1, "upserted": 2}
+    ingest_listings(db, USER, [ListingIn(**listing("b", 25))])
+    search = BrowserSearchIn(platform="wallapop", url="https://es.wallapop.com/search?q=switch",
+                             results=[{"url": "c", "title": "Switch c", "price": 30}, {"url": "a", "title": "Switch a", "price": 11}])
+    ingest_browser_searches(db, USER, [search])
+    assert sorted((row["url"], row["price"]) for row in db.tables["listings"]) == [("a", 11), ("b", 25), ("c", 30)]
+
+def test_sales_skip_stored_urls():
+    db = MemorySupabase()
+    first = [ObservedSaleIn(**sale(url)) for url in ["a", "b", "a", None]]
+    assert ingest_sales(db, USER, first) == {"received": 4, "duplicates": 1, "inserted": 3}
+    again = [ObservedSaleIn(**sale(url, 150.0)) for url in ["a", "c", None]]
+    assert ingest_sales(db, USER, again) == {"received": 3, "duplicates": 1, "inserted": 2}
+    rows = db.tables["observed_sales"]
+    assert sorted(str(row["url"]) for row in rows) == ["None", "None", "a", "b", "c"]
+    # The stored sale keeps its first price; a recapture does not overwrite it
+    assert [row["sold_price"] for row in rows if row["url"] == "a"] == [100.0]
+    # The same url on another platform is another sale
+    other = ObservedSaleIn(**{**sale("a"), "platform": "catawiki"})
+    assert ingest_sales(db, USER, [other])["inserted"] == 1
+
+def test_inserted_sales_reach_the_stats_store():
+    db = MemorySupabase()
+    assert sales_stats.summaries(db, USER, ["P1"], ["ebay"], False)[("P1", "ebay")]["count"] == 0
+    ingest_sales(db, USER, [ObservedSaleIn(**sale(url, price)) for url, price in [("a", 100), ("b", 200), ("a", 100)]])
+    ingest_sales(db, USER, [ObservedSaleIn(**sale("b", 500))])
+    summary = sales_stats.summaries(db, USER, ["P1"], ["ebay"], False)[("P1", "ebay")]
+    assert (summary["count"], summary["median"]) == (2, 150.0)
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import types
+
+import pytest
+
+import job_queue
+import scrape_worker
+from job_queue import (ERROR_TIMED_OUT, JOB_DONE, JOB_EXPIRED, JOB_FAILED, JOB_LEASE_SECONDS, JOB_QUEUED,
+                       JOB_RUNNING, JobFailed, SQLiteJobQueue, run_job)
+from products import Product
+from scrape_worker import ScrapeWorker
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue, "time", types.SimpleNamespace(time=clock))
+    return clock
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite"))
+    yield queue
+    queue.close()
+
+def product(title: str) -> Product:
+    return Product(title=title, price=10.0, url=f'https://es.wallapop.com/item/{title}', platform='wallapop')
+
+def test_claims_are_exclusive_and_in_order(clock, queue):
+    first = queue.enqueue('wallapop', ['switch'], 20)
+    clock.now += 1
+    second = queue.enqueue('ebay', ['switch'], 20)
+    clock.now += 1
+    third = queue.enqueue('wallapop', ['ps5'], 10)
+
+    job = queue.claim('w1', ['wallapop', 'ebay'])
+    assert (job['id'], job['keywords'], job['max_results']) == (first, ['switch'], 20)
+    assert queue.claim('w2', ['wallapop'])['id'] == third
+    assert queue.claim('w2', ['wallapop']) is None
+    assert queue.claim('w2', []) is None
+    assert queue.claim('w2', ['ebay'])['id'] == second
+    assert queue.get(first)['status'] == JOB_RUNNING
+
+def test_claims_from_threads_never_overlap(queue):
+    ids = {queue.enqueue('wallapop', [str(i)], 20) for i in range(40)}
+    claimed, lock = [], threading.Lock()
+
+    def work(name):
+        while (job := queue.claim(name, ['wallapop'])) is not None:
+            with lock:
+                claimed.append(job['id'])
+    threads = [threading.Thread(target=work, args=(f'w{i}',)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(ids)
+
+def test_lapsed_lease_goes_back_in_line(clock, queue):
+    job_id = queue.enqueue('wallapop', ['switch'], 20)
+    queue.claim('w1', ['wallapop'])
+    clock.now += JOB_LEASE_SECONDS / 2
+    queue.renew('w1', [job_id])
+    # Renewed halfway through, so the original lease end is not enough
+    clock.now += JOB_LEASE_SECONDS / 2
+    assert queue.claim('w2', ['wallapop']) is None
+
+    clock.now += JOB_LEASE_SECONDS / 2
+    job = queue.claim('w2', ['wallapop'])
+    assert job['id'] == job_id
+    assert queue.get(job_id)['attempts'] == 2
+
+    # The first worker lost the job; only its new owner may finish it
+    queue.complete(job_id, 'w1', [product('late')])
+    assert queue.get(job_id)['status'] == JOB_RUNNING
+    queue.complete(job_id, 'w2', [product('ok')])
+    finished = queue.get(job_id)
+    assert (finished['status'], finished['worker'], finished['products']) == (JOB_DONE, 'w2', [product('ok')])
+
+def test_jobs_expire_and_are_purged(clock, queue):
+    waiting = queue.enqueue('wallapop', ['switch'], 20, timeout=5)
+    failed = queue.enqueue('ebay', ['switch'], 20, timeout=5)
+    queue.claim('w1', ['ebay'])
+    queue.fail(failed, 'w1', 'RuntimeError: blocked')
+    assert (queue.get(failed)['status'], queue.get(failed)['error']) == (JOB_FAILED, 'RuntimeError: blocked')
+
+    clock.now += 5
+    assert queue.get(waiting)['status'] == JOB_EXPIRED
+    assert queue.claim('w1', ['wallapop']) is None
+    assert queue.stats()[JOB_EXPIRED] == 1
+
+    queue.purge(retention=60)
+    assert queue.get(waiting) is not None
+    clock.now += 60
+    queue.purge(retention=60)
+    assert queue.get(waiting) is None and queue.get(failed) is None
+
+def test_stats_count_busy_workers(clock, queue):
+    for platform in ['wallapop', 'wallapop', 'ebay']:
+        queue.enqueue(platform, ['switch'], 20)
+    queue.claim('w1', ['wallapop'])
+    queue.claim('w2', ['wallapop'])
+    stats = queue.stats()
+    assert (stats[JOB_QUEUED], stats[JOB_RUNNING], stats['busy_workers']) == (1, 2, 2)
+    clock.now += JOB_LEASE_SECONDS
+    assert queue.stats()['busy_workers'] == 0
+
+def run_worker(queue, scrapers, monkeypatch, *job_args):
+    monkeypatch.setattr(scrape_worker, "SCRAPERS", scrapers)
+
+    async def run():
+        worker = ScrapeWorker(queue, concurrency=2, name='w1')
+        task = asyncio.create_task(worker.run())
+        try:
+            return await asyncio.gather(*(run_job(queue, *args) for args in job_args), return_exceptions=True)
+        finally:
+            worker.stop()
+            await task
+    return asyncio.run(run())
+
+def test_worker_answers_queued_searches(queue, monkeypatch):
+    async def wallapop(keywords, max_results):
+        return [product(keyword) for keyword in keywords][:max_results]
+
+    async def ebay(keywords, max_results):
+        raise RuntimeError('blocked')
+
+    results = run_worker(queue, {'wallapop': wallapop, 'ebay': ebay}, monkeypatch,
+                         ('wallapop', ['switch', 'oled'], 1), ('ebay', ['switch'], 20))
+    assert results[0] == [product('switch')]
+    assert isinstance(results[1], JobFailed) and 'blocked' in str(results[1])
+
+def test_worker_timeout_reaches_the_caller(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_TIMEOUT_SECONDS", 0.3)
+    monkeypatch.setattr(scrape_worker, "STOP_GRACE_SECONDS", 0.0)
+
+    async def slow(keywords, max_results):
+        await asyncio.sleep(5)
+
+    [result] = run_worker(queue, {'wallapop': slow}, monkeypatch, ('wallapop', ['switch'], 20))
+    assert isinstance(result, asyncio.TimeoutError)
+    # The caller gave up; the job keeps its lease until it lapses or the job itself expires
+    assert queue.stats()[JOB_RUNNING] == 1
+
+def test_worker_stops_scraping_when_the_job_expires(queue, monkeypatch):
+    monkeypatch.setattr(scrape_worker, "SCRAPERS", {'wallapop': lambda keywords, max_results: asyncio.sleep(5)})
+
+    async def run():
+        job_id = queue.enqueue('wallapop', ['switch'], 20, timeout=0.3)
+        worker = ScrapeWorker(queue, concurrency=1, name='w1')
+        task = asyncio.create_task(worker.run())
+        job = await job_queue.wait_for_job(queue, job_id, 2)
+        worker.stop()
+        await task
+        return job
+    job = asyncio.run(run())
+    assert (job['status'], job['error']) == (JOB_FAILED, ERROR_TIMED_OUT)
+
+def test_workers_skip_the_search_cache():
+    assert all(search.__name__.startswith('search_') for search in scrape_worker.SCRAPERS.values())
+    assert all(not hasattr(search, 'uncached') for search in scrape_worker.SCRAPERS.values())
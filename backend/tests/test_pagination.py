@@ -0,0 +1,62 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from auth import current_user
+from main import app
+from pagination import cursor_number, cursor_sort, cursor_uuid, decode_cursor, encode_cursor
+
+def status_of(fn, *args, **kwargs):
+    with pytest.raises(HTTPException) as e:
+        fn(*args, **kwargs)
+    return e.value.status_code
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(["roi_percent", 1250, "https://a/1", "https://b/2"])
+    assert "=" not in cursor
+    assert decode_cursor(cursor, (str,), (int,), (str,), (str,)) == ["roi_percent", 1250, "https://a/1", "https://b/2"]
+    assert decode_cursor(None, (str,)) is None
+
+@pytest.mark.parametrize("cursor", [
+    "%%%",
+    encode_cursor({"a": 1}),
+    encode_cursor(["roi_percent", 1250]),
+    encode_cursor(["roi_percent", "1250", "a", "b"]),
+    # bool is an int to Python, not to a cursor
+    encode_cursor(["roi_percent", True, "a", "b"]),
+])
+def test_malformed_cursors_are_rejected(cursor):
+    assert status_of(decode_cursor, cursor, (str,), (int,), (str,), (str,)) == 400
+
+def test_cursor_must_match_the_ordering():
+    assert cursor_sort(None, "roi_percent") is None
+    assert cursor_sort(["net_profit", 10, "a", "b"], "net_profit") == [10, "a", "b"]
+    assert status_of(cursor_sort, ["net_profit", 10, "a", "b"], "roi_percent") == 400
+
+def test_filter_values_are_canonical():
+    assert cursor_uuid("6F9619FF-8B86-D011-B42D-00C04FC964FF") == "6f9619ff-8b86-d011-b42d-00c04fc964ff"
+    assert status_of(cursor_uuid, "1,id.gt.0") == 400
+    assert cursor_number(3.0, integer=True) == 3
+    for value in [float("nan"), float("inf"), True, "1"]:
+        assert status_of(cursor_number, value) == 400
+    assert status_of(cursor_number, 2.5, integer=True) == 400
+
+@pytest.fixture
+def client():
+    app.dependency_overrides[current_user] = lambda: "user-1"
+    yield TestClient(app)
+    app.dependency_overrides.pop(current_user, None)
+
+@pytest.mark.parametrize("body", [{"max_results": 0}, {"max_results": 201}, {"limit": 0}, {"limit": 501}])
+def test_search_bounds(client, body):
+    assert client.post("/api/search-arbitrage", json={"keywords": ["switch"], **body}).status_code == 422
+
+def test_search_cursor_from_another_ordering(client):
+    cursor = encode_cursor(["net_profit", 1000, "https://a/1", "https://b/2"])
+    response = client.post("/api/search-arbitrage", json={"keywords": ["switch"], "sort_by": "roi_percent", "cursor": cursor})
+    assert response.status_code == 400
+
+def test_opportunities_cursor_from_another_ordering(client):
+    cursor = encode_cursor(["total_score.desc", 80.5, "6f9619ff-8b86-d011-b42d-00c04fc964ff"])
+    assert client.get("/api/opportunities", params={"sort_by": "total_score", "order": "asc", "cursor": cursor}).status_code == 400
+    assert client.get("/api/opportunities", params={"limit": 501}).status_code == 422
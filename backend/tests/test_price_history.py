@@ -0,0 +1,135 @@
+import math
+import random
+from datetime import date
+
+import numpy as np
+import pytest
+
+from benchmarks.memory_supabase import MemorySupabase
+from ingest import compact_price_history, ingest_sales
+from models import ObservedSaleIn
+from price_history import (DAILY_RETENTION_DAYS, MAX_WEEKS, RAW_RETENTION_DAYS, PriceSeries, from_day, signals,
+                           to_day, today, week_start)
+from sales_stats import SALES_WINDOW, sales_stats
+
+USER = "user-1"
+
+def brute_buckets(days, prices) -> list:
+    buckets = []
+    for day in sorted(set(days)):
+        values = sorted(p for d, p in zip(days, prices) if d == day)
+        n = len(values)
+        buckets.append({"start": from_day(day), "count": n, "min": values[0],
+                        "median": round((values[(n - 1) // 2] + values[n // 2]) / 2, 2), "max": values[-1]})
+    return buckets
+
+@pytest.mark.parametrize("seed", range(4))
+def test_from_points_matches_brute_force(seed):
+    rng = random.Random(seed)
+    days = [rng.randint(19000, 19030) for _ in range(200)]
+    prices = [float(rng.randint(50, 500)) for _ in days]
+    assert PriceSeries.from_points(days, prices).buckets() == brute_buckets(days, prices)
+    assert len(PriceSeries.from_points([], [])) == 0
+
+def test_merge_of_disjoint_days_is_the_union():
+    old = PriceSeries.from_points([10, 10, 12], [5.0, 7.0, 9.0])
+    new = PriceSeries.from_points([11, 13, 13, 13], [1.0, 2.0, 8.0, 3.0])
+    assert new.merge(old).buckets() == brute_buckets([10, 10, 12, 11, 13, 13, 13], [5.0, 7.0, 9.0, 1.0, 2.0, 8.0, 3.0])
+    assert old.merge(PriceSeries()) is old and PriceSeries().merge(old) is old
+
+def test_merge_of_one_day_weights_medians_by_count():
+    heavy = PriceSeries([5], [3], [8.0], [10.0], [12.0])
+    light = PriceSeries([5], [1], [19.0], [20.0], [21.0])
+    [bucket] = heavy.merge(light).buckets()
+    assert (bucket["count"], bucket["min"], bucket["median"], bucket["max"]) == (4, 8.0, 10.0, 21.0)
+    [bucket] = PriceSeries([5], [1], [9.0], [10.0], [11.0]).merge(PriceSeries([5], [3], [18.0], [20.0], [22.0])).buckets()
+    assert bucket["median"] == 20.0
+
+def test_row_round_trip():
+    series = PriceSeries.from_points([100, 100, 101], [10.004, 20.0, 30.5])
+    row = series.to_row()
+    assert row == {"days": [100, 101], "counts": [2, 1], "mins": [10.0, 30.5], "medians": [15.0, 30.5], "maxs": [20.0, 30.5]}
+    assert PriceSeries.from_row(row).buckets() == series.buckets()
+    assert len(PriceSeries.from_row({"days": None, "counts": None, "mins": None, "medians": None, "maxs": None})) == 0
+
+def test_weeks_start_on_monday():
+    for day in range(to_day("2024-01-01"), to_day("2024-01-15")):
+        start = week_start(day)
+        assert date.fromisoformat(from_day(start)).weekday() == 0 and 0 <= day - start < 7
+
+def test_compact_goes_weekly_then_drops():
+    now = to_day("2024-06-30")
+    days = list(range(now - 1000, now + 1))
+    series = PriceSeries.from_points(days, [float(d % 97) for d in days]).compact(now)
+
+    daily_from = week_start(now - DAILY_RETENTION_DAYS)
+    oldest = week_start(now) - MAX_WEEKS * 7
+    assert series.day[0] == oldest
+    weekly = series.day[series.day < daily_from]
+    assert all(date.fromisoformat(from_day(d)).weekday() == 0 for d in weekly)
+    assert np.all(np.diff(weekly) == 7) and np.all(series.count[series.day < daily_from] == 7)
+    assert series.day[series.day >= daily_from].tolist() == list(range(daily_from, now + 1))
+    # Every sale from the oldest kept week on is still counted, nothing before it
+    assert int(series.count.sum()) == now - oldest + 1
+    assert series.low.min() == 0.0 and series.high.max() == 96.0
+    assert series.compact(now).buckets() == series.buckets()
+
+def test_signals():
+    assert all(math.isnan(value) for value in signals(PriceSeries(), 1000))
+    now = 1000
+    # Two sales a day for four weeks, the median rising one euro a day from 100
+    days = [d for d in range(now - 27, now + 1) for _ in range(2)]
+    velocity, trend = signals(PriceSeries.from_points(days, [100.0 + d - (now - 27) for d in days]), now)
+    assert velocity == 14.0
+    assert trend == pytest.approx(7 / 113.5)
+    velocity, trend = signals(PriceSeries.from_points([now - 3], [50.0]), now)
+    assert velocity == 0.25 and math.isnan(trend)
+    # Sales after "now" or before the windows do not count
+    assert signals(PriceSeries.from_points([now - 400, now + 1], [50.0, 60.0]), now)[0] == 0.0
+
+def sale(i: int, days_ago: int, is_demo: bool = False) -> dict:
+    return {"id": f"S{i:04d}", "user_id": USER, "platform": "ebay", "product_id": "P1", "sold_price": 100.0 + i,
+            "sold_at": from_day(today() - days_ago), "url": f"https://ebay/{i}", "is_demo": is_demo}
+
+@pytest.fixture
+def db():
+    sales_stats.invalidate(USER)
+    # A sale every three days for a year, newest first
+    yield MemorySupabase({"observed_sales": [sale(i, 3 * i) for i in range(120)], "price_history": []})
+    sales_stats.invalidate(USER)
+
+def summary(db) -> dict:
+    sales_stats.invalidate(USER)
+    return sales_stats.summaries(db, USER, ["P1"], ["ebay"], False)[("P1", "ebay")]
+
+def test_compaction_keeps_counts_and_estimates(db):
+    before = summary(db)
+    assert (before["count"], before["window"], before["velocity"]) == (120, SALES_WINDOW, 2.5)
+
+    result = compact_price_history(db, USER)
+    # Older than the raw window and outside the latest SALES_WINDOW sales
+    assert result == {"compacted": 120 - SALES_WINDOW, "series": 1}
+    assert sorted(row["id"] for row in db.tables["observed_sales"]) == [f"S{i:04d}" for i in range(SALES_WINDOW)]
+    [history] = db.tables["price_history"]
+    assert sum(history["counts"]) == 120 - SALES_WINDOW
+    assert history["compacted_through"] == today() - RAW_RETENTION_DAYS
+
+    after = summary(db)
+    assert after == before
+    assert compact_price_history(db, USER) == {"compacted": 0, "series": 0}
+
+def test_compacted_sales_are_not_ingested_again(db):
+    compact_price_history(db, USER)
+    old, recent = sale(100, 300), sale(500, 1)
+    items = [ObservedSaleIn(**{k: v for k, v in row.items() if k not in ("id", "user_id")}) for row in (old, recent)]
+    assert ingest_sales(db, USER, items)["inserted"] == 1
+    assert summary(db)["count"] == 121
+
+def test_demo_sales_get_their_own_series(db):
+    db.tables["observed_sales"] += [sale(200 + i, 200 + i, is_demo=True) for i in range(3)]
+    compact_price_history(db, USER)
+    series = {row["is_demo"]: sum(row["counts"]) for row in db.tables["price_history"]}
+    assert series == {False: 120 - SALES_WINDOW, True: 3}
+    sales_stats.invalidate(USER)
+    assert sales_stats.summaries(db, USER, ["P1"], ["ebay"], True)[("P1", "ebay")]["count"] == 123
+    assert summary(db)["count"] == 120
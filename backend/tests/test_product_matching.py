@@ -0,0 +1,96 @@
+import random
+
+import pytest
+
+from arbitrage_engine import calculate_arbitrage_opportunity, find_opportunities
+from product_index import ProductIndex
+from products import Product
+from product_matching import TitleMatcher, match_pairs, normalize_title
+
+@pytest.mark.parametrize("title,tokens", [
+    ("Sony WH-1000XM4 auriculares", ["sony", "wh1000xm4", "wh", "1000xm4", "auriculares"]),
+    ("iPhone 12 128GB nuevo", ["iphone", "12", "128gb"]),
+    ("iPhone 12 128 GB", ["iphone", "12", "128gb"]),
+    ("Disco duro 2 TO", ["disco", "duro", "2tb"]),
+    ("PlayStation 5 edición digital", ["playstation", "5", "edicion", "digital"]),
+    ("Nintendo Switch 2nd gen", ["nintendo", "switch", "2"]),
+    ("", []),
+])
+def test_normalize_title(title, tokens):
+    assert normalize_title(title) == tokens
+
+SELL_TITLES = ["iPhone 12 128GB negro", "iPhone 12 64GB", "LEGO Star Wars 75192 Millennium Falcon",
+               "Sony WH-1000XM4 negro", "Samsung Galaxy S21"]
+
+@pytest.mark.parametrize("title,expected", [
+    ("iphone 12 128 gb", 0),
+    ("sony wh1000xm4", 3),
+    ("galaxy s21 samsung", 4),
+    # Same words, but the model number or storage size disagrees
+    ("LEGO Star Wars 75257 Millennium Falcon", None),
+    ("iPhone 13 128GB negro", None),
+    ("iPhone 12 256GB", None),
+])
+def test_best_match(title, expected):
+    best = TitleMatcher(SELL_TITLES).best(title)
+    assert (best[0] if best else None) == expected
+
+WORDS = ["iphone", "samsung", "galaxy", "lego", "sony", "funda", "negro", "azul", "pro", "max", "mini", "consola",
+         "12", "13", "s21", "75192", "wh1000xm4", "64gb", "128gb", "256gb", "1tb", "2", "5"]
+
+def random_titles(rng: random.Random, n: int):
+    return [" ".join(rng.sample(WORDS, rng.randint(1, 6))) for _ in range(n)]
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("threshold", [0.2, 0.35, 0.6])
+def test_match_many_equals_query(seed, threshold):
+    rng = random.Random(seed)
+    matcher = TitleMatcher(random_titles(rng, 300))
+    buy_titles = random_titles(rng, 80)
+    title_idx, doc_idx, scores = match_pairs(buy_titles, matcher, threshold)
+    bulk = {(int(t), int(d)): float(s) for t, d, s in zip(title_idx, doc_idx, scores)}
+    single = {(t, d): s for t, title in enumerate(buy_titles) for d, s in matcher.query(title, threshold)}
+    assert bulk.keys() == single.keys()
+    for pair, score in single.items():
+        assert bulk[pair] == pytest.approx(score)
+
+def test_titles_added_after_a_query_are_found():
+    matcher = TitleMatcher(SELL_TITLES)
+    assert matcher.best("nintendo switch oled") is None
+    doc_id = matcher.add("Nintendo Switch OLED blanca")
+    assert matcher.best("nintendo switch oled")[0] == doc_id
+    assert match_pairs(["nintendo switch oled"], matcher)[1].tolist() == [doc_id]
+
+def test_engine_only_pairs_matching_titles():
+    rng = random.Random(3)
+    products = {platform: [Product(title=title, price=float(rng.randint(5, 900)), url=f'{platform}/{i}', platform=platform)
+                           for i, title in enumerate(random_titles(rng, 40))]
+                for platform in ['wallapop', 'ebay', 'vinted']}
+    opportunities = find_opportunities(products, products, None, 0.35)
+    assert opportunities
+    expected = []
+    for buy_platform, buy_products in products.items():
+        for sell_platform, sell_products in products.items():
+            if buy_platform == sell_platform:
+                continue
+            matcher = TitleMatcher([p.title for p in sell_products])
+            for buy in buy_products:
+                for doc_id, score in matcher.query(buy.title, 0.35):
+                    sell = sell_products[doc_id]
+                    opportunity = calculate_arbitrage_opportunity(buy, sell)
+                    if sell.price > buy.price * 1.2 and opportunity.roi_percent > 0:
+                        expected.append((buy.url, sell.url, round(score, 2)))
+    got = [(o.buy.url, o.sell.url, o.match_confidence) for o in opportunities]
+    assert sorted(got) == sorted(expected)
+    rois = [o.roi_percent for o in opportunities]
+    assert rois == sorted(rois, reverse=True)
+
+def test_product_index_maps_aliases_and_placeholders():
+    index = ProductIndex([{"id": "p1", "canonical_name": "iPhone 12 128GB", "aliases": ["Apple iPhone doce 128GB"]},
+                          {"id": "p2", "canonical_name": "Sony WH-1000XM4", "aliases": None}])
+    assert index.best("apple iphone doce", 0.35)[0] == "p1"
+    assert index.best("sony wh1000xm4 negro", 0.35)[0] == "p2"
+    index.add(("new", 0), ["Nintendo Switch OLED"])
+    assert index.best("switch oled nintendo", 0.35)[0] == ("new", 0)
+    index.resolve({("new", 0): "p3"})
+    assert index.best("switch oled nintendo", 0.35)[0] == "p3"
@@ -0,0 +1,111 @@
+import pytest
+
+from benchmarks.memory_supabase import MemorySupabase
+from models import RefreshIn
+from opportunities import refresh
+from product_index import product_index_cache
+from sales_stats import sales_stats
+
+USER = "user-1"
+PRODUCTS = ["iPhone 12 128GB", "Nintendo Switch OLED", "Sony WH-1000XM4", "LEGO 75192 Millennium Falcon"]
+
+def listing(i: int, product: str, price: float, imported_at: str) -> dict:
+    return {"id": f"L{i:04d}", "user_id": USER, "platform": "wallapop", "url": f"https://example/{i}",
+            "title": f"{product} usado", "price": price, "shipping_price": None, "is_demo": False,
+            "imported_at": imported_at}
+
+def sale(i: int, product_id: str, price: float, sold_at: str) -> dict:
+    return {"id": f"S{i:04d}", "user_id": USER, "platform": "ebay", "product_id": product_id,
+            "sold_price": price, "sold_at": sold_at, "is_demo": False}
+
+@pytest.fixture
+def db():
+    product_index_cache.invalidate(USER)
+    sales_stats.invalidate(USER)
+    db = MemorySupabase({
+        "user_settings": [{"user_id": USER, "packaging_cost": 2.0, "tax_enabled": False, "tax_rate": 0.0,
+                           "risk_buffer": 0.05, "liquidity_days_high": 7, "liquidity_days_medium": 14,
+                           "liquidity_days_low": 30}],
+        "platform_fees": [{"user_id": USER, "platform": "ebay", "fee_percent": 0.125, "fee_fixed": 0.35},
+                          {"user_id": USER, "platform": "wallapop", "fee_percent": 0.05, "fee_fixed": 0.0}],
+        "products": [{"id": f"P{i}", "user_id": USER, "canonical_name": name, "aliases": [], "liquidity_class": "medium"}
+                     for i, name in enumerate(PRODUCTS)],
+        "listings": [listing(i, PRODUCTS[i % 4], 50.0 + 10 * i, f"2024-03-01T10:{i:02d}:00+00:00") for i in range(8)],
+        "listing_product_match": [],
+        "observed_sales": [sale(i, f"P{i % 4}", 300.0 + i, f"2024-02-{10 + i:02d}") for i in range(12)],
+    })
+    yield db
+    product_index_cache.invalidate(USER)
+    sales_stats.invalidate(USER)
+
+BODY = RefreshIn(min_roi=0.0, min_net_margin=0.0).model_dump()
+
+def opportunities(db) -> dict:
+    return {(row["buy_listing_id"], row["sell_platform"]): {k: v for k, v in row.items() if k != "id"}
+            for row in db.tables["opportunities"]}
+
+def full_refresh_of(db) -> dict:
+    # A fresh copy of the same data refreshed from scratch is what the incremental path must converge to
+    copy = MemorySupabase({name: [dict(row) for row in rows] for name, rows in db.tables.items()
+                           if name not in ("opportunities", "refresh_watermarks")})
+    product_index_cache.invalidate(USER)
+    sales_stats.invalidate(USER)
+    refresh(copy, USER, {**BODY, "full": True})
+    product_index_cache.invalidate(USER)
+    sales_stats.invalidate(USER)
+    return opportunities(copy)
+
+def test_first_refresh_is_full_then_noop(db):
+    result = refresh(db, USER, BODY)
+    assert (result["mode"], result["recomputed"]) == ("full", 8)
+    assert len(db.tables["opportunities"]) == 8
+
+    db.reset_counters()
+    result = refresh(db, USER, BODY)
+    assert (result["mode"], result["recomputed"], result["skipped"]) == ("incremental", 0, 8)
+    assert ("opportunities", "upsert") not in db.round_trips
+
+def test_new_listings_are_recomputed_once(db):
+    refresh(db, USER, BODY)
+    db.tables["listings"].append(listing(20, PRODUCTS[1], 80.0, "2024-03-02T09:00:00+00:00"))
+    # Committed late with an older stamp, inside the lag window
+    db.tables["listings"].append(listing(21, PRODUCTS[2], 90.0, "2024-03-01T10:05:30+00:00"))
+    result = refresh(db, USER, BODY)
+    assert (result["mode"], result["recomputed"]) == ("incremental", 2)
+    assert refresh(db, USER, BODY)["recomputed"] == 0
+    assert opportunities(db) == full_refresh_of(db)
+
+def test_new_sales_recompute_that_products_listings(db):
+    refresh(db, USER, BODY)
+    before = opportunities(db)
+    for i in range(5):
+        db.tables["observed_sales"].append(sale(100 + i, "P0", 900.0, "2024-03-05"))
+    result = refresh(db, USER, BODY)
+    assert result["recomputed"] == 2
+    after = opportunities(db)
+    changed = {key for key in after if after[key] != before[key]}
+    assert changed == {("L0000", "ebay"), ("L0004", "ebay")}
+    assert after == full_refresh_of(db)
+
+    # A second sale on the boundary day is new; the ones already seen that day are not
+    db.tables["observed_sales"].append(sale(200, "P1", 950.0, "2024-03-05"))
+    assert refresh(db, USER, BODY)["recomputed"] == 2
+    assert refresh(db, USER, BODY)["recomputed"] == 0
+    assert opportunities(db) == full_refresh_of(db)
+
+def test_settings_change_forces_full(db):
+    refresh(db, USER, BODY)
+    db.tables["user_settings"][0]["packaging_cost"] = 5.0
+    assert refresh(db, USER, BODY)["mode"] == "full"
+    assert refresh(db, USER, {**BODY, "min_roi": 0.05})["mode"] == "full"
+    assert refresh(db, USER, {**BODY, "min_roi": 0.05})["mode"] == "incremental"
+
+def test_targeted_refresh_keeps_watermark(db):
+    refresh(db, USER, BODY)
+    watermark = dict(db.tables["refresh_watermarks"][0])
+    db.tables["listings"].append(listing(30, PRODUCTS[3], 70.0, "2024-03-03T08:00:00+00:00"))
+    result = refresh(db, USER, {**BODY, "listing_ids": ["L0030"]})
+    assert (result["mode"], result["recomputed"]) == ("targeted", 1)
+    assert db.tables["refresh_watermarks"][0] == watermark
+    # The incremental pass still sees the listing as new
+    assert refresh(db, USER, BODY)["recomputed"] == 1
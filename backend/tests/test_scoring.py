@@ -0,0 +1,118 @@
+import random
+
+import numpy as np
+import pytest
+
+from scoring import DEMAND_SCORE, estimate_sell_price, score_batch
+
+# The per-pair formulas refresh used before score_batch, kept verbatim as the reference
+
+def clamp(x, lo, hi):
+    return max(lo, min(hi, x))
+
+def breakeven(invested, fee_sell_percent, fee_sell_fixed, ship_sell, packaging, tax_rate, tax_enabled, risk_buffer):
+    pct = fee_sell_percent + (tax_rate if tax_enabled else 0.0) + risk_buffer
+    denom = 1.0 - pct
+    if denom <= 0.05:
+        return 999999.0
+    return (invested + fee_sell_fixed + ship_sell + packaging) / denom
+
+def scalar_score(p_buy, ship_buy, fb, window, median, p25, fs, est_days, packaging, tax_rate, tax_enabled, risk_buffer):
+    fee_buy = p_buy * float(fb["fee_percent"]) + float(fb["fee_fixed"])
+    invested = p_buy + fee_buy + ship_buy
+
+    if window >= 5:
+        p_sell = float(median)
+    elif window > 0:
+        p_sell = float(p25)
+    else:
+        p_sell = p_buy * 1.35
+
+    fee_sell = p_sell * float(fs["fee_percent"]) + float(fs["fee_fixed"])
+    ship_sell = 0.0
+    tax = p_sell * tax_rate if tax_enabled else 0.0
+    risk = p_sell * risk_buffer
+
+    net_margin = (p_sell - fee_sell - ship_sell - packaging - tax - risk) - invested
+    roi = (net_margin / invested) if invested > 0 else 0.0
+    be = breakeven(invested, float(fs["fee_percent"]), float(fs["fee_fixed"]), ship_sell, packaging, tax_rate, tax_enabled, risk_buffer)
+
+    score_nm = clamp(net_margin/100.0, 0.0, 1.0) * 30.0
+    score_roi = clamp(roi/0.40, 0.0, 1.0) * 20.0
+    profit_score = score_nm + score_roi
+    liquidity_score = clamp(1.0 - (est_days/60.0), 0.0, 1.0) * 25.0
+    demand_score = 12.5
+    total_score = profit_score + liquidity_score + demand_score
+    return {
+        "est_sell_price": p_sell, "invested": invested, "net_margin": net_margin, "roi": roi,
+        "breakeven_sell_price": be, "liquidity_score": liquidity_score, "demand_score": demand_score,
+        "total_score": total_score,
+    }
+
+def random_rows(rng: random.Random, n: int):
+    rows = []
+    for _ in range(n):
+        window = rng.choice([0, 0, 1, 3, 4, 5, 6, 50])
+        median = round(rng.uniform(1, 900), 2) if window else None
+        rows.append({
+            # Zero prices and free fees leave nothing invested, the roi = 0 branch
+            "p_buy": rng.choice([0.0, round(rng.uniform(0.5, 800), 2)]),
+            "ship_buy": rng.choice([0.0, round(rng.uniform(0, 15), 2)]),
+            "fb": {"fee_percent": rng.choice([0.0, 0.05, rng.uniform(0, 0.2)]), "fee_fixed": rng.choice([0.0, 0.35])},
+            "fs": {"fee_percent": rng.choice([0.0, 0.125, rng.uniform(0, 0.9)]), "fee_fixed": rng.choice([0.0, 0.35, 1.0])},
+            "window": window,
+            "median": median,
+            "p25": round(median * rng.uniform(0.6, 1.0), 2) if median is not None else None,
+            "est_days": rng.choice([1, 7, 14, 30, 60, 90]),
+        })
+    return rows
+
+def vector_scores(rows, packaging, tax_rate, tax_enabled, risk_buffer):
+    col = lambda name, f=lambda r: r: np.array([f(r[name]) for r in rows], dtype=np.float64)
+    p_buy = col("p_buy")
+    p_sell = estimate_sell_price(p_buy, col("window"),
+                                 col("median", lambda v: np.nan if v is None else v),
+                                 col("p25", lambda v: np.nan if v is None else v))
+    scores = score_batch(p_buy, col("ship_buy"), col("fb", lambda f: f["fee_percent"]), col("fb", lambda f: f["fee_fixed"]),
+                         p_sell, col("fs", lambda f: f["fee_percent"]), col("fs", lambda f: f["fee_fixed"]),
+                         np.array([r["est_days"] for r in rows], dtype=np.int64),
+                         packaging, tax_rate, tax_enabled, risk_buffer)
+    scores["est_sell_price"] = p_sell
+    return scores
+
+SETTINGS = [
+    # packaging, tax_rate, tax_enabled, risk_buffer
+    (2.0, 0.0, False, 0.05),
+    (0.0, 0.21, True, 0.0),
+    (1.5, 0.21, False, 0.10),
+    # Sell-side percentages past 95% make the breakeven unreachable
+    (3.0, 0.5, True, 0.5),
+    (0.0, 0.0, False, 0.96),
+]
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("packaging,tax_rate,tax_enabled,risk_buffer", SETTINGS)
+def test_score_batch_matches_scalar_formulas(seed, packaging, tax_rate, tax_enabled, risk_buffer):
+    rows = random_rows(random.Random(seed), 300)
+    scores = vector_scores(rows, packaging, tax_rate, tax_enabled, risk_buffer)
+    for i, row in enumerate(rows):
+        expected = scalar_score(row["p_buy"], row["ship_buy"], row["fb"], row["window"], row["median"], row["p25"],
+                                row["fs"], row["est_days"], packaging, tax_rate, tax_enabled, risk_buffer)
+        for name, value in expected.items():
+            # Bit for bit, not approximately: stored rows must not change
+            assert float(scores[name][i]) == value, (name, row)
+
+def test_zero_sales_use_markup_and_neutral_demand():
+    rows = [{"p_buy": 100.0, "ship_buy": 0.0, "fb": {"fee_percent": 0.0, "fee_fixed": 0.0},
+             "fs": {"fee_percent": 0.0, "fee_fixed": 0.0}, "window": 0, "median": None, "p25": None, "est_days": 14}]
+    scores = vector_scores(rows, 0.0, 0.0, False, 0.0)
+    assert scores["est_sell_price"][0] == 100.0 * 1.35
+    assert scores["demand_score"][0] == DEMAND_SCORE
+    assert scores["roi"][0] == pytest.approx(0.35)
+
+def test_nothing_invested_has_zero_roi():
+    rows = [{"p_buy": 0.0, "ship_buy": 0.0, "fb": {"fee_percent": 0.05, "fee_fixed": 0.0},
+             "fs": {"fee_percent": 0.1, "fee_fixed": 0.0}, "window": 6, "median": 50.0, "p25": 40.0, "est_days": 7}]
+    scores = vector_scores(rows, 0.0, 0.0, False, 0.0)
+    assert scores["invested"][0] == 0.0
+    assert scores["roi"][0] == 0.0
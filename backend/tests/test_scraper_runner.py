@@ -0,0 +1,187 @@
+import asyncio
+import types
+
+import pytest
+
+import scraper_runner
+from scraper_runner import (BreakerOpenError, CircuitBreaker, PlatformRunner, RateLimitedError, TokenBucket,
+                            STATUS_BREAKER_OPEN, STATUS_CACHED, STATUS_ERROR, STATUS_OK, STATUS_RATE_LIMITED,
+                            STATUS_STALE, STATUS_TIMED_OUT)
+from products import Product
+from search_cache import SearchCache
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(scraper_runner, "time", types.SimpleNamespace(monotonic=clock))
+    monkeypatch.setattr(scraper_runner, "RETRY_BACKOFF_SECONDS", 0.0)
+    return clock
+
+@pytest.fixture
+def platform_state(monkeypatch):
+    cache = SearchCache()
+    monkeypatch.setattr(scraper_runner, "search_cache", cache)
+    monkeypatch.setattr(scraper_runner, "runners", {})
+    return cache
+
+def test_token_bucket_burst_and_refill(clock):
+    async def run():
+        bucket = TokenBucket(rate=0.5, burst=2)
+        await bucket.acquire(0)
+        await bucket.acquire(0)
+        with pytest.raises(RateLimitedError):
+            await bucket.acquire(0)
+        clock.now += 2
+        await bucket.acquire(0)
+        # A long idle period refills up to the burst, no further
+        clock.now += 3600
+        await bucket.acquire(0)
+        await bucket.acquire(0)
+        with pytest.raises(RateLimitedError):
+            await bucket.acquire(0)
+    asyncio.run(run())
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    clock.now += 30
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    # One trial at a time; a failed trial opens the circuit again
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.failures == 0
+
+def test_guard_counts_errors_and_deadline_cancellations(clock):
+    async def run():
+        runner = PlatformRunner('wallapop', rate=100, burst=100)
+        runner.breaker.failure_threshold = 10
+        with pytest.raises(ValueError):
+            async with runner.guard(1):
+                raise ValueError()
+        assert runner.breaker.failures == 1
+
+        # Cancelled early (the client went away): not the scraper's fault
+        with pytest.raises(asyncio.CancelledError):
+            async with runner.guard(1, clock.now + 5):
+                raise asyncio.CancelledError()
+        assert runner.breaker.failures == 1
+
+        # Cancelled once the search deadline has passed: a timeout like any other
+        deadline = clock.now + 5
+        with pytest.raises(asyncio.CancelledError):
+            async with runner.guard(1, deadline):
+                clock.now = deadline
+                raise asyncio.CancelledError()
+        assert runner.breaker.failures == 2
+
+        async with runner.guard(1):
+            pass
+        assert runner.breaker.failures == 0
+    asyncio.run(run())
+
+def test_cancelled_trial_frees_half_open_slot(clock):
+    async def run():
+        runner = PlatformRunner('wallapop', rate=100, burst=100)
+        runner.breaker.opened_at = clock.now - runner.breaker.reset_timeout
+        with pytest.raises(asyncio.CancelledError):
+            async with runner.guard(1, clock.now + 5):
+                raise asyncio.CancelledError()
+        assert runner.breaker.allow()
+    asyncio.run(run())
+
+def test_run_retries_then_gives_up(clock, monkeypatch):
+    monkeypatch.setattr(scraper_runner, "SCRAPER_RETRIES", 1)
+    async def run():
+        runner = PlatformRunner('wallapop', rate=100, burst=100)
+        calls = []
+        async def flaky(keywords, max_results):
+            calls.append(keywords)
+            if len(calls) == 1:
+                raise RuntimeError('captcha')
+            return [{'title': 'ok'}]
+        assert await runner.run(flaky, ['switch'], 20, clock.now + 10) == [{'title': 'ok'}]
+        assert len(calls) == 2 and runner.breaker.failures == 0
+
+        async def broken(keywords, max_results):
+            calls.append(keywords)
+            raise RuntimeError('blocked')
+        with pytest.raises(RuntimeError):
+            await runner.run(broken, ['switch'], 20, clock.now + 10)
+        assert len(calls) == 4 and runner.breaker.failures == 2
+    asyncio.run(run())
+
+def test_run_times_out_at_deadline(clock):
+    async def run():
+        runner = PlatformRunner('wallapop', rate=100, burst=100)
+        async def slow(keywords, max_results):
+            await asyncio.sleep(5)
+        with pytest.raises(asyncio.TimeoutError):
+            await runner.run(slow, ['switch'], 20, clock.now + 0.01)
+        return runner.breaker.failures
+    assert asyncio.run(run()) == 1
+
+def product(title: str) -> Product:
+    return Product(title=title, price=10.0, url='', platform='wallapop')
+
+async def search(keywords, max_results):
+    return [product('fresh')]
+
+def test_run_platform_statuses(clock, platform_state):
+    async def run():
+        runner = scraper_runner.get_runner('wallapop')
+        result = await scraper_runner.run_platform('wallapop', search, ['switch'], 20, clock.now + 10)
+        assert result['status'] == STATUS_OK
+
+        await platform_state.put('wallapop', platform_state.key('wallapop', ['switch'], 20), [product('cached')])
+        result = await scraper_runner.run_platform('wallapop', search, ['switch'], 20, clock.now + 10)
+        assert (result['status'], result['products']) == (STATUS_CACHED, [product('cached')])
+
+        async def broken(keywords, max_results):
+            raise RuntimeError('blocked')
+        result = await scraper_runner.run_platform('wallapop', broken, ['other'], 20, clock.now + 10)
+        assert result['status'] == STATUS_ERROR
+
+        runner.bucket.tokens = 0
+        runner.bucket.rate = 0.001
+        result = await scraper_runner.run_platform('wallapop', search, ['other'], 20, clock.now + 10)
+        assert result['status'] == STATUS_RATE_LIMITED
+
+        runner.breaker.opened_at = clock.now
+        result = await scraper_runner.run_platform('wallapop', search, ['other'], 20, clock.now + 10)
+        assert result['status'] == STATUS_BREAKER_OPEN
+
+        async def slow(keywords, max_results):
+            await asyncio.sleep(5)
+        result = await scraper_runner.run_platform('ebay', slow, ['other'], 20, clock.now + 0.01)
+        assert result['status'] == STATUS_TIMED_OUT
+    asyncio.run(run())
+
+def test_stale_hit_skips_rate_limit(clock, platform_state):
+    async def run():
+        key = platform_state.key('wallapop', ['switch'], 20)
+        await platform_state.put('wallapop', key, [product('old')])
+        platform_state._entries[key].fresh_until = 0
+        runner = scraper_runner.get_runner('wallapop')
+        runner.bucket.tokens = 0
+        runner.bucket.rate = 0.001
+        result = await scraper_runner.run_platform('wallapop', search, ['switch'], 20, clock.now + 10)
+        assert (result['status'], result['products']) == (STATUS_STALE, [product('old')])
+        assert runner.bucket.tokens == 0
+    asyncio.run(run())
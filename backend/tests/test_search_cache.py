@@ -0,0 +1,145 @@
+import asyncio
+import types
+
+import pytest
+
+import search_cache as search_cache_module
+from products import Product
+from search_cache import EMPTY_TTL, SearchCache, SQLiteCacheBackend
+
+TTL = search_cache_module.PLATFORM_TTLS['wallapop']
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(search_cache_module, "time", types.SimpleNamespace(time=clock))
+    monkeypatch.delenv("SEARCH_CACHE_TTL_WALLAPOP", raising=False)
+    return clock
+
+class Scraper:
+    def __init__(self):
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        if self.release is not None:
+            await self.release.wait()
+        return [Product(title=f'call {self.calls}', price=10.0, url='', platform='wallapop')]
+
+def test_key_normalises_keywords():
+    assert SearchCache.key('ebay', ['  iPhone', 'ＰＲＯ  12 '], 20) == SearchCache.key('ebay', ['iphone pro', '12'], 20)
+    assert SearchCache.key('ebay', ['iphone'], 20) != SearchCache.key('ebay', ['iphone'], 40)
+
+def test_fresh_stale_and_expired(clock):
+    async def run():
+        cache, scraper = SearchCache(), Scraper()
+        fetch = lambda: cache.get_or_fetch('wallapop', ['switch'], 20, scraper)
+        assert (await fetch())[0].title == 'call 1'
+        clock.now += TTL - 1
+        assert (await fetch())[0].title == 'call 1'
+        assert await cache.peek('wallapop', ['switch'], 20) is not None
+
+        # Past the TTL the old value is served at once and refreshed in the background
+        clock.now += 2
+        assert await cache.peek('wallapop', ['switch'], 20) is None
+        assert (await fetch())[0].title == 'call 1'
+        await asyncio.sleep(0)
+        assert scraper.calls == 2
+        assert (await fetch())[0].title == 'call 2'
+
+        # Past the stale window the caller waits for a new scrape
+        clock.now += TTL * 3
+        assert (await fetch())[0].title == 'call 3'
+        return cache.counters
+    counters = asyncio.run(run())
+    assert (counters['hits'], counters['stale_hits'], counters['misses'], counters['revalidations']) == (3, 1, 2, 1)
+
+def test_empty_results_expire_sooner(clock):
+    async def run():
+        cache = SearchCache()
+        key = cache.key('wallapop', ['nada'], 20)
+        await cache.put('wallapop', key, [])
+        clock.now += EMPTY_TTL - 1
+        assert await cache.peek('wallapop', ['nada'], 20) == []
+        clock.now += 2
+        assert await cache.peek('wallapop', ['nada'], 20) is None
+    asyncio.run(run())
+
+def test_concurrent_misses_share_one_scrape(clock):
+    async def run():
+        cache, scraper = SearchCache(), Scraper()
+        scraper.release = asyncio.Event()
+        waiters = [asyncio.create_task(cache.get_or_fetch('wallapop', ['switch'], 20, scraper)) for _ in range(5)]
+        await asyncio.sleep(0)
+        scraper.release.set()
+        results = await asyncio.gather(*waiters)
+        return cache, scraper, results
+    cache, scraper, results = asyncio.run(run())
+    assert scraper.calls == 1
+    assert all(result == results[0] for result in results)
+    assert cache.counters['coalesced'] == 4
+    assert cache.stats()['inflight'] == 0
+
+def test_failed_scrape_is_not_cached(clock):
+    async def run():
+        cache = SearchCache()
+        async def broken():
+            raise RuntimeError('blocked')
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await cache.get_or_fetch('wallapop', ['switch'], 20, broken)
+        return cache.counters
+    counters = asyncio.run(run())
+    assert (counters['misses'], counters['errors']) == (2, 2)
+
+def test_evicts_least_recently_used_over_budget(clock):
+    async def run():
+        value = [Product(title='x' * 100, price=1.0, url='', platform='wallapop')]
+        cache = SearchCache()
+        await cache.put('wallapop', cache.key('wallapop', ['a'], 20), value)
+        # Room for two entries, not three
+        cache.max_bytes = cache.stats()['bytes'] * 5 // 2
+        await cache.put('wallapop', cache.key('wallapop', ['b'], 20), value)
+        await cache.peek('wallapop', ['a'], 20)
+        await cache.put('wallapop', cache.key('wallapop', ['c'], 20), value)
+        return [await cache.peek('wallapop', [k], 20) is not None for k in 'abc'], cache.counters['evictions']
+    present, evictions = asyncio.run(run())
+    assert present == [True, False, True]
+    assert evictions == 1
+
+def test_sqlite_backend_survives_restart(clock, tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    async def run():
+        cache, scraper = SearchCache(backend=SQLiteCacheBackend(path)), Scraper()
+        await cache.get_or_fetch('wallapop', ['switch'], 20, scraper)
+        cache.backend.close()
+        restarted = SearchCache(backend=SQLiteCacheBackend(path))
+        value = await restarted.get_or_fetch('wallapop', ['switch'], 20, scraper)
+        restarted.backend.close()
+        return value, restarted.counters['disk_hits'], scraper.calls
+    value, disk_hits, calls = asyncio.run(run())
+    assert value[0].title == 'call 1'
+    assert (disk_hits, calls) == (1, 1)
+
+def test_cached_decorator_keeps_uncached(clock):
+    cache, calls = SearchCache(), []
+
+    @cache.cached('wallapop')
+    async def search(keywords, max_results=20):
+        calls.append(keywords)
+        return [Product(title=keywords[0], price=1.0, url='', platform='wallapop')]
+
+    async def run():
+        await search(['switch'])
+        await search(['Switch '])
+        await search.uncached(['switch'], 20)
+    asyncio.run(run())
+    assert calls == [['switch'], ['switch']]
@@ -1,66 +1,91 @@
-﻿import asyncio
-import re
-from typing import List, Dict
-from playwright.async_api import async_playwright
+﻿from typing import AsyncIterator, List
+
+from browser_pool import browser_pool
+from page_loader import load_results, scroll_for_more, MAX_PAGES
+from extraction import extract_cards, build_products, take_new
+from http_fetch import HttpFallback, base_url, fetch_mode, http_fetcher
+from logger import get_logger
+from products import Product
+from search_cache import search_cache
+
+logger = get_logger(__name__)
 
 class VintedScraper:
     def __init__(self):
-        self.base_url = "https://www.vinted.es"
+        self.base_url = base_url('vinted', "https://www.vinted.es")
+        self.result_selectors = ['[data-testid="feed-grid"] > div', '.feed-grid__item', 'article[class*="item"]']
+        self.card_fields = {
+            'title': ('[data-testid="item-title"], h3, div[class*="title"]', 'text'),
+            'price': ('[data-testid="item-price"], div[class*="price"]', 'text'),
+            'url': ('a', 'href'),
+            'image_url': ('img', 'src|data-src'),
+            'location': None
+        }
+        self.last_load = None
     
-    async def search_items(self, keywords: List[str], max_results: int = 20) -> List[Dict]:
+    async def iter_items(self, keywords: List[str], max_results: int = 20) -> AsyncIterator[List[Product]]:
         search_query = " ".join(keywords)
         search_url = f"{self.base_url}/catalog?search_text={search_query.replace(' ', '+')}"
         
-        print(f"🔍 Buscando en Vinted: {search_query}")
+        logger.info(f"🔍 Buscando en Vinted: {search_query}")
         
-        try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True, args=['--no-sandbox', '--disable-setuid-sandbox'])
-                page = await browser.new_page()
-                await page.goto(search_url, wait_until='domcontentloaded', timeout=30000)
-                await asyncio.sleep(3)
-                
-                products = []
-                selectors = ['[data-testid="feed-grid"] > div', '.feed-grid__item', 'article[class*="item"]']
-                
-                items = []
-                for selector in selectors:
-                    items = await page.query_selector_all(selector)
-                    if len(items) > 0:
+        seen = set()
+        found = 0
+        mode = fetch_mode('vinted')
+        if mode != 'browser':
+            try:
+                async for rows in http_fetcher.results('vinted', [search_url], self.result_selectors, self.card_fields):
+                    products = take_new(build_products(rows, 'vinted', self.base_url, 'España'), seen, max_results - found)
+                    if not products:
                         break
-                
-                for item in items[:max_results]:
-                    try:
-                        title_elem = await item.query_selector('[data-testid="item-title"], h3, div[class*="title"]')
-                        title = await title_elem.inner_text() if title_elem else ""
-                        
-                        price_elem = await item.query_selector('[data-testid="item-price"], div[class*="price"]')
-                        price_text = await price_elem.inner_text() if price_elem else "0"
-                        price = float(re.sub(r'[^\d,.]', '', price_text).replace(',', '.'))
-                        
-                        link_elem = await item.query_selector('a')
-                        href = await link_elem.get_attribute('href') if link_elem else ""
-                        url = f"{self.base_url}{href}" if href and not href.startswith('http') else href
-                        
-                        if title and price > 0:
-                            products.append({
-                                'title': title.strip(),
-                                'price': price,
-                                'url': url,
-                                'platform': 'vinted',
-                                'image_url': '',
-                                'location': 'España'
-                            })
-                    except:
-                        continue
-                
-                await browser.close()
-                print(f"✅ Encontrados {len(products)} productos en Vinted")
-                return products
+                    found += len(products)
+                    yield products
+                    if found >= max_results:
+                        break
+                # The HTML only carries the first page (the rest loads on scroll); in auto mode the browser fills the gap
+                if found >= max_results or mode == 'http':
+                    return
+                logger.info(f"↩️ Vinted: {found} de {max_results} productos por HTTP, completando con navegador")
+            except HttpFallback as e:
+                logger.info(f"↩️ Vinted sin resultados por HTTP ({str(e)}), usando navegador")
+        
+        async with browser_pool.page('vinted') as page:
+            load = await load_results(page, search_url, self.result_selectors, platform='vinted')
+            self.last_load = load
+            logger.debug(f"⏱️ Vinted listo en {load.wait_ms:.0f} ms (navegación {load.navigation_ms:.0f} ms)")
+            if not load.ready:
+                return
+            
+            offset = 0
+            for _ in range(MAX_PAGES):
+                rows = await extract_cards(page, load.selector, self.card_fields, offset=offset, platform='vinted')
+                offset += len(rows)
+                products = take_new(build_products(rows, 'vinted', self.base_url, 'España'), seen, max_results - found)
+                if products:
+                    found += len(products)
+                    yield products
+                if found >= max_results or not await scroll_for_more(page, load.selector, offset):
+                    break
+    
+    async def search_items(self, keywords: List[str], max_results: int = 20) -> List[Product]:
+        products = []
+        try:
+            async for batch in self.iter_items(keywords, max_results):
+                products.extend(batch)
         except Exception as e:
-            print(f"❌ Error scraping Vinted: {str(e)}")
-            return []
+            logger.error(f"❌ Error scraping Vinted: {str(e)}")
+            if not products:
+                raise
+            return products
+        
+        logger.info(f"✅ Encontrados {len(products)} productos en Vinted")
+        return products
 
-async def search_vinted(keywords: List[str], max_results: int = 20) -> List[Dict]:
+@search_cache.cached('vinted')
+async def search_vinted(keywords: List[str], max_results: int = 20) -> List[Product]:
     scraper = VintedScraper()
     return await scraper.search_items(keywords, max_results)
+
+def stream_vinted(keywords: List[str], max_results: int = 20) -> AsyncIterator[List[Product]]:
+    scraper = VintedScraper()
+    return scraper.iter_items(keywords, max_results)
@@ -1,60 +1,91 @@
-﻿import asyncio
-import re
-from typing import List, Dict
-from playwright.async_api import async_playwright
+﻿from typing import AsyncIterator, List
+
+from browser_pool import browser_pool
+from page_loader import load_results, scroll_for_more, MAX_PAGES
+from extraction import extract_cards, build_products, take_new
+from http_fetch import HttpFallback, base_url, fetch_mode, http_fetcher
+from logger import get_logger
+from products import Product
+from search_cache import search_cache
+
+logger = get_logger(__name__)
 
 class WallapopScraper:
     def __init__(self):
-        self.base_url = "https://es.wallapop.com"
+        self.base_url = base_url('wallapop', "https://es.wallapop.com")
+        self.result_selectors = ['[data-testid="product-card"]']
+        self.card_fields = {
+            'title': ('p[class*="title"]', 'text'),
+            'price': ('span[class*="price"]', 'text'),
+            'url': ('a', 'href'),
+            'image_url': ('img', 'src|data-src'),
+            'location': None
+        }
+        self.last_load = None
     
-    async def search_items(self, keywords: List[str], max_results: int = 20) -> List[Dict]:
+    async def iter_items(self, keywords: List[str], max_results: int = 20) -> AsyncIterator[List[Product]]:
         search_query = " ".join(keywords)
         search_url = f"{self.base_url}/app/search?keywords={search_query.replace(' ', '%20')}"
         
-        print(f"🔍 Buscando en Wallapop: {search_query}")
+        logger.info(f"🔍 Buscando en Wallapop: {search_query}")
         
+        seen = set()
+        found = 0
+        mode = fetch_mode('wallapop')
+        if mode != 'browser':
+            try:
+                async for rows in http_fetcher.results('wallapop', [search_url], self.result_selectors, self.card_fields):
+                    products = take_new(build_products(rows, 'wallapop', self.base_url, 'España'), seen, max_results - found)
+                    if not products:
+                        break
+                    found += len(products)
+                    yield products
+                    if found >= max_results:
+                        break
+                # The HTML only carries the first page (the rest loads on scroll); in auto mode the browser fills the gap
+                if found >= max_results or mode == 'http':
+                    return
+                logger.info(f"↩️ Wallapop: {found} de {max_results} productos por HTTP, completando con navegador")
+            except HttpFallback as e:
+                logger.info(f"↩️ Wallapop sin resultados por HTTP ({str(e)}), usando navegador")
+        
+        async with browser_pool.page('wallapop') as page:
+            load = await load_results(page, search_url, self.result_selectors, platform='wallapop')
+            self.last_load = load
+            logger.debug(f"⏱️ Wallapop listo en {load.wait_ms:.0f} ms (navegación {load.navigation_ms:.0f} ms)")
+            if not load.ready:
+                return
+            
+            offset = 0
+            for _ in range(MAX_PAGES):
+                rows = await extract_cards(page, load.selector, self.card_fields, offset=offset, platform='wallapop')
+                offset += len(rows)
+                products = take_new(build_products(rows, 'wallapop', self.base_url, 'España'), seen, max_results - found)
+                if products:
+                    found += len(products)
+                    yield products
+                if found >= max_results or not await scroll_for_more(page, load.selector, offset):
+                    break
+    
+    async def search_items(self, keywords: List[str], max_results: int = 20) -> List[Product]:
+        products = []
         try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True, args=['--no-sandbox'])
-                page = await browser.new_page()
-                await page.goto(search_url, wait_until='domcontentloaded', timeout=30000)
-                await asyncio.sleep(3)
-                
-                products = []
-                items = await page.query_selector_all('[data-testid="product-card"]')
-                
-                for item in items[:max_results]:
-                    try:
-                        title_elem = await item.query_selector('p[class*="title"]')
-                        title = await title_elem.inner_text() if title_elem else ""
-                        
-                        price_elem = await item.query_selector('span[class*="price"]')
-                        price_text = await price_elem.inner_text() if price_elem else "0"
-                        price = float(re.sub(r'[^\d,.]', '', price_text).replace(',', '.'))
-                        
-                        link_elem = await item.query_selector('a')
-                        url = await link_elem.get_attribute('href') if link_elem else ""
-                        url = f"{self.base_url}{url}" if url and not url.startswith('http') else url
-                        
-                        if title and price > 0:
-                            products.append({
-                                'title': title.strip(),
-                                'price': price,
-                                'url': url,
-                                'platform': 'wallapop',
-                                'image_url': '',
-                                'location': 'España'
-                            })
-                    except:
-                        continue
-                
-                await browser.close()
-                print(f"✅ Encontrados {len(products)} productos en Wallapop")
-                return products
+            async for batch in self.iter_items(keywords, max_results):
+                products.extend(batch)
         except Exception as e:
-            print(f"❌ Error scraping Wallapop: {str(e)}")
-            return []
+            logger.error(f"❌ Error scraping Wallapop: {str(e)}")
+            if not products:
+                raise
+            return products
+        
+        logger.info(f"✅ Encontrados {len(products)} productos en Wallapop")
+        return products
 
-async def search_wallapop(keywords: List[str], max_results: int = 20) -> List[Dict]:
+@search_cache.cached('wallapop')
+async def search_wallapop(keywords: List[str], max_results: int = 20) -> List[Product]:
     scraper = WallapopScraper()
     return await scraper.search_items(keywords, max_results)
+
+def stream_wallapop(keywords: List[str], max_results: int = 20) -> AsyncIterator[List[Product]]:
+    scraper = WallapopScraper()
+    return scraper.iter_items(keywords, max_results)
@@ -0,0 +1,223 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+from supabase import Client
+
+import opportunities
+from ingest import insert_sales, listing_row, sale_row, upsert_listings
+from logger import get_logger
+from models import ListingIn, ObservedSaleIn, RefreshIn
+from opportunities import PRODUCT_MATCH_THRESHOLD
+from product_index import product_index_cache
+from products import Product
+from scraper_runner import run_platform, STATUS_OK, STATUS_CACHED, STATUS_STALE
+from supabase_client import get_supabase, run_sync, select_all, select_in
+
+SCHEDULER_ENABLED = os.getenv("WATCHLIST_SCHEDULER_ENABLED", "0") == "1"
+TICK_SECONDS = float(os.getenv("WATCHLIST_TICK_SECONDS", "30"))
+MAX_CONCURRENT = int(os.getenv("WATCHLIST_MAX_CONCURRENT", "2"))
+PLATFORM_BUDGET = int(os.getenv("WATCHLIST_PLATFORM_BUDGET", "4"))
+RUN_DEADLINE_SECONDS = float(os.getenv("WATCHLIST_DEADLINE_SECONDS", "60"))
+DEFAULT_INTERVAL_MINUTES = 60
+NEVER_RUN_STALENESS = 10.0
+
+logger = get_logger(__name__)
+
+# Marketplaces whose scraper returns completed sales rather than live listings
+SOLD_PLATFORMS = {'ebay', 'catawiki'}
+
+def _parse_ts(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+def staleness(watchlist: dict, now: float) -> float:
+    last_run = _parse_ts(watchlist.get("last_run_at"))
+    if last_run is None:
+        return NEVER_RUN_STALENESS
+    interval = max(1, watchlist.get("interval_minutes") or DEFAULT_INTERVAL_MINUTES) * 60
+    return (now - last_run) / interval
+
+def hit_rate(watchlist: dict) -> float:
+    return ((watchlist.get("hits") or 0) + 1) / ((watchlist.get("runs") or 0) + 2)
+
+def priority(watchlist: dict, now: float) -> float:
+    return staleness(watchlist, now) * (0.5 + hit_rate(watchlist))
+
+def watchlist_platforms(watchlist: dict) -> List[str]:
+    return list(dict.fromkeys([*(watchlist.get("platforms_buy") or []), *(watchlist.get("platforms_sell") or [])]))
+
+def plan(watchlists: List[dict], now: float, platforms: List[str], budget: int = PLATFORM_BUDGET) -> List[dict]:
+    # Most valuable due watchlists first, without exceeding each platform's share of this tick
+    remaining = dict.fromkeys(platforms, budget)
+    due = sorted((w for w in watchlists if staleness(w, now) >= 1), key=lambda w: (-priority(w, now), str(w["id"])))
+    selected = []
+    for watchlist in due:
+        wanted = [p for p in watchlist_platforms(watchlist) if p in remaining]
+        if not wanted or any(remaining[p] <= 0 for p in wanted):
+            continue
+        for p in wanted:
+            remaining[p] -= 1
+        selected.append(watchlist)
+    return selected
+
+def persist_results(sb: Client, watchlist: dict, scraped: Dict[str, List[Product]]) -> dict:
+    user_id = watchlist["user_id"]
+    platforms_buy = watchlist.get("platforms_buy") or []
+    platforms_sell = watchlist.get("platforms_sell") or []
+
+    listing_rows = [
+        listing_row(user_id, ListingIn(platform=product.platform, url=product.url, title=product.title,
+                                       price=product.price, location=product.location or None,
+                                       images=[product.image_url] if product.image_url else []))
+        for platform in platforms_buy for product in scraped.get(platform, []) if product.url
+    ]
+    listing_ids = [row["id"] for row in upsert_listings(sb, listing_rows, returning=True)]
+
+    # Only cards that show when they sold become sales; a scrape date would pile old sales onto today
+    sold = [product for platform in platforms_sell if platform in SOLD_PLATFORMS
+            for product in scraped.get(platform, []) if product.url and product.sold_at]
+    inserted = []
+    if sold:
+        index = product_index_cache.get(sb, user_id)
+        keyword = " ".join(watchlist.get("keywords") or [])
+        sale_rows = []
+        with index.lock:
+            matches = [index.best(product.title, PRODUCT_MATCH_THRESHOLD) for product in sold]
+        for product, best in zip(sold, matches):
+            sale_rows.append(sale_row(user_id, ObservedSaleIn(
+                platform=product.platform, product_id=best[0] if best else None, keyword=keyword,
+                sold_price=product.price, sold_at=product.sold_at, url=product.url)))
+        inserted, _ = insert_sales(sb, user_id, sale_rows)
+
+    # Listings already matched to a product with new sales need their estimate recomputed too
+    affected = set(listing_ids)
+    sold_products = sorted({sale["product_id"] for sale in inserted if sale.get("product_id")})
+    if sold_products:
+        affected.update(m["listing_id"] for m in select_in(
+            lambda: sb.table("listing_product_match").select("listing_id").eq("user_id", user_id).order("listing_id"),
+            "product_id", sold_products))
+
+    updated = 0
+    if affected and platforms_buy and platforms_sell:
+        body = RefreshIn().model_dump()
+        body.update({
+            "platforms_buy": platforms_buy, "platforms_sell": platforms_sell,
+            "listing_ids": sorted(affected), "limit": len(affected)
+        })
+        for name in ("min_roi", "min_net_margin"):
+            if watchlist.get(name) is not None:
+                body[name] = watchlist[name]
+        updated = opportunities.refresh(sb, user_id, body)["updated"]
+
+    return {"listings": len(listing_ids), "sales": len(inserted), "refreshed": len(affected), "opportunities": updated}
+
+class WatchlistScheduler:
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT, tick_seconds: float = TICK_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.tick_seconds = tick_seconds
+        self.searches: Dict[str, Callable[[List[str], int], Awaitable[List[Product]]]] = {}
+        self.sb: Optional[Client] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+        self._running: set = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.counters = {'ticks': 0, 'runs': 0, 'failures': 0, 'listings': 0, 'sales': 0, 'opportunities': 0}
+        self.last_tick: Optional[float] = None
+
+    @property
+    def started(self) -> bool:
+        return self._loop_task is not None
+
+    def start(self, searches: Dict[str, Callable[[List[str], int], Awaitable[List[Product]]]], sb: Optional[Client] = None):
+        if self.started:
+            return
+        self.searches = searches
+        self.sb = sb or get_supabase()
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._loop_task = asyncio.create_task(self._loop())
+        logger.info(f"🗓️ Planificador de watchlists iniciado (cada {self.tick_seconds:.0f}s)")
+
+    async def stop(self):
+        tasks = [t for t in [self._loop_task, *self._tasks] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop_task = None
+        self._tasks.clear()
+        self._running.clear()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"❌ Error en el planificador de watchlists: {str(e)}")
+            await asyncio.sleep(self.tick_seconds)
+
+    async def tick(self) -> List[dict]:
+        self.counters['ticks'] += 1
+        self.last_tick = time.time()
+        watchlists = await run_sync(
+            select_all, lambda: self.sb.table("watchlists").select("*").eq("is_active", True).order("id"))
+        idle = [w for w in watchlists if w["id"] not in self._running]
+        batch = plan(idle, time.time(), list(self.searches))
+        for watchlist in batch:
+            self._running.add(watchlist["id"])
+            task = asyncio.create_task(self._run_guarded(watchlist))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return batch
+
+    async def _run_guarded(self, watchlist: dict):
+        try:
+            async with self._semaphore:
+                await self.run_watchlist(watchlist)
+        except Exception as e:
+            self.counters['failures'] += 1
+            logger.error(f"❌ Error en watchlist {watchlist['id']}: {str(e)}")
+        finally:
+            self._running.discard(watchlist["id"])
+
+    async def run_watchlist(self, watchlist: dict) -> dict:
+        keywords = watchlist.get("keywords") or []
+        max_results = watchlist.get("max_results") or 20
+        searches = {p: self.searches[p] for p in watchlist_platforms(watchlist) if p in self.searches}
+        deadline = time.monotonic() + RUN_DEADLINE_SECONDS
+
+        results = await asyncio.gather(*[
+            run_platform(platform, search, keywords, max_results, deadline)
+            for platform, search in searches.items()
+        ])
+        results = dict(zip(searches, results))
+        scraped = {p: r['products'] for p, r in results.items()}
+        statuses = {p: r['status'] for p, r in results.items()}
+
+        summary = await run_sync(persist_results, self.sb, watchlist, scraped)
+        hit = summary["opportunities"] > 0
+        await run_sync(lambda: self.sb.table("watchlists").update({
+            "last_run_at": datetime.now(timezone.utc).isoformat(),
+            "runs": (watchlist.get("runs") or 0) + 1,
+            "hits": (watchlist.get("hits") or 0) + (1 if hit else 0),
+            "last_status": statuses,
+            "last_error": None if all(s in (STATUS_OK, STATUS_CACHED, STATUS_STALE) for s in statuses.values()) else "partial"
+        }).eq("id", watchlist["id"]).execute())
+
+        self.counters['runs'] += 1
+        for name in ('listings', 'sales', 'opportunities'):
+            self.counters[name] += summary[name]
+        logger.info(f"🗓️ Watchlist {watchlist['id']} ({' '.join(keywords)}): {summary['listings']} anuncios, "
+                    f"{summary['sales']} ventas, {summary['opportunities']} oportunidades")
+        return summary
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            'enabled': self.started,
+            'running': len(self._running),
+            'last_tick': self.last_tick
+        }
+
+watchlist_scheduler = WatchlistScheduler()
@@ -0,0 +1,151 @@
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+import numpy as np
+from fastapi import HTTPException
+from supabase import Client
+
+from arbitrage_engine import top_k_indices
+from opportunities import evaluate_snapshot, load_settings, load_snapshot, opportunity_row, passes_thresholds
+
+WHATIF_TTL_SECONDS = int(os.getenv("WHATIF_TTL_SECONDS", "600"))
+WHATIF_MAX_SNAPSHOTS = int(os.getenv("WHATIF_MAX_SNAPSHOTS", "64"))
+WHATIF_MAX_GRID = int(os.getenv("WHATIF_MAX_GRID", "400"))
+
+SETTING_PARAMS = ("packaging_cost", "tax_rate", "risk_buffer")
+FEE_PARAMS = ("fee_percent", "fee_fixed")
+
+def settings_version(settings: dict, fee: dict) -> str:
+    payload = json.dumps([settings, fee], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+class SnapshotCache:
+    def __init__(self, ttl: int = WHATIF_TTL_SECONDS, max_entries: int = WHATIF_MAX_SNAPSHOTS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @staticmethod
+    def key(user_id: str, body: dict, version: str) -> tuple:
+        return (user_id, tuple(body["platforms_buy"]), tuple(body["platforms_sell"]),
+                bool(body.get("include_demo", False)), int(body["limit"]), version)
+
+    def get(self, sb: Client, user_id: str, body: dict) -> Tuple[dict, dict, dict, bool]:
+        # Settings and fees are edited outside the API, so they are read every time and versioned into the key
+        settings, fee = load_settings(sb, user_id)
+        key = self.key(user_id, body, settings_version(settings, fee))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return entry[1], settings, fee, True
+            self.counters['misses'] += 1
+
+        snapshot = load_snapshot(sb, user_id, body)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return snapshot, settings, fee, False
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == user_id]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self.counters['invalidations'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, 'entries': len(self._entries)}
+
+snapshot_cache = SnapshotCache()
+
+def apply_overrides(settings: dict, fee: dict, overrides: dict) -> Tuple[dict, dict]:
+    settings = dict(settings)
+    for name in (*SETTING_PARAMS, "tax_enabled"):
+        if overrides.get(name) is not None:
+            settings[name] = overrides[name]
+    fee = {platform: dict(values) for platform, values in fee.items()}
+    for platform, values in (overrides.get("platform_fees") or {}).items():
+        current = fee.setdefault(platform, {"platform": platform, "fee_percent": 0.0, "fee_fixed": 0.0})
+        for name in FEE_PARAMS:
+            if values.get(name) is not None:
+                current[name] = values[name]
+    return settings, fee
+
+def _sweep_overrides(name: str, value: float) -> dict:
+    # Sweep axes are setting names or "<fee_percent|fee_fixed>:<platform>"
+    if name in SETTING_PARAMS:
+        return {name: value}
+    param, _, platform = name.partition(":")
+    if param in FEE_PARAMS and platform:
+        return {"platform_fees": {platform: {param: value}}}
+    raise HTTPException(status_code=400, detail=f"Parámetro de barrido no soportado: {name}")
+
+def _merge(base: dict, extra: dict) -> dict:
+    merged = dict(base)
+    for name, value in extra.items():
+        if name == "platform_fees":
+            fees = {p: dict(v) for p, v in (merged.get("platform_fees") or {}).items()}
+            for platform, values in value.items():
+                fees.setdefault(platform, {}).update(values)
+            merged["platform_fees"] = fees
+        else:
+            merged[name] = value
+    return merged
+
+def summarize(scores: dict, keep: np.ndarray) -> dict:
+    count = int(keep.sum())
+    return {
+        "opportunities": count,
+        "total_net_margin": round(float(scores["net_margin"][keep].sum()), 2),
+        "mean_roi": round(float(scores["roi"][keep].mean()), 4) if count else 0.0,
+        "best_total_score": round(float(scores["total_score"][keep].max()), 2) if count else None,
+    }
+
+def what_if(sb: Client, user_id: str, body: dict) -> dict:
+    started = time.perf_counter()
+    snapshot, base_settings, base_fee, cached = snapshot_cache.get(sb, user_id, body)
+
+    axes = list((body.get("sweep") or {}).items())
+    grid_size = int(np.prod([len(values) for _, values in axes])) if axes else 1
+    if grid_size > WHATIF_MAX_GRID:
+        raise HTTPException(status_code=400, detail=f"Máximo {WHATIF_MAX_GRID} combinaciones por barrido")
+
+    settings, fee = apply_overrides(base_settings, base_fee, body)
+    scores = evaluate_snapshot(snapshot, settings, fee)
+    keep = passes_thresholds(scores, body["min_net_margin"], body["min_roi"])
+    passing = np.flatnonzero(keep)
+    best = passing[top_k_indices(scores["total_score"][passing], body.get("top", 20))]
+
+    result = {
+        "snapshot": {"rows": len(snapshot["p_buy"]), "listings": len(snapshot["listing_ids"]), "cached": cached},
+        "summary": summarize(scores, keep),
+        "opportunities": [opportunity_row(user_id, snapshot, scores, i) for i in best.tolist()],
+    }
+
+    if axes:
+        grid = []
+        for point in itertools.product(*(values for _, values in axes)):
+            overrides = dict(body)
+            for (name, _), value in zip(axes, point):
+                overrides = _merge(overrides, _sweep_overrides(name, value))
+            point_settings, point_fee = apply_overrides(base_settings, base_fee, overrides)
+            point_scores = evaluate_snapshot(snapshot, point_settings, point_fee)
+            point_keep = passes_thresholds(point_scores, body["min_net_margin"], body["min_roi"])
+            grid.append({"params": dict(zip((name for name, _ in axes), point)), **summarize(point_scores, point_keep)})
+        result["sweep"] = grid
+
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
@@ -123,20 +123,20 @@ export default function Home() {
           <h3 style={{ marginTop: 0, marginBottom: 16 }}>📊 Productos Encontrados</h3>
           <div style={{ display: 'grid', gridTemplateColumns: 'repeat(4, 1fr)', gap: 16 }}>
             <div style={statBoxStyle}>
-              <div style={{ fontSize: 24, fontWeight: 700, color: '#13c1ac' }}>🛍️ {stats.wallapop}</div>
-              <div style={{ fontSize: 12, color: '#666' }}>Wallapop</div>
+              <div style={{ fontSize: 24, fontWeight: 700, color: '#13c1ac' }}>🛍️ {stats.wallapop?.count ?? 0}</div>
+              <div style={{ fontSize: 12, color: '#666' }}>Wallapop{stats.wallapop?.status && stats.wallapop.status !== 'ok' ? ` (${stats.wallapop.status})` : ''}</div>
             </div>
             <div style={statBoxStyle}>
-              <div style={{ fontSize: 24, fontWeight: 700, color: '#e53238' }}>🌐 {stats.ebay}</div>
-              <div style={{ fontSize: 12, color: '#666' }}>eBay</div>
+              <div style={{ fontSize: 24, fontWeight: 700, color: '#e53238' }}>🌐 {stats.ebay?.count ?? 0}</div>
+              <div style={{ fontSize: 12, color: '#666' }}>eBay{stats.ebay?.status && stats.ebay.status !== 'ok' ? ` (${stats.ebay.status})` : ''}</div>
             </div>
             <div style={statBoxStyle}>
-              <div style={{ fontSize: 24, fontWeight: 700, color: '#09b1ba' }}>👕 {stats.vinted}</div>
-              <div style={{ fontSize: 12, color: '#666' }}>Vinted</div>
+              <div style={{ fontSize: 24, fontWeight: 700, color: '#09b1ba' }}>👕 {stats.vinted?.count ?? 0}</div>
+              <div style={{ fontSize: 12, color: '#666' }}>Vinted{stats.vinted?.status && stats.vinted.status !== 'ok' ? ` (${stats.vinted.status})` : ''}</div>
             </div>
             <div style={statBoxStyle}>
-              <div style={{ fontSize: 24, fontWeight: 700, color: '#ff6f00' }}>🎨 {stats.catawiki}</div>
-              <div style={{ fontSize: 12, color: '#666' }}>Catawiki</div>
+              <div style={{ fontSize: 24, fontWeight: 700, color: '#ff6f00' }}>🎨 {stats.catawiki?.count ?? 0}</div>
+              <div style={{ fontSize: 12, color: '#666' }}>Catawiki{stats.catawiki?.status && stats.catawiki.status !== 'ok' ? ` (${stats.catawiki.status})` : ''}</div>
             </div>
           </div>
         </div>
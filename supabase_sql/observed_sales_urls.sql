@@ -0,0 +1,8 @@
+-- Una venta observada por (usuario, plataforma, url): la ingesta hace upsert ignorando duplicados
+delete from public.observed_sales a
+  using public.observed_sales b
+  where a.user_id = b.user_id and a.platform = b.platform and a.url = b.url and a.id > b.id;
+
+drop index if exists public.observed_sales_user_url_idx;
+create unique index if not exists observed_sales_user_platform_url_key
+  on public.observed_sales (user_id, platform, url);
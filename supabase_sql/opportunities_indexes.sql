@@ -0,0 +1,6 @@
+-- Índices para leer oportunidades filtradas y ordenadas con paginación por cursor (keyset)
+create index if not exists opportunities_user_score_idx on public.opportunities (user_id, total_score desc, id desc);
+create index if not exists opportunities_user_margin_idx on public.opportunities (user_id, net_margin desc, id desc);
+create index if not exists opportunities_user_roi_idx on public.opportunities (user_id, roi desc, id desc);
+create index if not exists opportunities_user_sell_score_idx on public.opportunities (user_id, sell_platform, total_score desc, id desc);
+create index if not exists listings_user_platform_category_idx on public.listings (user_id, platform, category);
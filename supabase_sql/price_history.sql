@@ -0,0 +1,35 @@
+-- Historial compacto de ventas observadas: una fila por producto, plataforma y demo con los cubos
+-- (dia o semana) en arrays paralelos. Las ventas antiguas se pliegan aqui desde observed_sales
+create table if not exists public.price_history (
+  user_id uuid not null references auth.users(id) on delete cascade,
+  product_id uuid not null,
+  platform text not null,
+  is_demo boolean not null default false,
+  days int[] not null default '{}',
+  counts int[] not null default '{}',
+  mins double precision[] not null default '{}',
+  medians double precision[] not null default '{}',
+  maxs double precision[] not null default '{}',
+  compacted_through int not null default 0,
+  primary key (user_id, product_id, platform, is_demo)
+);
+
+create index if not exists observed_sales_user_sold_at_idx on public.observed_sales (user_id, sold_at);
+
+-- Ventas aun sin compactar agregadas por dia, para la velocidad y la tendencia sin leer cada venta
+create or replace view public.observed_sales_daily with (security_invoker = true) as
+select
+  user_id, product_id, platform, is_demo, sold_at,
+  count(*) as sales,
+  min(sold_price) as low,
+  percentile_cont(0.5) within group (order by sold_price) as median,
+  max(sold_price) as high
+from public.observed_sales
+where product_id is not null
+group by user_id, product_id, platform, is_demo, sold_at;
+
+alter table public.price_history enable row level security;
+
+drop policy if exists "price_history_owner" on public.price_history;
+create policy "price_history_owner" on public.price_history
+  for all using (auth.uid() = user_id) with check (auth.uid() = user_id);
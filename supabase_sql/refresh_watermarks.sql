@@ -0,0 +1,21 @@
+-- Punto hasta el que cada usuario tiene las oportunidades recalculadas (refresh incremental)
+create table if not exists public.refresh_watermarks (
+  user_id uuid primary key references auth.users(id) on delete cascade,
+  config_version text not null,
+  listings_imported_at timestamptz,
+  listings_boundary_ids uuid[] not null default '{}',
+  sales_sold_at date,
+  sales_boundary_ids uuid[] not null default '{}',
+  updated_at timestamptz not null default now()
+);
+
+alter table public.refresh_watermarks add column if not exists listings_boundary_ids uuid[] not null default '{}';
+
+create index if not exists listings_user_imported_idx on public.listings (user_id, imported_at);
+create index if not exists observed_sales_user_sold_idx on public.observed_sales (user_id, sold_at);
+
+alter table public.refresh_watermarks enable row level security;
+
+drop policy if exists "refresh_watermarks_owner" on public.refresh_watermarks;
+create policy "refresh_watermarks_owner" on public.refresh_watermarks
+  for select using (auth.uid() = user_id);
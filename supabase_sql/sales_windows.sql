@@ -0,0 +1,16 @@
+-- Ventas observadas numeradas de la mas reciente a la mas antigua por producto y plataforma, con y sin
+-- demo, para que el backend lea solo la ventana de las ultimas N ventas y el total sin traer el historial
+create or replace view public.observed_sales_ranked with (security_invoker = true) as
+select
+  id, user_id, product_id, platform, sold_price, sold_at, is_demo,
+  row_number() over (partition by user_id, product_id, platform order by sold_at desc, id) as rank_all,
+  count(*) over (partition by user_id, product_id, platform) as count_all,
+  case when not is_demo then
+    row_number() over (partition by user_id, product_id, platform, is_demo order by sold_at desc, id)
+  end as rank_real,
+  count(*) filter (where not is_demo) over (partition by user_id, product_id, platform) as count_real
+from public.observed_sales
+where product_id is not null;
+
+create index if not exists observed_sales_user_product_sold_idx
+  on public.observed_sales (user_id, product_id, platform, sold_at desc, id);
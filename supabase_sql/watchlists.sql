@@ -0,0 +1,27 @@
+-- Busquedas guardadas que el planificador del backend ejecuta periodicamente
+create table if not exists public.watchlists (
+  id uuid primary key default gen_random_uuid(),
+  user_id uuid not null references auth.users(id) on delete cascade,
+  keywords text[] not null,
+  platforms_buy text[] not null default array['wallapop','vinted'],
+  platforms_sell text[] not null default array['ebay'],
+  max_results int not null default 20,
+  interval_minutes int not null default 60,
+  min_roi numeric,
+  min_net_margin numeric,
+  is_active boolean not null default true,
+  runs int not null default 0,
+  hits int not null default 0,
+  last_run_at timestamptz,
+  last_status jsonb,
+  last_error text,
+  created_at timestamptz not null default now()
+);
+
+create index if not exists watchlists_active_idx on public.watchlists (is_active, last_run_at);
+
+alter table public.watchlists enable row level security;
+
+drop policy if exists "watchlists_owner" on public.watchlists;
+create policy "watchlists_owner" on public.watchlists
+  for all using (auth.uid() = user_id) with check (auth.uid() = user_id);